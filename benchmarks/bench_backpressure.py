@@ -0,0 +1,98 @@
+"""
+Refilling qin: the old fixed-sleep polling versus wait_below() on the
+Manager-served BatchQueue.
+
+--workers processes drain qin in blocks of --block, each block "fetched"
+in --fetch-ms. A queue_in_srv style producer with unlimited work keeps
+qin between the low and high water marks. Reports the throughput, the
+time qin sat empty (as put_many() measures it) and the producer calls.
+
+    PYTHONPATH=. python benchmarks/bench_backpressure.py --seconds 5
+"""
+import argparse
+import multiprocessing as mp
+import time
+from queue import Empty
+
+from ispider_core.crawlers.cls_queue_transport import QueueManager
+
+
+def _req(i):
+    return (f"https://domain{i % 1000}.com/{i}", 'internal_url', f"domain{i % 1000}.com", 0, 1, 'httpx')
+
+
+def worker(qin, block, fetch_ms, stop_at, done):
+    n = 0
+    while time.time() < stop_at:
+        try:
+            n += len(qin.get_many(block, timeout=0.1))
+        except Empty:
+            continue
+        time.sleep(fetch_ms / 1000)
+    done.put(n)
+
+
+def producer(qin, high, low, mode, stop_at):
+    i = calls = 0
+    starved = 0
+    size = 0
+    while time.time() < stop_at:
+        if mode == 'poll':
+            # Previous loop: check the size, sleep if above the mark
+            calls += 1
+            if qin.qsize() >= high:
+                time.sleep(.5)
+                continue
+            size = qin.qsize()
+            calls += 1
+        elif size >= low:
+            calls += 1
+            size = qin.wait_below(low, timeout=1)
+            if size >= low:
+                continue
+
+        n = high - size
+        starved += qin.put_many([_req(i + k) for k in range(n)])
+        calls += 1
+        size += n
+        i += n
+    return starved, calls
+
+
+def run(mode, args):
+    manager = QueueManager()
+    manager.start()
+    try:
+        qin = manager.BatchQueue()
+        done = mp.Queue()
+        stop_at = time.time() + args.seconds
+        procs = [mp.Process(target=worker, args=(qin, args.block, args.fetch_ms, stop_at, done))
+                 for _ in range(args.workers)]
+        for p in procs:
+            p.start()
+        starved, calls = producer(qin, args.high, args.high // 2, mode, stop_at)
+        fetched = sum(done.get() for _ in procs)
+        for p in procs:
+            p.join()
+    finally:
+        manager.shutdown()
+
+    print(f"{mode:>5}: {fetched / args.seconds:9.0f} req/s - qin empty {starved:5.2f}s "
+          f"- producer calls {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--block', type=int, default=100)
+    parser.add_argument('--fetch-ms', type=float, default=20)
+    parser.add_argument('--high', type=int, default=2000)
+    args = parser.parse_args()
+
+    for mode in ('poll', 'event'):
+        run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
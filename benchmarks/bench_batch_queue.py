@@ -0,0 +1,90 @@
+"""
+Sitemap-heavy crawl through the Manager queues: one put/get per link
+versus put_many/get_many per block.
+
+A worker puts every link of --sitemaps sitemaps (--links each) into qout,
+queue_in_srv style consumer moves them to qin in blocks, then the worker
+side drains qin in ASYNC_BLOCK_SIZE blocks.
+
+    PYTHONPATH=. python benchmarks/bench_batch_queue.py --sitemaps 4 --links 50000
+"""
+import argparse
+import multiprocessing as mp
+import time
+from queue import Empty
+
+from ispider_core.crawlers.cls_queue_transport import QueueManager
+
+
+def sitemap_worker(qout, sitemaps, links, batched):
+    for s in range(sitemaps):
+        reqs = [(f"https://domain.com/post/{s}/{i}", 'internal_url', 'domain.com', 0, 2, 'httpx') for i in range(links)]
+        if batched:
+            qout.put_many(reqs)
+        else:
+            for reqA in reqs:
+                qout.put(reqA)
+
+
+def mover(qout, qin, total, block, batched):
+    moved = 0
+    while moved < total:
+        if batched:
+            reqs = qout.get_many(block, timeout=5)
+            qin.put_many(reqs)
+            moved += len(reqs)
+        else:
+            qin.put(qout.get(timeout=5))
+            moved += 1
+
+
+def drainer(qin, total, block, batched):
+    got = 0
+    while got < total:
+        try:
+            if batched:
+                got += len(qin.get_many(block, timeout=5))
+            else:
+                qin.get(timeout=5)
+                got += 1
+        except Empty:
+            break
+
+
+def run(manager, args, batched):
+    qout = manager.BatchQueue()
+    qin = manager.BatchQueue()
+    total = args.sitemaps * args.links
+
+    procs = [
+        mp.Process(target=sitemap_worker, args=(qout, args.sitemaps, args.links, batched)),
+        mp.Process(target=mover, args=(qout, qin, total, 5000, batched)),
+        mp.Process(target=drainer, args=(qin, total, args.async_block_size, batched)),
+    ]
+    t0 = time.time()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return total, time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sitemaps', type=int, default=4)
+    parser.add_argument('--links', type=int, default=50000)
+    parser.add_argument('--async-block-size', type=int, default=32)
+    args = parser.parse_args()
+
+    with QueueManager() as manager:
+        results = {}
+        for batched in [False, True]:
+            total, elapsed = run(manager, args, batched)
+            results[batched] = elapsed
+            label = 'put_many/get_many' if batched else 'put/get'
+            print(f"{label:18s} {total} links in {elapsed:.2f}s -> {total / elapsed:,.0f} links/s")
+        print(f"Speedup: {results[False] / results[True]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
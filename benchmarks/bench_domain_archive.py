@@ -0,0 +1,69 @@
+"""
+Memory of the domain stats through a crawl of --domains domains done
+--wave at a time, with and without the domain archive: resident memory of
+the Manager process (Linux /proc), the archive moving the finished
+domains after each wave, and the time serialize() takes at the end.
+
+    PYTHONPATH=. python benchmarks/bench_domain_archive.py --domains 200000
+"""
+import argparse
+import logging
+import multiprocessing as mp
+import tempfile
+import time
+from pathlib import Path
+
+from ispider_core.crawlers.cls_domain_archive import DomainArchive
+from ispider_core.crawlers.cls_domain_stats import SharedDomainStats
+
+
+def rss_mb(pid):
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def run(name, archive, args):
+    with mp.Manager() as manager:
+        stats = SharedDomainStats(manager, logging.getLogger('bench'), manager.Lock())
+        stats.archive = archive
+        pid = manager._process.pid
+        start = rss_mb(pid)
+        t0 = time.perf_counter()
+        for w in range(0, args.domains, args.wave):
+            doms = [f"www.domain-{i}.com" for i in range(w, min(w + args.wave, args.domains))]
+            for dom in doms:
+                stats.filter_and_add_links(dom, ['a', 'b', 'c'], 100)
+                for _ in range(3):
+                    stats.reduce_missing(dom)
+            stats.apply_stats([{"dom_tld": dom, "key": "bytes", "value": 30000} for dom in doms])
+            # Two passes: domains are moved once found finished twice
+            stats.archive_finished()
+            stats.archive_finished()
+        took = time.perf_counter() - t0
+        peak = rss_mb(pid)
+
+        t0 = time.perf_counter()
+        state = stats.serialize()
+        serialize = time.perf_counter() - t0
+        assert len(state['dom_missing']) == args.domains
+        print(f"{name:>10}: manager RSS {peak - start:7.1f} MB over start - "
+              f"crawl {took:.1f}s - serialize {serialize:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domains', type=int, default=200_000)
+    parser.add_argument('--wave', type=int, default=20_000)
+    args = parser.parse_args()
+
+    run('in memory', None, args)
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = DomainArchive(Path(tmp) / 'archive.sqlite')
+        run('archive', archive, args)
+        archive.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Domain counters on Manager dicts (SharedDomainStats) versus shared-memory
+arrays (ShmDomainStats), with --domains domains: time to add them, then
+--workers processes doing the per-response updates of a crawl
+(filter_and_add_links, add_missing_total, reduce_missing) on random
+domains, then the backlog summary and the full scans of thread_stats
+and SaveState.
+
+    PYTHONPATH=. python benchmarks/bench_domain_stats.py --domains 100000
+"""
+import argparse
+import logging
+import multiprocessing as mp
+import random
+import time
+
+from ispider_core.crawlers.cls_domain_stats import SharedDomainStats, ShmDomainStats
+
+
+def _work(stats, domains, ops, seed, out):
+    rnd = random.Random(seed)
+    t0 = time.perf_counter()
+    for _ in range(ops):
+        dom_tld = f"d{rnd.randrange(domains)}.com"
+        stats.filter_and_add_links(dom_tld, ['a', 'b'], 5000)
+        stats.add_missing_total(dom_tld)
+        stats.reduce_missing(dom_tld)
+    out.put(time.perf_counter() - t0)
+
+
+def run(name, stats, args):
+    t0 = time.perf_counter()
+    for i in range(args.domains):
+        stats.add_domain(f"d{i}.com")
+    added = time.perf_counter() - t0
+
+    out = mp.Queue()
+    procs = [mp.Process(target=_work, args=(stats, args.domains, args.ops, seed, out))
+             for seed in range(args.workers)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    took = time.perf_counter() - t0
+    ops = 3 * args.ops * args.workers
+
+    t0 = time.perf_counter()
+    stats.get_finished_domains()
+    stats.get_sorted_missing()
+    stats.serialize()
+    scans = time.perf_counter() - t0
+
+    # What thread_stats reads on each round, once the names are cached
+    t0 = time.perf_counter()
+    stats.backlog_summary(k=20)
+    summary = time.perf_counter() - t0
+
+    print(f"{name:>7}: add {args.domains / added:8.0f} domains/s - "
+          f"{args.workers} workers {ops / took:8.0f} updates/s - "
+          f"backlog summary {summary * 1000:.1f}ms - scans {scans:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domains', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=5000)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench')
+    with mp.Manager() as manager:
+        run('manager', SharedDomainStats(manager, logger, manager.Lock()), args)
+        stats = ShmDomainStats(manager, logger, manager.Lock())
+        try:
+            run('shm', stats, args)
+        finally:
+            stats.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Saving the queues state: drain, pickle and put back every item (previous
+SaveState) versus a FrontierJournal checkpoint of the Manager-served
+BatchQueue, after --delta operations since the last checkpoint.
+
+    PYTHONPATH=. python benchmarks/bench_journal.py --items 200000 --delta 5000
+"""
+import argparse
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+from ispider_core.crawlers.cls_queue_transport import QueueManager
+
+
+def _req(i):
+    return (f"https://domain{i % 1000}.com/post/{i}", 'internal_url', f"domain{i % 1000}.com", 0, 2, 'httpx')
+
+
+def drain_and_pickle(q, path):
+    items = []
+    while not q.empty():
+        items.append(q.get())
+    with open(path, 'wb') as f:
+        pickle.dump(items, f)
+    for itm in items:
+        q.put(itm)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=200_000)
+    parser.add_argument('--delta', type=int, default=5000)
+    args = parser.parse_args()
+
+    manager = QueueManager()
+    manager.start()
+    tmp = Path(tempfile.mkdtemp())
+    try:
+        plain = manager.BatchQueue()
+        journaled = manager.BatchQueue(journal_dir=tmp / 'journal')
+        for q in (plain, journaled):
+            for i in range(0, args.items, 10000):
+                q.put_many([_req(j) for j in range(i, min(i + 10000, args.items))])
+        journaled.checkpoint()
+
+        for q in (plain, journaled):
+            q.get_many(args.delta // 2)
+            q.put_many([_req(args.items + j) for j in range(args.delta // 2)])
+
+        t0 = time.perf_counter()
+        drain_and_pickle(plain, tmp / 'qout.pkl')
+        t_drain = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        journaled.checkpoint()
+        t_journal = time.perf_counter() - t0
+    finally:
+        manager.shutdown()
+
+    print(f"{args.items} queued, {args.delta} ops since the last save")
+    print(f"drain + pickle: {t_drain:8.3f}s")
+    print(f"journal checkpoint: {t_journal:8.3f}s ({t_drain / t_journal:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
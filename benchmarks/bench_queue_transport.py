@@ -0,0 +1,67 @@
+"""
+Requests/sec through the crawl queues: Manager queue vs shared-memory ring.
+
+    PYTHONPATH=. python benchmarks/bench_queue_transport.py --producers 4 --consumers 4 --items 50000
+"""
+import argparse
+import multiprocessing as mp
+import time
+from queue import Empty
+
+from ispider_core.crawlers import cls_queue_transport
+
+
+def producer(q, n, idx):
+    for i in range(n):
+        q.put((f"https://www.domain{idx}.com/some/path/{i}", 'internal_url', f"domain{idx}.com", 0, 2, 'httpx'))
+
+
+def consumer(q, counter):
+    got = 0
+    while True:
+        try:
+            q.get(timeout=2)
+        except Empty:
+            break
+        got += 1
+    with counter.get_lock():
+        counter.value += got
+
+
+def run(transport, manager, args):
+    conf = {'QUEUE_TRANSPORT': transport}
+    q = cls_queue_transport.build_queue(conf, manager, maxsize=args.maxsize)
+    counter = mp.Value('q', 0)
+
+    procs = [mp.Process(target=producer, args=(q, args.items, i)) for i in range(args.producers)]
+    procs += [mp.Process(target=consumer, args=(q, counter)) for _ in range(args.consumers)]
+
+    t0 = time.time()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    # Consumers leave after 2 idle seconds
+    elapsed = time.time() - t0 - 2
+
+    if isinstance(q, cls_queue_transport.ShmRingQueue):
+        q.close()
+    return counter.value, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--consumers', type=int, default=4)
+    parser.add_argument('--items', type=int, default=20000, help="Items per producer")
+    parser.add_argument('--maxsize', type=int, default=100000)
+    args = parser.parse_args()
+
+    with cls_queue_transport.QueueManager() as manager:
+        for transport in ['manager', 'shm']:
+            count, elapsed = run(transport, manager, args)
+            print(f"{transport:8s} {count} requests in {elapsed:.2f}s -> {count / elapsed:,.0f} req/s")
+
+
+if __name__ == '__main__':
+    main()
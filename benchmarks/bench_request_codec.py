@@ -0,0 +1,56 @@
+"""
+Request tuples through the shm ring, pickled versus encoded with
+RequestCodec (domain id, discriminator and engine ids, url): bytes per
+request and put_many/get_many throughput, --requests requests spread
+over --domains domains.
+
+    PYTHONPATH=. python benchmarks/bench_request_codec.py --requests 200000
+"""
+import argparse
+import multiprocessing as mp
+import pickle
+import random
+import time
+
+from ispider_core.crawlers.cls_queue_transport import ShmRingQueue
+from ispider_core.utils.interning import InternTable, RequestCodec
+
+
+def run(name, codec, reqs, args):
+    size = sum(len(codec.dumps(r) if codec else pickle.dumps(r, protocol=pickle.HIGHEST_PROTOCOL)) for r in reqs)
+    q = ShmRingQueue(capacity=256 * 1024 * 1024, codec=codec)
+    try:
+        t0 = time.perf_counter()
+        for k in range(0, len(reqs), args.batch):
+            q.put_many(reqs[k:k + args.batch])
+        put = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        while not q.empty():
+            q.get_many(args.batch)
+        got = time.perf_counter() - t0
+    finally:
+        q.close()
+    print(f"{name:>7}: {size / len(reqs):6.1f} bytes/request - "
+          f"put {len(reqs) / put:8.0f}/s - get {len(reqs) / got:8.0f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200_000)
+    parser.add_argument('--domains', type=int, default=10_000)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    reqs = []
+    for i in range(args.requests):
+        dom_tld = f"domain-{rnd.randrange(args.domains)}.com"
+        reqs.append((f"https://www.{dom_tld}/section/page-{i}.html", 'internal_url', dom_tld, 0, 2, 'httpx'))
+
+    with mp.Manager() as manager:
+        run('pickle', None, reqs, args)
+        run('codec', RequestCodec(InternTable(manager)), reqs, args)
+
+
+if __name__ == '__main__':
+    main()
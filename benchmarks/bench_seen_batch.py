@@ -0,0 +1,77 @@
+"""
+Seen filter lookups one request at a time (req_in_seen) versus whole
+blocks (filter_unseen), on a filter starting at --capacity and grown to
+hold --items requests, for both the process-local SeenFilter and SharedSeenFilter. Half of the
+looked up requests are in the filter.
+
+    PYTHONPATH=. python benchmarks/bench_seen_batch.py --items 10000000
+"""
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from ispider_core.crawlers.cls_seen_filter import SeenFilter, SharedSeenFilter
+
+
+def _req(i):
+    return (f"https://domain{i % 1000}.com/post/{i}", 'internal_url', f"domain{i % 1000}.com", 0, 2, 'httpx')
+
+
+def fill(seen_filter, items, block=100_000):
+    t0 = time.perf_counter()
+    for start in range(0, items, block):
+        seen_filter.mark_seen([_req(i) for i in range(start, min(items, start + block))])
+    return time.perf_counter() - t0
+
+
+def single(seen_filter, reqs):
+    t0 = time.perf_counter()
+    unseen = [reqA for reqA in reqs if not seen_filter.req_in_seen(reqA)]
+    return time.perf_counter() - t0, len(unseen)
+
+
+def batched(seen_filter, reqs, block):
+    t0 = time.perf_counter()
+    unseen = 0
+    for i in range(0, len(reqs), block):
+        unseen += len(seen_filter.filter_unseen(reqs[i:i + block]))
+    return time.perf_counter() - t0, unseen
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10_000_000)
+    parser.add_argument('--capacity', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--block', type=int, default=1000)
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    (tmp / 'dumps').mkdir()
+    conf = {'USER_FOLDER': tmp, 'LOG_LEVEL': 'WARNING', 'path_dumps': tmp / 'dumps'}
+
+    # Half in the filter, half never added
+    reqs = [_req(i) for i in range(args.items - args.lookups // 2, args.items + args.lookups // 2)]
+
+    for name, seen_filter in (
+            ('local', SeenFilter(conf, threading.Lock(), capacity=args.capacity)),
+            ('shm', SharedSeenFilter(conf, capacity=args.capacity))):
+        took = fill(seen_filter, args.items)
+        stats = seen_filter.stats()
+        print(f"{name:>5}: filled with {stats['items']} items in {took:.1f}s - {stats['stages']} stages, "
+              f"est. FP rate {stats['fp_rate']:.2e}, {stats['bytes'] / 2**20:.1f} MB")
+
+        t_single, n_single = single(seen_filter, reqs)
+        t_batch, n_batch = batched(seen_filter, reqs, args.block)
+        assert n_single == n_batch
+        print(f"{name:>5}: single {len(reqs) / t_single:9.0f} lookups/s - "
+              f"blocks of {args.block} {len(reqs) / t_batch:9.0f} lookups/s - "
+              f"{n_batch} unseen")
+        if isinstance(seen_filter, SharedSeenFilter):
+            seen_filter.close()
+
+
+if __name__ == '__main__':
+    main()
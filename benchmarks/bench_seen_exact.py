@@ -0,0 +1,70 @@
+"""
+Seen filter backends: the Bloom filter (SeenFilter) versus the exact
+fingerprint set (ExactSeenFilter), filled with --items requests. Reports
+RAM and disk used, fill and lookup throughput in blocks of --block (half
+of the looked up requests are in the set), and the requests wrongly
+reported as seen.
+
+    PYTHONPATH=. python benchmarks/bench_seen_exact.py --items 10000000
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from ispider_core.crawlers.cls_seen_filter import ExactSeenFilter, SeenFilter
+
+
+def _req(i):
+    return (f"https://domain{i % 1000}.com/post/{i}", 'internal_url', f"domain{i % 1000}.com", 0, 2, 'httpx')
+
+
+def fill(seen_filter, items, block=100_000):
+    t0 = time.perf_counter()
+    for start in range(0, items, block):
+        seen_filter.mark_seen([_req(i) for i in range(start, min(items, start + block))])
+    return time.perf_counter() - t0
+
+
+def lookups(seen_filter, reqs, block):
+    t0 = time.perf_counter()
+    unseen = 0
+    for i in range(0, len(reqs), block):
+        unseen += len(seen_filter.filter_unseen(reqs[i:i + block]))
+    return time.perf_counter() - t0, unseen
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10_000_000)
+    parser.add_argument('--capacity', type=int, default=1_000_000)
+    parser.add_argument('--memory-items', type=int, default=4_000_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--block', type=int, default=1000)
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    (tmp / 'dumps').mkdir()
+    conf = {'USER_FOLDER': tmp, 'LOG_LEVEL': 'WARNING', 'path_dumps': tmp / 'dumps', 'path_data': tmp}
+
+    # Half in the set, half never added
+    reqs = [_req(i) for i in range(args.items - args.lookups // 2, args.items + args.lookups // 2)]
+    try:
+        for name, seen_filter in (
+                ('bloom', SeenFilter(conf, threading.Lock(), capacity=args.capacity)),
+                ('exact', ExactSeenFilter(conf, threading.Lock(), memory_items=args.memory_items))):
+            took = fill(seen_filter, args.items)
+            stats = seen_filter.stats()
+            t, unseen = lookups(seen_filter, reqs, args.block)
+            print(f"{name:>5}: {stats['items']} items filled in {took:.1f}s - "
+                  f"RAM {stats['bytes'] / 2**20:.1f} MB, disk {stats.get('disk_bytes', 0) / 2**20:.1f} MB - "
+                  f"blocks of {args.block} {len(reqs) / t:9.0f} lookups/s - "
+                  f"{args.lookups // 2 - unseen} wrongly seen")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Seen filter lookups: SeenFilter served by SeenFilterManager with a Manager
+lock (previous setup) versus SharedSeenFilter, whose bits live in shared
+memory.
+
+--procs processes call req_in_seen() for --seconds on a filter holding
+--items requests, half of the lookups hitting. Reports lookups per second.
+
+    PYTHONPATH=. python benchmarks/bench_seen_filter.py --procs 4 --seconds 3
+"""
+import argparse
+import multiprocessing as mp
+import tempfile
+import time
+from multiprocessing.managers import SyncManager
+from pathlib import Path
+
+from ispider_core.crawlers.cls_controllers import SeenFilterManager
+from ispider_core.crawlers.cls_seen_filter import SharedSeenFilter
+
+
+def _req(i):
+    return (f"https://domain{i % 1000}.com/post/{i}", 'internal_url', f"domain{i % 1000}.com", 0, 2, 'httpx')
+
+
+def lookups(seen_filter, items, stop_at, done):
+    n = 0
+    while time.time() < stop_at:
+        seen_filter.req_in_seen(_req(n % (2 * items)))
+        n += 1
+    done.put(n)
+
+
+def run(mode, seen_filter, args):
+    for i in range(args.items):
+        seen_filter.add_to_seen_req(_req(i))
+
+    done = mp.Queue()
+    stop_at = time.time() + args.seconds
+    procs = [mp.Process(target=lookups, args=(seen_filter, args.items, stop_at, done))
+             for _ in range(args.procs)]
+    for p in procs:
+        p.start()
+    total = sum(done.get() for _ in procs)
+    for p in procs:
+        p.join()
+    print(f"{mode:>7}: {total / args.seconds:10.0f} lookups/s with {args.procs} processes")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--procs', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--items', type=int, default=20_000)
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    (tmp / 'dumps').mkdir()
+    conf = {'USER_FOLDER': tmp, 'LOG_LEVEL': 'WARNING', 'path_dumps': tmp / 'dumps'}
+
+    locks = SyncManager()
+    locks.start()
+    manager = SeenFilterManager()
+    manager.start()
+    try:
+        run('manager', manager.SeenFilter(conf, locks.Lock()), args)
+    finally:
+        manager.shutdown()
+        locks.shutdown()
+
+    seen_filter = SharedSeenFilter(conf)
+    try:
+        run('shm', seen_filter, args)
+    finally:
+        seen_filter.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ from contextlib import asynccontextmanager
 from ispider_core.ispider import ISpider
 from ispider_core.config import Settings
 from ispider_core.utils.logger import LoggerFactory
+from ispider_core.utils.interning import DISCRIMINATORS, ENGINES
 
 
 """ Redirect all to /tmp/spider_log """
@@ -237,7 +238,8 @@ async def get_domains_list():
         return {"domains": []}
     
     dom_stats = spider_instance.shared_dom_stats
-    domains = list(dom_stats.dom_missing.keys())  # Correctly get domain list
+    # Archived (finished) domains included
+    domains = [dom for dom, _ in dom_stats.domain_rows()]
     return {"domains": domains}
 
 
@@ -249,38 +251,91 @@ async def get_domains():
         raise HTTPException(status_code=500, detail="Domain stats not available")
 
     status = {}
-    with dom_stats.lock:
-        for dom in dom_stats.dom_missing.keys():
-            missing_pages = dom_stats.dom_missing[dom]
-            total_pages = dom_stats.dom_total[dom]
-            try:
-                progress = round(((dom_stats.dom_total[dom]-dom_stats.dom_missing[dom])/dom_stats.dom_total[dom]), 2)
-            except:
-                progress = 0
-
-            status[dom] = {
-                "domain": dom,
-                "status": "Finished" if dom_stats.dom_missing[dom] == 0 else "Running",
-                "progress": progress,
-                "speed": 0,
-                "pagesFound": dom_stats.dom_total[dom],
-                "pagesDownloaded": dom_stats.dom_total[dom] - dom_stats.dom_missing[dom],
-                "hasRobot": dom_stats.local_stats[dom].get('has_robot', False),
-                "hasSitemaps": dom_stats.local_stats[dom].get('has_sitemaps', False),
-                
-                "lastCall": dom_stats.dom_last_call.get(dom).isoformat(timespec='seconds') + "Z" if dom_stats.dom_last_call.get(dom) else None,
-                "lastStatus": dom_stats.local_stats.get(dom, 0).get('last_status_code', 0),
-                
-                "bytes": dom_stats.local_stats[dom].get('bytes', 0),
-                "missing": dom_stats.dom_missing[dom],
-                "total": dom_stats.dom_total[dom],
-                "engine": dom_stats.dom_engine.get(dom),
-            }
+    for dom, row in dom_stats.domain_rows():
+        missing, total, stats = row['missing'], row['total'], row['local_stats']
+        try:
+            progress = round(((total - missing) / total), 2)
+        except ZeroDivisionError:
+            progress = 0
+
+        status[dom] = {
+            "domain": dom,
+            "status": "Finished" if missing == 0 else "Running",
+            "progress": progress,
+            "speed": 0,
+            "pagesFound": total,
+            "pagesDownloaded": total - missing,
+            "hasRobot": stats.get('has_robot', False),
+            "hasSitemaps": stats.get('has_sitemaps', False),
+
+            "lastCall": row['last_call'].isoformat(timespec='seconds') + "Z" if row['last_call'] else None,
+            "lastStatus": stats.get('last_status_code', 0),
+
+            "bytes": stats.get('bytes', 0),
+            "missing": missing,
+            "total": total,
+            "engine": row['engine'],
+        }
 
     return status
 
 
 
+@app.get("/spider/domains/events")
+async def get_domain_events(since: int = 0, limit: int = 10000):
+    """Domain completion events from position since, and the position to ask for next."""
+    global spider_instance
+    dom_stats = spider_instance.shared_dom_stats if spider_instance else None
+    if dom_stats is None:
+        raise HTTPException(status_code=500, detail="Domain stats not available")
+    if not hasattr(dom_stats, 'events'):
+        raise HTTPException(status_code=501, detail="Completion events need DOMAIN_STATS_TRANSPORT 'shm'")
+
+    events, next_pos = dom_stats.events(since, limit)
+    return {
+        "events": [
+            {"position": pos, "domain": dom, "event": kind, "target": target}
+            for pos, dom, kind, target in events
+        ],
+        "next": next_pos,
+    }
+
+
+@app.get("/spider/domains/summary")
+async def get_domain_summary(k: int = 20):
+    """The k largest domain backlogs and the histogram of all of them."""
+    global spider_instance
+    dom_stats = spider_instance.shared_dom_stats if spider_instance else None
+    if dom_stats is None:
+        raise HTTPException(status_code=500, detail="Domain stats not available")
+
+    summary = dom_stats.backlog_summary(k)
+    return {
+        "top": [{"domain": dom, "missing": missing} for dom, missing in summary['top']],
+        "histogram": [{"low": lo, "high": hi, "domains": n} for lo, hi, n in summary['histogram']],
+    }
+
+
+@app.get("/spider/ids")
+async def get_ids(start: int = 0, limit: int = 10000):
+    """
+    Names behind the ids of the compact requests and of the dom_id of the
+    JSON records: domains from id start, and the start to ask for next.
+    """
+    global spider_instance
+    dom_stats = spider_instance.shared_dom_stats if spider_instance else None
+    if dom_stats is None or dom_stats.domain_ids is None:
+        raise HTTPException(status_code=500, detail="Domain stats not available")
+
+    names = dom_stats.domain_ids.names(min(start + limit, len(dom_stats.domain_ids)))[start:]
+    return {
+        "discriminators": list(DISCRIMINATORS),
+        "engines": list(ENGINES),
+        "domains": [{"id": start + i, "domain": name} for i, name in enumerate(names)],
+        "next": start + len(names),
+    }
+
+
 @app.get("/spider/config/get", response_model=SpiderConfig)
 async def get_config():
     global spider_config
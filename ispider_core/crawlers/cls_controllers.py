@@ -2,23 +2,31 @@
 from ispider_core.utils.logger import LoggerFactory
 from ispider_core.utils import domains
 from ispider_core.utils import state_manager
+from ispider_core.utils import interning
 
 from ispider_core.crawlers import cls_queue_out
+from ispider_core.crawlers import cls_queue_transport
+from ispider_core.crawlers import cls_frontier
 from ispider_core.crawlers import cls_seen_filter
 from ispider_core.crawlers import cls_domain_stats
+from ispider_core.crawlers import cls_domain_archive
+from ispider_core.crawlers import cls_shards
+from ispider_core.crawlers import cls_counters
 from ispider_core.crawlers import thread_queue_in
 from ispider_core.crawlers import thread_stats
 from ispider_core.crawlers import thread_save_finished
 from ispider_core.crawlers import stage_unified
+from ispider_core.crawlers import stage_sharded
 
 from queue import LifoQueue
 import multiprocessing as mp
+import queue
 import time
-from itertools import repeat
 import threading
 
 import os
 import pickle
+from pathlib import Path
 
 from multiprocessing.managers import BaseManager
 
@@ -29,7 +37,12 @@ class SeenFilterManager(BaseManager):
     pass
     
 MyManager.register('LifoQueue', LifoQueue)
+MyManager.register('Frontier', cls_frontier.SpillingFrontier)
+MyManager.register('BatchQueue', cls_queue_transport.BatchQueue)
+MyManager.register('LeaseTable', cls_queue_transport.LeaseTable)
 SeenFilterManager.register('SeenFilter', cls_seen_filter.SeenFilter)
+SeenFilterManager.register('ExactSeenFilter', cls_seen_filter.ExactSeenFilter)
+SeenFilterManager.register('PartitionedSeenFilter', cls_seen_filter.PartitionedSeenFilter)
 
 
 class BaseCrawlController:
@@ -39,31 +52,96 @@ class BaseCrawlController:
         self.stage = 'unified'  # Fixed on unified
         self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
         self.dom_tld_finished = []
+        self.sharded = conf.get('EXECUTION_MODE', 'shared') == 'sharded'
         
         # Locks
         self.shared_lock = self.manager.Lock()
         self.shared_lock_driver = self.manager.Lock()
         self.shared_lock_seen_filter = self.manager.Lock()
 
-        self.seen_filter_manager = self._get_manager_seen_filter()
-        self.seen_filter = self.seen_filter_manager.SeenFilter(conf, self.shared_lock_seen_filter)
+        shared = conf.get('SEEN_FILTER_TRANSPORT', 'shm') == 'shm'
+        seen_filter_class = cls_seen_filter.seen_filter_class(conf, shared=shared)
+        if conf.get('SEEN_FILTER_BACKEND', 'bloom') == 'exact':
+            # Resumed crawls reload the set from the checkpoint
+            cls_seen_filter.ExactSeenFilter.clear(conf)
+        if shared:
+            self.seen_filter_manager = None
+            self.seen_filter = seen_filter_class(conf)
+        else:
+            self.seen_filter_manager = self._get_manager_seen_filter()
+            self.seen_filter = getattr(self.seen_filter_manager, seen_filter_class.__name__)(
+                conf, self.shared_lock_seen_filter)
 
         self.enqueue_thread = None
         self.shared_new_domains = self.manager.list()
         
         # Stats
-        self.shared_script_controller = self.manager.dict({'speedb': [], 'speedu': [], 'running_state': 1, 'bytes': 0, 'tot_counter': 0, 'landings': 0, 'robots': 0, 'sitemaps': 0, 'internal_urls': 0 })
+        self.shared_script_controller = self.manager.dict({'speedb': [], 'speedu': [], 'running_state': 1, 'bytes': 0, 'tot_counter': 0, 'landings': 0, 'robots': 0, 'sitemaps': 0, 'internal_urls': 0, 'canonical_saved': 0 })
 
         # Informations by domain
         self.shared_qstats = self.manager.Queue()
-        self.shared_dom_stats = cls_domain_stats.SharedDomainStats(
-            manager, self.logger, self.shared_lock, self.shared_qstats)
+        if conf.get('DOMAIN_STATS_TRANSPORT', 'shm') == 'shm':
+            self.shared_dom_stats = cls_domain_stats.ShmDomainStats(
+                manager, self.logger, self.shared_lock, self.shared_qstats,
+                stripes=conf.get('DOMAIN_STATS_LOCK_STRIPES', 64))
+        else:
+            self.shared_dom_stats = cls_domain_stats.SharedDomainStats(
+                manager, self.logger, self.shared_lock, self.shared_qstats)
+        # Shards keep their domains' stats themselves
+        if conf.get('DOMAIN_ARCHIVE_SEC', 60) and not self.sharded:
+            self.shared_dom_stats.archive = cls_domain_archive.DomainArchive(
+                conf.get('DOMAIN_ARCHIVE_PATH') or Path(conf['path_data']) / 'domain_archive.sqlite')
+            if not conf['RESUME']:
+                self.shared_dom_stats.archive.clear()
+        # Domain ids of the shm rings, the JSON records (dom_id) and /spider/ids
+        if self.shared_dom_stats.domain_ids is None:
+            self.shared_dom_stats.domain_ids = interning.InternTable(manager)
         
         self.lifo_manager = self._get_manager()
         self.queue_out_handler = None
 
-        self.shared_qin = self.manager.Queue(maxsize=conf['QUEUE_MAX_SIZE'])
-        self.shared_qout = self.manager.Queue()
+        # Newest checkpoint to resume from: journaled queues are replayed up to it
+        self.resume_checkpoint, self.resume_manifest = (
+            state_manager.latest_checkpoint(conf) if conf['RESUME'] else (None, None))
+
+        # Shm rings carry requests as domain ids plus the url
+        self.request_codec = None
+        if conf.get('QUEUE_SHM_COMPACT', True):
+            self.request_codec = interning.RequestCodec(self.shared_dom_stats.domain_ids)
+
+        # qin and qout are served by two different manager processes
+        self.qin_manager = self._get_manager()
+        self.shared_qin = cls_queue_transport.build_queue(
+            conf, self.qin_manager, maxsize=conf['QUEUE_MAX_SIZE'], name='qin',
+            resume=state_manager.journal_resume(conf, self.resume_manifest, 'qin'),
+            codec=self.request_codec)
+        qout_resume = state_manager.journal_resume(conf, self.resume_manifest, 'qout')
+        shm = conf.get('QUEUE_TRANSPORT', 'manager') == 'shm'
+        self.frontier = None
+        if conf.get('FRONTIER_MEMORY_ITEMS'):
+            if shm:
+                # Rings have no journal: the frontier only takes what the ring can't
+                self.frontier = self.lifo_manager.Frontier({**conf, 'FRONTIER_JOURNAL': False}, False)
+            else:
+                self.frontier = self.lifo_manager.Frontier(conf, qout_resume)
+        if shm:
+            # Workers never block on a full qout ring: the excess waits there
+            overflow = self.frontier
+            if overflow is None:
+                overflow = self.lifo_manager.BatchQueue(
+                    priorities=conf.get('QUEUE_PRIORITIES'),
+                    by_depth=conf.get('QUEUE_PRIORITY_BY_DEPTH', True))
+            self.shared_qout = cls_queue_transport.build_queue(
+                conf, self.lifo_manager, capacity=conf.get('QUEUE_SHM_QOUT_BYTES'), name='qout',
+                resume=qout_resume, codec=self.request_codec, overflow=overflow)
+            self.logger.info("qout: shm ring, spilling to the "
+                             f"{'disk frontier' if self.frontier is not None else 'Manager queue'} when full")
+        elif self.frontier is not None:
+            self.shared_qout = self.frontier
+            self.logger.info(f"qout: frontier, {conf['FRONTIER_MEMORY_ITEMS']} requests in memory, the rest on disk")
+        else:
+            self.shared_qout = cls_queue_transport.build_queue(
+                conf, self.lifo_manager, name='qout', resume=qout_resume)
         # self.shared_qout = self.lifo_manager.LifoQueue()
 
         # self.shared_qout = mp.Queue()
@@ -71,6 +149,18 @@ class BaseCrawlController:
 
         self.resume_state = state_manager.ResumeState(self.conf, self)
         self.save_state = state_manager.SaveState(self.conf, self)
+        if not conf['RESUME']:
+            self.save_state.clear_checkpoints()
+        self.checkpoint_thread = None
+        self.release_thread = None
+        self.archive_thread = None
+
+        # Worker reports (counters, shard state); sharded mode: one inbox per worker
+        self.shard_inboxes = []
+        self.shared_progress = None
+        self.shard_pending = {}
+        self.progress_thread = None
+        self.flush_thread = None
 
         self.processes = []
 
@@ -140,6 +230,104 @@ class BaseCrawlController:
             logger.warning("Keyboard Interrupt received. Closing the flush stats manager")
 
 
+    def checkpoint_loop(self):
+        interval = self.conf.get('CHECKPOINT_INTERVAL_SEC')
+        t0 = time.time()
+        try:
+            while self.shared_script_controller['running_state']:
+                time.sleep(1)
+                # Only once crawlers run (state 9), the shutdown writes the last one
+                if self.shared_script_controller['running_state'] == 1 or time.time() - t0 < interval:
+                    continue
+                t0 = time.time()
+                try:
+                    self.save_state.checkpoint('periodic')
+                except EOFError:
+                    self.logger.warning(f"checkpoint_loop closed by EOF")
+                    break
+                except Exception as e:
+                    self.logger.warning(f"Failed to write checkpoint: {e}")
+            self.logger.info("Closing checkpoint_loop")
+        except KeyboardInterrupt:
+            self.logger.warning("Keyboard Interrupt received. Closing the checkpoint thread")
+
+    def release_seen_loop(self):
+        """Free the seen filter partitions of the domains finished since the last pass."""
+        interval = self.conf.get('SEEN_RELEASE_SEC', 60)
+        released = set()
+        t0 = time.time()
+        try:
+            while self.shared_script_controller['running_state']:
+                time.sleep(1)
+                if time.time() - t0 < interval:
+                    continue
+                t0 = time.time()
+                try:
+                    finished = set(self.shared_dom_stats.get_finished_domains()) - released
+                    if finished:
+                        n = self.seen_filter.release(list(finished))
+                        released |= finished
+                        self.logger.debug(f"Seen filter: released {n} finished domains")
+                except EOFError:
+                    self.logger.warning(f"release_seen_loop closed by EOF")
+                    break
+                except Exception as e:
+                    self.logger.warning(f"Failed to release finished domains: {e}")
+            self.logger.info("Closing release_seen_loop")
+        except KeyboardInterrupt:
+            self.logger.warning("Keyboard Interrupt received. Closing the seen release thread")
+
+    def archive_domains_loop(self):
+        """Move the finished domains to the domain archive."""
+        interval = self.conf.get('DOMAIN_ARCHIVE_SEC', 60)
+        t0 = time.time()
+        try:
+            while self.shared_script_controller['running_state']:
+                time.sleep(1)
+                if time.time() - t0 < interval:
+                    continue
+                t0 = time.time()
+                try:
+                    n = self.shared_dom_stats.archive_finished()
+                    if n:
+                        self.logger.info(f"Domain archive: moved {n} finished domains "
+                                         f"in {time.time() - t0:.2f}s")
+                except EOFError:
+                    self.logger.warning(f"archive_domains_loop closed by EOF")
+                    break
+                except Exception as e:
+                    self.logger.warning(f"Failed to archive finished domains: {e}")
+            self.logger.info("Closing archive_domains_loop")
+        except KeyboardInterrupt:
+            self.logger.warning("Keyboard Interrupt received. Closing the domain archive thread")
+
+    def collect_progress_loop(self):
+        """Merge the worker counters and, in sharded mode, the shard reports."""
+        try:
+            while self.shared_script_controller['running_state']:
+                try:
+                    self._apply_progress(self.shared_progress.get(timeout=1))
+                except queue.Empty:
+                    continue
+                except EOFError:
+                    self.logger.warning(f"collect_progress_loop closed by EOF")
+                    break
+                except Exception as e:
+                    self.logger.warning(f"Failed to apply progress report: {e}")
+            self.logger.info("Closing collect_progress_loop")
+        except KeyboardInterrupt:
+            self.logger.warning("Keyboard Interrupt received. Closing the shard progress collector")
+
+    def _apply_progress(self, report):
+        if not self.sharded:
+            cls_counters.apply_counters(report, self.shared_script_controller, self.shared_lock)
+            self.shared_dom_stats.apply_stats(report.get('stats', ()))
+            return
+        cls_shards.apply_report(
+            report, self.shared_dom_stats, self.shared_script_controller, self.shared_lock)
+        self.shard_pending[report['mod']] = report['pending']
+        self.shared_script_controller['shard_pending'] = sum(self.shard_pending.values())
+
     def _get_manager_seen_filter(self):
         m = SeenFilterManager()
         m.start()
@@ -158,17 +346,19 @@ class BaseCrawlController:
 
 
     def _start_threads(self):
-        self.logger.debug("Starting queue input thread...")
-        self.processes.append(mp.Process(
-            target=thread_queue_in.queue_in_srv, 
-            args=(
-                self.shared_script_controller, 
-                self.shared_dom_stats, 
-                self.seen_filter, 
-                self.conf,
-                self.shared_qin, 
-                self.shared_qout, 
-            )))
+        if not self.sharded:
+            # Shards schedule their own domains
+            self.logger.debug("Starting queue input thread...")
+            self.processes.append(mp.Process(
+                target=thread_queue_in.queue_in_srv, 
+                args=(
+                    self.shared_script_controller, 
+                    self.shared_dom_stats, 
+                    self.seen_filter, 
+                    self.conf,
+                    self.shared_qin, 
+                    self.shared_qout, 
+                )))
 
         self.logger.debug("Starting stats thread...")
         self.processes.append(mp.Process(
@@ -204,24 +394,139 @@ class BaseCrawlController:
         )
         self.flush_thread.start()
 
+        self.logger.debug("Starting progress thread (threading)...")
+        self.progress_thread = threading.Thread(
+            target=self.collect_progress_loop,
+            daemon=True
+        )
+        self.progress_thread.start()
+
+        # Shards hold their requests until shutdown: only that save is complete
+        if self.conf.get('CHECKPOINT_INTERVAL_SEC') and not self.sharded:
+            self.logger.debug("Starting checkpoint thread (threading)...")
+            self.checkpoint_thread = threading.Thread(
+                target=self.checkpoint_loop,
+                daemon=True
+            )
+            self.checkpoint_thread.start()
+
+        # Shards release the partitions of their own domains
+        if self.conf.get('SEEN_FILTER_BACKEND', 'bloom') == 'partitioned' and not self.sharded:
+            self.logger.debug("Starting seen release thread (threading)...")
+            self.release_thread = threading.Thread(
+                target=self.release_seen_loop,
+                daemon=True
+            )
+            self.release_thread.start()
+
+        if self.shared_dom_stats.archive is not None:
+            self.logger.debug("Starting domain archive thread (threading)...")
+            self.archive_thread = threading.Thread(
+                target=self.archive_domains_loop,
+                daemon=True
+            )
+            self.archive_thread.start()
+
     def _start_crawlers(self, exclusion_list, crawl_func):
+        # Plain processes instead of a Pool: the queue transports may hold
+        # multiprocessing locks, which can only be passed by inheritance.
         self.logger.debug("Initializing crawler pools...")
-        procs = list(range(0, self.conf['POOLS']))
-        with mp.Pool(self.conf['POOLS']) as pool:
-            pool.starmap(
-                crawl_func,
-                zip(
-                    procs,
-                    repeat(self.conf),
-                    repeat(exclusion_list),
-                    repeat(self.seen_filter),
-                    repeat(self.shared_lock),
-                    repeat(self.shared_lock_driver),
-                    repeat(self.shared_script_controller),
-                    repeat(self.shared_dom_stats),
-                    repeat(self.shared_qin),
-                    repeat(self.shared_qout)
+        workers = []
+        for mod in range(0, self.conf['POOLS']):
+            proc = mp.Process(
+                target=crawl_func,
+                args=(
+                    mod,
+                    self.conf,
+                    exclusion_list,
+                    self.seen_filter,
+                    self.shared_lock,
+                    self.shared_lock_driver,
+                    self.shared_script_controller,
+                    self.shared_dom_stats,
+                    self.shared_qin,
+                    self.shared_qout,
+                    self.shared_progress,
                 ))
+            proc.daemon = True
+            proc.start()
+            workers.append(proc)
+
+        self._join_workers(workers)
+        self._drain_progress()
+
+    def _join_workers(self, workers):
+        """Wait for the worker processes, logging the ones that did not exit cleanly."""
+        for mod, proc in enumerate(workers):
+            proc.join()
+            if proc.exitcode and proc.exitcode < 0:
+                self.logger.error(f"Worker {mod} (pid {proc.pid}) killed by signal {-proc.exitcode}")
+            elif proc.exitcode:
+                self.logger.error(f"Worker {mod} (pid {proc.pid}) exited with code {proc.exitcode}, "
+                                  f"traceback on stderr")
+
+    def _drain_progress(self):
+        """Apply the reports left in shared_progress once the workers are done."""
+        while True:
+            try:
+                self._apply_progress(self.shared_progress.get_nowait())
+            except queue.Empty:
+                break
+
+    def _route_queued(self, router):
+        """Sharded mode: hand the requests in qin/qout (e.g. resumed) to their shards."""
+        for q in (self.shared_qin, self.shared_qout):
+            while True:
+                try:
+                    router.put_many(q.get_many(10000, block=False))
+                except queue.Empty:
+                    break
+
+    def _start_shards(self, exclusion_list):
+        self.logger.debug("Initializing crawler shards...")
+        shards = self.conf['POOLS']
+
+        # Shards start from the domain counters known now, see cls_shards.Shard
+        missing = dict(self.shared_dom_stats.dom_missing)
+        total = dict(self.shared_dom_stats.dom_total)
+        seeds = [{} for _ in range(shards)]
+        for dom_tld, v in missing.items():
+            if v > 0:
+                seeds[cls_shards.shard_of(dom_tld, shards)][dom_tld] = (v, total.get(dom_tld, v))
+
+        workers = []
+        for mod in range(0, shards):
+            proc = mp.Process(
+                target=stage_sharded.sharded,
+                args=(
+                    mod,
+                    self.conf,
+                    exclusion_list,
+                    self.shared_lock_driver,
+                    self.shared_script_controller,
+                    self.shard_inboxes[mod],
+                    self.shared_progress,
+                    self.shared_qout,
+                    seeds[mod],
+                    self.shared_dom_stats.domain_ids,
+                    self.shard_inboxes,
+                ))
+            proc.daemon = True
+            proc.start()
+            workers.append(proc)
+
+        self._join_workers(workers)
+
+        # Last reports, and domains that reached an inbox too late
+        self._drain_progress()
+        for inbox in self.shard_inboxes:
+            while True:
+                try:
+                    reqsA = cls_shards.inbox_requests(inbox.get_nowait(), self.shared_dom_stats, self.shared_lock)
+                except queue.Empty:
+                    break
+                if reqsA:
+                    self.shared_qout.put_many(reqsA)
 
     def run(self, crawl_func):
         self.logger.info("### BEGINNING CRAWLER")
@@ -234,14 +539,22 @@ class BaseCrawlController:
                 self.logger.info("Loading from resume..")
                 self.resume_state.resume_all()
                 self.logger.info(f"Tot already Finished: {len(self.dom_tld_finished)}")
-           
+
+            q = self.shared_qout
+            self.shared_progress = self.manager.Queue()
+            if self.sharded:
+                self.logger.info(f"Sharded execution on {self.conf['POOLS']} workers")
+                self.shard_inboxes = [self.manager.Queue() for _ in range(self.conf['POOLS'])]
+                q = cls_shards.ShardRouter(self.shard_inboxes)
+                self._route_queued(q)
+
             self.queue_out_handler = cls_queue_out.QueueOut(
                 self.conf, 
                 self.shared_dom_stats, 
                 self.dom_tld_finished, 
                 exclusion_list, 
                 self.logger,
-                self.shared_qout
+                q
             )
 
             self.queue_out_handler.fullfill(self.stage)
@@ -253,7 +566,10 @@ class BaseCrawlController:
             self._start_threads()
 
             self.logger.info("Starting crawlers")
-            self._start_crawlers(exclusion_list, crawl_func)
+            if self.sharded:
+                self._start_shards(exclusion_list)
+            else:
+                self._start_crawlers(exclusion_list, crawl_func)
 
         except KeyboardInterrupt:
             self.logger.warning("KeyboardInterrupt received. Shutting down...")
@@ -287,6 +603,18 @@ class BaseCrawlController:
         if self.flush_thread is not None:
             self.flush_thread.join()
 
+        if self.progress_thread is not None:
+            self.progress_thread.join()
+
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.join()
+
+        if self.release_thread is not None:
+            self.release_thread.join()
+
+        if self.archive_thread is not None:
+            self.archive_thread.join()
+
         # Save state
         self.logger.info("Saving state..") 
         self.save_state.save_all()
@@ -294,6 +622,19 @@ class BaseCrawlController:
         # self.save_queues()
         self.logger.info("Queue states saved")
 
+        for q in (self.shared_qin, self.shared_qout):
+            if isinstance(q, cls_queue_transport.ShmRingQueue):
+                q.close()
+        if self.frontier is not None:
+            self.frontier.close()
+        if isinstance(self.seen_filter, (cls_seen_filter.SharedSeenFilter, cls_seen_filter.SharedExactSeenFilter,
+                                         cls_seen_filter.SharedPartitionedSeenFilter)):
+            self.seen_filter.close()
+        if self.shared_dom_stats.archive is not None:
+            self.shared_dom_stats.archive.close()
+        if isinstance(self.shared_dom_stats, cls_domain_stats.ShmDomainStats):
+            self.shared_dom_stats.close()
+
         self.logger.info("All threads and processes stopped.")
 
 
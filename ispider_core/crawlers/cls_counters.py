@@ -0,0 +1,125 @@
+""" crawlers/cls_counters.py """
+import time
+import threading
+
+# script_controller counters owned by the workers, published as deltas
+COUNTERS = ('tot_counter', 'bytes', 'landings', 'robots', 'sitemaps', 'internal_urls', 'canonical_saved')
+
+# Counter of each request discriminator
+RD_COUNTERS = {
+    'landing_page': 'landings',
+    'robots': 'robots',
+    'sitemap': 'sitemaps',
+    'internal_url': 'internal_urls',
+}
+
+
+def count_response(rd, counters):
+    """Count a response of discriminator rd in counters, a worker-local dict."""
+    key = RD_COUNTERS.get(rd)
+    if key is not None:
+        counters[key] = counters.get(key, 0) + 1
+
+
+class StatsBuffer:
+    """
+    Stands for dom_stats.qstats in a worker: the local_stats items put are
+    merged by domain and key (sums added up, sets overwritten) until
+    take() returns them, at most one item per domain and key, to be sent
+    in one message instead of one Manager queue call each.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.puts = 0
+        self.since = None   # time.time() of the oldest item not taken
+
+    def put(self, item):
+        key = (item["dom_tld"], item["key"])
+        op = item.get("op", "sum")
+        with self.lock:
+            self.puts += 1
+            if self.since is None:
+                self.since = time.time()
+            merged = self.items.get(key)
+            if merged is not None and op == "sum":
+                # A sum after a set stays a set
+                merged["value"] += item["value"]
+            else:
+                self.items[key] = {"dom_tld": key[0], "key": key[1], "value": item["value"], "op": op}
+
+    def take(self):
+        """(items, puts merged into them, time of the oldest one or None)"""
+        with self.lock:
+            out = (list(self.items.values()), self.puts, self.since)
+            self.items, self.puts, self.since = {}, 0, None
+        return out
+
+
+class WorkerCounters(dict):
+    """
+    script_controller counters of one worker process, accumulated as
+    deltas in this plain dict (it stands for script_controller in
+    manage_resps) and published every flush_sec in one progress message,
+    merged by the controller with apply_counters(). The message also
+    carries the seconds the worker waited on domain stats locks and the
+    local_stats updates merged by stats, which takes the place of
+    dom_stats.qstats in the worker.
+
+    Used by one thread at a time: the response handler.
+    """
+
+    def __init__(self, mod, progress, dom_stats, flush_sec=1):
+        super().__init__(dict.fromkeys(COUNTERS, 0))
+        self.mod = mod
+        self.progress = progress
+        self.dom_stats = dom_stats
+        self.flush_sec = flush_sec
+        self.last_publish = time.monotonic()
+        self.stats = StatsBuffer()
+        dom_stats.qstats = self.stats
+
+    def maybe_publish(self):
+        if time.monotonic() - self.last_publish >= self.flush_sec:
+            self.publish()
+
+    def publish(self):
+        """Send the deltas accumulated since the last call."""
+        self.last_publish = time.monotonic()
+        counters = {k: v for k, v in self.items() if v}
+        lock_wait = self.dom_stats.take_lock_wait()
+        stats, puts, since = self.stats.take()
+        if not counters and not lock_wait and not stats:
+            return
+        self.update(dict.fromkeys(COUNTERS, 0))
+        report = {'mod': self.mod, 'counters': counters, 'lock_wait': lock_wait}
+        if stats:
+            report.update(stats_report(stats, puts, since))
+        self.progress.put(report)
+
+
+def stats_report(stats, puts, since):
+    """Report fields of StatsBuffer.take(), see apply_counters()."""
+    counters = {'stats_puts': puts, 'stats_items': len(stats)}
+    return {'stats': stats, 'stats_since': since, 'stats_counters': counters}
+
+
+def apply_counters(report, script_controller, lock):
+    """
+    Merge the counters of a WorkerCounters or Shard report into
+    script_controller; lock waits add up by worker in 'lock_wait'. With
+    local_stats updates, 'stats_lag' is the age of the oldest one.
+    The updates themselves go to dom_stats.apply_stats().
+    """
+    with lock:
+        counters = {k: script_controller.get(k, 0) + v
+                    for k, v in {**report['counters'], **report.get('stats_counters', {})}.items() if v}
+        if report.get('stats_since') is not None:
+            counters['stats_lag'] = round(time.time() - report['stats_since'], 3)
+        if report.get('lock_wait'):
+            lock_wait = dict(script_controller.get('lock_wait') or {})
+            lock_wait[report['mod']] = lock_wait.get(report['mod'], 0) + report['lock_wait']
+            counters['lock_wait'] = lock_wait
+        if counters:
+            script_controller.update(counters)
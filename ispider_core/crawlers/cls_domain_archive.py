@@ -0,0 +1,103 @@
+""" crawlers/cls_domain_archive.py """
+import os
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+
+# Columns of a domain row, after dom_tld; last_call is an ISO string or None
+FIELDS = ('missing', 'total', 'last_call', 'engine', 'local_stats')
+
+
+class DomainArchive:
+    """
+    Stats of finished domains in an SQLite table keyed by dom_tld, moved
+    out of the domain stats (see SharedDomainStats.archive_finished()) so
+    their memory follows the domains in progress.
+
+    Rows are dicts of FIELDS, local_stats pickled. Each process (and
+    thread) opens its own connection on first use, the database in WAL
+    mode lets them read while the controller writes.
+    """
+    BATCH = 10000
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS domains (dom_tld TEXT PRIMARY KEY, missing INTEGER, "
+                       "total INTEGER, last_call TEXT, engine TEXT, local_stats BLOB)")
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.pid = os.getpid()
+        return db
+
+    @staticmethod
+    def _row(values):
+        row = dict(zip(FIELDS, values))
+        row['local_stats'] = pickle.loads(row['local_stats']) if row['local_stats'] else {}
+        return row
+
+    def put_many(self, rows):
+        """Store {dom_tld: row}, replacing the rows already there."""
+        db = self._db()
+        with db:
+            db.execute("BEGIN")
+            db.executemany("INSERT OR REPLACE INTO domains VALUES (?, ?, ?, ?, ?, ?)", [
+                (dom_tld, row['missing'], row['total'], row['last_call'], row['engine'],
+                 pickle.dumps(row['local_stats'], protocol=pickle.HIGHEST_PROTOCOL))
+                for dom_tld, row in rows.items()])
+
+    def get(self, dom_tld):
+        values = self._db().execute(
+            f"SELECT {', '.join(FIELDS)} FROM domains WHERE dom_tld = ?", (dom_tld,)).fetchone()
+        return None if values is None else self._row(values)
+
+    def pop(self, dom_tld):
+        """The row of dom_tld, removed from the archive; None if not archived."""
+        row = self.get(dom_tld)
+        # Only one of the processes popping it at the same time gets it
+        if row is None or not self._db().execute("DELETE FROM domains WHERE dom_tld = ?", (dom_tld,)).rowcount:
+            return None
+        return row
+
+    def __contains__(self, dom_tld):
+        return self._db().execute("SELECT 1 FROM domains WHERE dom_tld = ?", (dom_tld,)).fetchone() is not None
+
+    def __len__(self):
+        return self._db().execute("SELECT count(*) FROM domains").fetchone()[0]
+
+    def names(self):
+        return [name for name, in self._db().execute("SELECT dom_tld FROM domains")]
+
+    def rows(self):
+        """(dom_tld, row) of every archived domain, read BATCH at a time."""
+        cursor = self._db().execute(f"SELECT dom_tld, {', '.join(FIELDS)} FROM domains")
+        while True:
+            batch = cursor.fetchmany(self.BATCH)
+            if not batch:
+                return
+            for values in batch:
+                yield values[0], self._row(values[1:])
+
+    def clear(self):
+        self._db().execute("DELETE FROM domains")
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -0,0 +1,147 @@
+""" crawlers/cls_domain_scheduler.py """
+import time
+from collections import deque
+from heapq import heappush, heappop
+
+
+class DomainScheduler:
+    """
+    Per-domain politeness scheduler.
+
+    Requests are kept in one FIFO per dom_tld. Domains with pending requests
+    sit in a heap keyed by their next eligible time, so releasing a request
+    costs O(log D) and the caller knows exactly how long to wait for the next
+    one, instead of polling.
+
+    A domain is in the heap at most once, only while it has pending requests.
+    With a RequestPriority, each domain serves its lowest level first
+    (e.g. robots and sitemaps before deep internal urls).
+
+    push_many() holds at most max_per_domain requests of a domain, so a
+    big domain can't fill the scheduler while it releases one request per
+    delay: the caller keeps the rest until the domain has room again.
+    """
+
+    def __init__(self, min_delay=0.5, clock=time.monotonic, priority=None, max_per_domain=None):
+        self.min_delay = min_delay
+        self.clock = clock
+        self.priority = priority if priority is not None and priority.enabled else None
+        self.max_per_domain = max_per_domain
+        self.queues = {}        # dom_tld -> deque of requests, or heap of (level, seq, request)
+        self._seq = 0
+        self.heap = []          # (eligible_at, dom_tld)
+        self.last_release = {}  # dom_tld -> time of last release
+        self.pending = 0
+        self.released = 0
+        self.deferred = 0
+        self.skipped = 0
+        self._releases_since_prune = 0
+
+    def __len__(self):
+        return self.pending
+
+    def push(self, reqA):
+        dom_tld = reqA[2]
+        q = self.queues.get(dom_tld)
+        if q is None:
+            q = self.queues[dom_tld] = deque() if self.priority is None else []
+
+        if self.priority is None:
+            q.append(reqA)
+        else:
+            self._seq += 1
+            heappush(q, (self.priority.level(reqA), self._seq, reqA))
+        self.pending += 1
+
+        if len(q) == 1:
+            last = self.last_release.get(dom_tld)
+            eligible_at = last + self.min_delay if last is not None else 0
+            heappush(self.heap, (eligible_at, dom_tld))
+
+    def push_many(self, reqsA):
+        """Push reqsA, return the ones left out because their domain already holds max_per_domain."""
+        deferred = []
+        for reqA in reqsA:
+            q = self.queues.get(reqA[2])
+            if self.max_per_domain is not None and q is not None and len(q) >= self.max_per_domain:
+                deferred.append(reqA)
+            else:
+                self.push(reqA)
+        self.deferred += len(deferred)
+        return deferred
+
+    def pop_ready(self, limit, now=None, skip=None):
+        """
+        Release up to limit requests whose domain delay has passed.
+        Requests for which skip(reqA) is True are dropped without using
+        their domain's slot.
+        """
+        now = self.clock() if now is None else now
+        out = []
+
+        while self.heap and len(out) < limit and self.heap[0][0] <= now:
+            eligible_at, dom_tld = heappop(self.heap)
+            q = self.queues[dom_tld]
+            reqA = q.popleft() if self.priority is None else heappop(q)[2]
+
+            if skip is not None and skip(reqA):
+                self.pending -= 1
+                self.skipped += 1
+                if q:
+                    heappush(self.heap, (eligible_at, dom_tld))
+                else:
+                    del self.queues[dom_tld]
+                continue
+
+            out.append(reqA)
+            self.last_release[dom_tld] = now
+
+            if q:
+                heappush(self.heap, (now + self.min_delay, dom_tld))
+            else:
+                del self.queues[dom_tld]
+
+        self.pending -= len(out)
+        self.released += len(out)
+
+        self._releases_since_prune += len(out)
+        if self._releases_since_prune > 100_000:
+            self._prune(now)
+
+        return out
+
+    def next_eligible_in(self, now=None):
+        """Seconds until the next request can be released, None if empty."""
+        if not self.heap:
+            return None
+        now = self.clock() if now is None else now
+        return max(0.0, self.heap[0][0] - now)
+
+    def drain(self):
+        """Remove and return every pending request, ignoring delays."""
+        if self.priority is None:
+            out = [reqA for q in self.queues.values() for reqA in q]
+        else:
+            out = [el[2] for q in self.queues.values() for el in sorted(q)]
+        self.queues.clear()
+        self.heap.clear()
+        self.pending = 0
+        return out
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'domains': len(self.queues),
+            'released': self.released,
+            'deferred': self.deferred,
+            'skipped': self.skipped,
+        }
+
+    def _prune(self, now):
+        # Domains idle for longer than the delay no longer constrain anything
+        limit = now - self.min_delay
+        self.last_release = {
+            k: v for k, v in self.last_release.items()
+            if v > limit or k in self.queues
+        }
+        self._releases_since_prune = 0
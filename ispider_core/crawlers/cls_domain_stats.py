@@ -1,7 +1,41 @@
+import os
+import time
+import heapq
 import queue
+import struct
+import threading
+import multiprocessing
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from datetime import datetime 
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ispider_core.utils.interning import InternTable
+
+# Kinds of the ShmDomainStats completion events: the new state of the domain, or a redirect
+IDLE, UNFINISHED, FINISHED, REDIRECTED = 0, 1, 2, 3
+EVENTS = ('idle', 'unfinished', 'finished', 'redirected')
+
+BACKLOG_BUCKETS = 64
+
+
+def backlog_bucket(missing):
+    """Histogram bucket of a backlog: 0 for none, b for 2**(b-1) <= missing < 2**b."""
+    return max(int(missing), 0).bit_length()
+
+
+def _histogram(counts):
+    """[(low, high, domains)] of the non-empty buckets."""
+    return [(1 << b >> 1, (1 << b) - 1, int(n)) for b, n in enumerate(counts) if n]
 
 class SharedDomainStats:
+    # DomainArchive of the finished domains, see archive_finished()
+    archive = None
+    # InternTable of the domain ids, set by the controller
+    domain_ids = None
+
     def __init__(self, manager, logger, lock, qstats=None):
         self.lock = lock
         self.qstats = qstats
@@ -12,7 +46,28 @@ class SharedDomainStats:
         self.dom_engine = manager.dict()
         self.dom_redirects = manager.dict()
         self.logger = logger
-        
+        # Seconds this process waited for the counter locks, see take_lock_wait()
+        self.lock_wait = 0.0
+        self._archive_candidates = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['lock_wait'] = 0.0
+        state['_archive_candidates'] = set()
+        return state
+
+    @contextmanager
+    def _locked(self, lock):
+        """Hold lock, adding the time taken to acquire it to lock_wait."""
+        t0 = time.perf_counter()
+        with lock:
+            self.lock_wait += time.perf_counter() - t0
+            yield
+
+    def take_lock_wait(self):
+        """Seconds waited for locks by this process since the last call."""
+        wait, self.lock_wait = self.lock_wait, 0.0
+        return wait
 
     def register_redirect(self, original_dom_tld, final_dom_tld):
         """Register a domain redirect and transfer stats to final domain"""
@@ -71,23 +126,32 @@ class SharedDomainStats:
         return self.dom_redirects.get(dom_tld, dom_tld)
 
     def serialize(self) -> dict:
-        """Return a serializable dict of the current state."""
+        """Return a serializable dict of the current state, archived domains included."""
+        state = {name: {} for name in ("dom_missing", "dom_total", "dom_last_call", "dom_engine", "local_stats")}
+        if self.archive is not None:
+            for dom_tld, row in self.archive.rows():
+                state["dom_missing"][dom_tld] = row['missing']
+                state["dom_total"][dom_tld] = row['total']
+                state["dom_last_call"][dom_tld] = row['last_call']
+                state["dom_engine"][dom_tld] = row['engine']
+                state["local_stats"][dom_tld] = row['local_stats']
         with self.lock:
-            return {
-                "dom_missing": dict(self.dom_missing),
-                "dom_total": dict(self.dom_total),
-                "dom_last_call": {
-                    k: v.isoformat() if v is not None else None
-                    for k, v in dict(self.dom_last_call).items()
-                },
-                "dom_engine": dict(self.dom_engine),
-                "dom_redirects": dict(self.dom_redirects),  # NEW
-                "local_stats": dict(self.local_stats),
-            }
+            state["dom_missing"].update(self.dom_missing)
+            state["dom_total"].update(self.dom_total)
+            state["dom_last_call"].update({
+                k: v.isoformat() if v is not None else None
+                for k, v in dict(self.dom_last_call).items()
+            })
+            state["dom_engine"].update(self.dom_engine)
+            state["dom_redirects"] = dict(self.dom_redirects)  # NEW
+            state["local_stats"].update(self.local_stats)
+        return state
 
     def restore(self, state: dict):
         """Restore the state from a previously saved dict."""
         with self.lock:
+            if self.archive is not None:
+                self.archive.clear()
             self.dom_missing.clear()
             self.dom_total.clear()
             self.dom_last_call.clear()
@@ -109,14 +173,107 @@ class SharedDomainStats:
                 self.local_stats[k] = v
 
     def add_domain(self, dom_tld):
+        """Start counting dom_tld, from its archived counters if it was archived."""
+        row = self._unarchive(dom_tld)
+        if row is not None:
+            self._forward_local_stats(dom_tld, row['local_stats'])
+            return
         self.dom_missing[dom_tld] = 0
         self.dom_total[dom_tld] = 0
         self.dom_last_call[dom_tld] = None
         self.dom_engine[dom_tld] = None
         self.local_stats[dom_tld] = {}
 
+    # Archive of the finished domains
+    def archive_finished(self):
+        """
+        Move the domains finished at this call and at the previous one to
+        the archive, in batches; returns how many were moved. Reads of
+        the domain stats (serialize(), the finished domains, domain_rows())
+        go on including them, and a domain counted again (a redirect to
+        it, new links) is taken back from the archive.
+
+        Called periodically by the controller only.
+        """
+        if self.archive is None:
+            return 0
+        finished = set(self._archivable())
+        ready = list(finished & self._archive_candidates)
+        self._archive_candidates = finished - set(ready)
+        moved = 0
+        for k in range(0, len(ready), self.ARCHIVE_BATCH):
+            moved += self._archive(ready[k:k + self.ARCHIVE_BATCH])
+        return moved
+
+    # Domains moved by one lock acquisition
+    ARCHIVE_BATCH = 500
+
+    def _archivable(self):
+        return [k for k, v in dict(self.dom_missing).items() if v == 0]
+
+    def _archive(self, dom_tlds):
+        rows = {}
+        with self._locked(self.lock):
+            for dom_tld in dom_tlds:
+                total = self.dom_total.get(dom_tld, 0)
+                if self.dom_missing.get(dom_tld) != 0 or not total:
+                    continue
+                last_call = self.dom_last_call.get(dom_tld)
+                rows[dom_tld] = {
+                    'missing': 0, 'total': total,
+                    'last_call': last_call.isoformat() if last_call is not None else None,
+                    'engine': self.dom_engine.get(dom_tld),
+                    'local_stats': self.local_stats.get(dom_tld, {}),
+                }
+            # Stored before being removed: readers never miss a domain
+            self.archive.put_many(rows)
+            for dom_tld in rows:
+                for d in (self.dom_missing, self.dom_total, self.dom_last_call, self.dom_engine, self.local_stats):
+                    d.pop(dom_tld, None)
+        return len(rows)
+
+    def _unarchive(self, dom_tld):
+        """Put the counters of dom_tld back from the archive, return its row (None if not archived)."""
+        if self.archive is None:
+            return None
+        row = self.archive.pop(dom_tld)
+        if row is not None:
+            self.dom_missing[dom_tld] = row['missing']
+            self.dom_total[dom_tld] = row['total']
+            self.dom_last_call[dom_tld] = datetime.fromisoformat(row['last_call']) if row['last_call'] else None
+            self.dom_engine[dom_tld] = row['engine']
+        return row
+
+    def _forward_local_stats(self, dom_tld, stats):
+        """local_stats live in the controller: other processes send them through qstats."""
+        if self.qstats is None:
+            self.local_stats[dom_tld] = dict(stats)
+            return
+        for k, v in stats.items():
+            self.qstats.put({"dom_tld": dom_tld, "key": k, "value": v, "op": "set"})
+
+    def domain_rows(self):
+        """
+        (dom_tld, row) of every domain, archived ones included: row has the
+        missing, total, last_call (datetime or None), engine and local_stats
+        of the domain.
+        """
+        for dom_tld, missing in dict(self.dom_missing).items():
+            yield dom_tld, {
+                'missing': missing,
+                'total': self.dom_total.get(dom_tld, 0),
+                'last_call': self.dom_last_call.get(dom_tld),
+                'engine': self.dom_engine.get(dom_tld),
+                'local_stats': self.local_stats.get(dom_tld, {}),
+            }
+        if self.archive is not None:
+            for dom_tld, row in self.archive.rows():
+                if row['last_call']:
+                    row['last_call'] = datetime.fromisoformat(row['last_call'])
+                yield dom_tld, row
+
     def reduce_missing(self, dom_tld):
-        with self.lock:
+        with self._locked(self.lock):
             if dom_tld not in self.dom_missing:
                 return
             self.dom_missing[dom_tld] -= 1
@@ -124,7 +281,7 @@ class SharedDomainStats:
     def reduce_total(self, dom_tld):
         if dom_tld not in self.dom_missing:
             return
-        with self.lock:
+        with self._locked(self.lock):
             self.dom_total[dom_tld] -= 1
 
     def add_missing_total(self, dom_tld):
@@ -132,21 +289,23 @@ class SharedDomainStats:
             return
         if dom_tld not in self.dom_total:
             return
-        with self.lock:
+        with self._locked(self.lock):
             self.dom_missing[dom_tld] += 1
             self.dom_total[dom_tld] += 1
 
     def set_last_call(self, dom_tld):
         if dom_tld not in self.dom_last_call:
             return
-        with self.lock:
+        with self._locked(self.lock):
             self.dom_last_call[dom_tld] = datetime.now()
 
     def is_domain_finished(self, dom_tld):
         """Check if a domain (or its redirect target) is finished"""
         final_dom = self.get_final_domain(dom_tld)
         with self.lock:
-            return self.dom_missing.get(final_dom, -1) == 0
+            if self.dom_missing.get(final_dom, -1) == 0:
+                return True
+        return self.archive is not None and final_dom in self.archive
 
     def get_finished_domains(self):
         """Returns all finished domains, including original names that redirected"""
@@ -154,6 +313,8 @@ class SharedDomainStats:
         with self.lock:
             # Get directly finished domains
             finished = [k for k, v in self.dom_missing.items() if v == 0]
+            if self.archive is not None:
+                finished.extend(self.archive.names())
             
             # Add reverse mappings: if final domain is finished, original is too
             reverse_redirects = {}
@@ -172,14 +333,35 @@ class SharedDomainStats:
     def get_unfinished_domains(self):
         return [k for k, v in self.dom_missing.items() if v > 0]
 
+    def count_finished(self):
+        return self.count_by(lambda v: v == 0) + (len(self.archive) if self.archive is not None else 0)
+
+    def count_unfinished(self):
+        return self.count_by(lambda v: v > 0)
+
     def get_tot_domains(self):
-        return len(self.dom_missing)
+        return len(self.dom_missing) + (len(self.archive) if self.archive is not None else 0)
 
     def count_by(self, condition_fn):
         return sum(1 for v in self.dom_missing.values() if condition_fn(v))
 
     def get_sorted_missing(self, reverse=True):
         return dict(sorted(self.dom_missing.items(), key=lambda item: item[1], reverse=reverse))
+
+    def backlog_summary(self, k=20):
+        """
+        The k largest backlogs (pages missing) as [(dom_tld, missing)], and
+        the histogram of the backlogs as [(low, high, domains)], see
+        backlog_bucket().
+        """
+        missing = dict(self.dom_missing)
+        counts = [0] * BACKLOG_BUCKETS
+        for v in missing.values():
+            counts[backlog_bucket(v)] += 1
+        return {
+            'top': heapq.nlargest(k, missing.items(), key=lambda item: item[1]),
+            'histogram': _histogram(counts),
+        }
     
     def increase_script_counters(self, rd, script_controller):
         """
@@ -196,27 +378,33 @@ class SharedDomainStats:
             elif rd == "internal_url":
                 script_controller["internal_urls"] = script_controller.get("internal_urls", 0) + 1
                 
-    def filter_and_add_links(self, dom_tld, links, max_pages):
-        """Filter links to avoid exceeding max_pages, and update counters safely."""
-        with self.lock:
+    def reserve(self, dom_tld, n, max_pages=None):
+        """
+        Reserve up to n pages of dom_tld without its total going over
+        max_pages (None: no cap), adding them to its missing and total
+        counters in one locked update. Returns how many were reserved.
+        """
+        with self._locked(self.lock):
             if dom_tld not in self.dom_missing:
                 self.add_domain(dom_tld)
+            total = self.dom_total.get(dom_tld, 0)
+            count = n if max_pages is None else max(0, min(n, max_pages - total))
+            if count:
+                self.dom_total[dom_tld] = total + count
+                self.dom_missing[dom_tld] += count
+            return count
 
-            current_total = self.dom_total.get(dom_tld, 0)
-            remaining = max_pages - current_total
-
-            if remaining <= 0:
-                return []  # No room left
-
-            limited_links = links[:remaining]
-            count = len(limited_links)
-
-            # print(f"[DOMSTATS] {dom_tld}: total={self.dom_total[dom_tld]} missing={self.dom_missing[dom_tld]} adding={count}")
-
-            self.dom_total[dom_tld] += count
-            self.dom_missing[dom_tld] += count
+    def release(self, dom_tld, n=1):
+        """Give back n reserved pages that will not be fetched."""
+        with self._locked(self.lock):
+            if dom_tld not in self.dom_missing:
+                return
+            self.dom_missing[dom_tld] -= n
+            self.dom_total[dom_tld] -= n
 
-            return limited_links
+    def filter_and_add_links(self, dom_tld, links, max_pages):
+        """The first links that fit in the max_pages budget of dom_tld, reserved."""
+        return links[:self.reserve(dom_tld, len(links), max_pages)]
 
     def flush_qstats(self):
         """Pull all items from qstats and aggregate into local_stats."""
@@ -225,29 +413,824 @@ class SharedDomainStats:
 
         try:
             while True:
-                item = self.qstats.get_nowait()
+                self._apply_stat(self.qstats.get_nowait())
+        except queue.Empty:
+            pass
 
-                # print(item)
-                
-                dom_tld = item["dom_tld"]
-                k = item["key"]
-                v = item["value"]
-                op = item.get("op", "sum")  # Default to sum if not specified
-
-                if dom_tld not in self.local_stats:
-                    self.local_stats[dom_tld] = {}
-
-                if op == "sum":
-                    # Initialize to 0 if not yet set
-                    if k not in self.local_stats[dom_tld]:
-                        self.local_stats[dom_tld][k] = 0
-                    self.local_stats[dom_tld][k] += v
-                elif op == "set":
-                    # Just set/overwrite
-                    self.local_stats[dom_tld][k] = v
-                else:
-                    # Optional: warn or ignore unknown op
-                    pass
+    def apply_stats(self, items):
+        """Aggregate qstats items collected elsewhere (e.g. by a shard) into local_stats."""
+        for item in items:
+            self._apply_stat(item)
 
-        except queue.Empty:
-            pass
\ No newline at end of file
+    def _apply_stat(self, item):
+        dom_tld = item["dom_tld"]
+        k = item["key"]
+        v = item["value"]
+        op = item.get("op", "sum")  # Default to sum if not specified
+
+        if dom_tld not in self.local_stats:
+            row = self._unarchive(dom_tld)
+            self.local_stats[dom_tld] = row['local_stats'] if row is not None else {}
+
+        if op == "sum":
+            # Initialize to 0 if not yet set
+            if k not in self.local_stats[dom_tld]:
+                self.local_stats[dom_tld][k] = 0
+            self.local_stats[dom_tld][k] += v
+        elif op == "set":
+            # Just set/overwrite
+            self.local_stats[dom_tld][k] = v
+        else:
+            # Optional: warn or ignore unknown op
+            pass
+
+
+class _DomainView(MutableMapping):
+    """One counter of ShmDomainStats seen as a dict keyed by dom_tld."""
+
+    def __init__(self, stats, field):
+        self.stats = stats
+        self.field = field
+
+    def _out(self, value):
+        return int(value)
+
+    def _in(self, value):
+        return value
+
+    def __getitem__(self, dom_tld):
+        slot = self.stats._slot(dom_tld)
+        if slot is None:
+            raise KeyError(dom_tld)
+        return self._out(slot[0][self.field][slot[1]])
+
+    def __setitem__(self, dom_tld, value):
+        self.stats._set(dom_tld, self.field, self._in(value))
+
+    def __delitem__(self, dom_tld):
+        if not self.stats._remove(dom_tld):
+            raise KeyError(dom_tld)
+
+    def __contains__(self, dom_tld):
+        return self.stats._slot(dom_tld) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(self.stats._column('alive').sum())
+
+    # Lists, as the Manager dict proxies return
+    def keys(self):
+        return self.stats._alive_names()
+
+    def values(self):
+        return [self._out(v) for v in self.stats._tracked(self.field)[1].tolist()]
+
+    def items(self):
+        names, values = self.stats._tracked(self.field)
+        return [(k, self._out(v)) for k, v in zip(names, values.tolist())]
+
+    def clear(self):
+        self.stats._clear()
+
+
+class _LastCallView(_DomainView):
+    """dom_last_call: epoch seconds in the array, datetime or None outside."""
+
+    def _out(self, value):
+        return None if np.isnan(value) else datetime.fromtimestamp(value)
+
+    def _in(self, value):
+        return np.nan if value is None else value.timestamp()
+
+
+class ShmDomainStats(SharedDomainStats):
+    """
+    SharedDomainStats with dom_missing, dom_total and dom_last_call in
+    shared-memory arrays indexed by domain id: the per-response updates
+    (reduce_missing, add_missing_total, reserve and release) make no
+    Manager round-trip.
+
+    Ids come from domain_ids, an InternTable: assigned when a domain is
+    added (at enqueue time), never changed, cached by each process.
+    Records are in chunks of CHUNK domains, one segment each, named after
+    the control segment with suffix _i; ids interned without the stats (the
+    ring codec, the dom_id of the JSON records) get theirs on first use. Updates take one of the stripes,
+    multiprocessing locks picked by domain id; self.lock still serializes
+    redirects and restore. dom_engine and dom_redirects, rarely written,
+    stay Manager dicts.
+
+    Each record also keeps the state of its domain: unfinished (pages
+    missing), finished (none missing, some found) or idle. The writes
+    changing it append an event to the completion stream (see events()),
+    segments of EVENT_CHUNK events with suffix _e<i>. Each process folds
+    the events it has not read yet into its own finished and unfinished
+    sets, so get_finished_domains() and the counts never scan the domains.
+
+    The same writes keep, per stripe in the segment with suffix _s, the
+    histogram of the backlogs and a table of the TOP largest ones with
+    their live values, for backlog_summary(). The table is a streaming
+    top-k: a domain enters when its backlog changes to more than the
+    smallest one of the table. The ceiling bounds the backlogs left out
+    of it; when the table falls below it, backlog_summary() rebuilds it
+    from the records of the stripe.
+
+    The three counters remain usable as dicts (_DomainView), for the API
+    server, thread_stats and SaveState. The records being compact, archived
+    domains keep theirs: only their engine and local_stats are moved. Like SharedSeenFilter, it must
+    reach other processes by inheritance (mp.Process args).
+    """
+    CHUNK = 65536
+    EVENT_CHUNK = 65536
+    TOP = 16
+    # bucket: backlog_bucket() + 1 while counted in the histogram; top: position + 1 in the top table
+    RECORD = np.dtype([('missing', '<i8'), ('total', '<i8'), ('last_call', '<f8'), ('alive', '<i8'),
+                       ('state', '<i8'), ('bucket', '<i8'), ('top', '<i8')])
+    EVENT = np.dtype([('dom', '<i8'), ('kind', '<i8'), ('target', '<i8')])
+    # Domain chunks, event chunks, events: each written under its own lock
+    _CONTROL = struct.Struct('<QQQ')
+    _FIELD = struct.Struct('<Q')
+
+    def __init__(self, manager, logger, lock, qstats=None, stripes=64):
+        self.lock = lock
+        self.qstats = qstats
+        self.local_stats = dict()
+        self.dom_engine = manager.dict()
+        self.dom_redirects = manager.dict()
+        self.logger = logger
+        self.lock_wait = 0.0
+        self._archive_candidates = set()
+
+        self.stripes = [multiprocessing.Lock() for _ in range(stripes)]
+        self.domain_ids = InternTable(manager)
+        self._events_lock = multiprocessing.Lock()
+        self._control = shared_memory.SharedMemory(create=True, size=self._CONTROL.size)
+        self._CONTROL.pack_into(self._control.buf, 0, 0, 0, 0)
+        self._summary_shm = shared_memory.SharedMemory(
+            name=f"{self._control.name}_s", create=True, size=self._summary_size())
+        self._owner_pid = os.getpid()
+        self._attach()
+        self._summary[:] = 0
+        self._top[:] = -1
+
+    def _summary_size(self):
+        return len(self.stripes) * (BACKLOG_BUCKETS + 2 * self.TOP + 2) * 8
+
+    def _attach(self):
+        if not hasattr(self, '_summary_shm'):
+            self._summary_shm = shared_memory.SharedMemory(name=f"{self._control.name}_s")
+        # Per stripe: histogram, top table (domain ids, -1 empty, and backlogs), its smallest
+        # backlog and the largest one a domain out of it may have
+        self._summary = np.ndarray(
+            (len(self.stripes), BACKLOG_BUCKETS + 2 * self.TOP + 2), dtype='<i8', buffer=self._summary_shm.buf)
+        self._hist = self._summary[:, :BACKLOG_BUCKETS]
+        self._top = self._summary[:, BACKLOG_BUCKETS:BACKLOG_BUCKETS + self.TOP]
+        self._top_missing = self._summary[:, BACKLOG_BUCKETS + self.TOP:-2]
+        self._floor = self._summary[:, -2]
+        self._ceiling = self._summary[:, -1]
+        self._chunk_shms = []
+        self._chunks = []
+        self._event_shms = []
+        self._event_chunks = []
+        self._reader = {'read': 0, 'finished': set(), 'unfinished': set(), 'redirects': {}}
+        self._reader_lock = threading.RLock()
+        self.dom_missing = _DomainView(self, 'missing')
+        self.dom_total = _DomainView(self, 'total')
+        self.dom_last_call = _LastCallView(self, 'last_call')
+
+    def __getstate__(self):
+        state = {k: v for k, v in self.__dict__.items() if k not in (
+            '_control', '_chunk_shms', '_chunks', '_event_shms', '_event_chunks', '_reader', '_reader_lock',
+            '_summary_shm', '_summary', '_hist', '_top', '_top_missing', '_floor', '_ceiling', 'dom_missing', 'dom_total', 'dom_last_call')}
+        state['_control_name'] = self._control.name
+        state['lock_wait'] = 0.0
+        state['_archive_candidates'] = set()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._control = shared_memory.SharedMemory(name=self.__dict__.pop('_control_name'))
+        self._attach()
+
+    # Ids and records
+    def _published(self, field):
+        """Field of the control segment: 0 domain chunks, 1 event chunks, 2 events."""
+        return self._FIELD.unpack_from(self._control.buf, 8 * field)[0]
+
+    def _publish(self, field, value):
+        self._FIELD.pack_into(self._control.buf, 8 * field, value)
+
+    def _published_chunks(self):
+        return self._published(0)
+
+    def _chunk_name(self, i):
+        return f"{self._control.name}_{i}"
+
+    def _map_chunk(self, shm):
+        self._chunk_shms.append(shm)
+        self._chunks.append(np.ndarray((self.CHUNK,), dtype=self.RECORD, buffer=shm.buf))
+
+    def _chunk(self, i):
+        if i >= len(self._chunks):
+            for j in range(len(self._chunks), self._published_chunks()):
+                self._map_chunk(shared_memory.SharedMemory(name=self._chunk_name(j)))
+            if i >= len(self._chunks):
+                # Id interned without _reserve (RequestCodec, the JSON dom_id)
+                self.domain_ids.reserve_assigned(self._reserve)
+        return self._chunks[i]
+
+    def _id(self, dom_tld):
+        """Id of dom_tld, None if it was never added."""
+        return self.domain_ids.get(dom_tld)
+
+    def _intern(self, dom_tlds):
+        """Ids of dom_tlds, assigning the missing ones."""
+        return self.domain_ids.intern_many(dom_tlds, reserve=self._reserve)
+
+    def _reserve(self, count):
+        """Chunks for count domains, called under the InternTable lock."""
+        chunks = self._published_chunks()
+        if chunks:
+            self._chunk(chunks - 1)
+        while chunks * self.CHUNK < count:
+            self._map_chunk(shared_memory.SharedMemory(
+                name=self._chunk_name(chunks), create=True, size=self.CHUNK * self.RECORD.itemsize))
+            chunks += 1
+            self._publish(0, chunks)
+
+    def _record(self, i):
+        """(chunk, slot, stripe lock, id) of domain id i."""
+        return self._chunk(i // self.CHUNK), i % self.CHUNK, self.stripes[self._stripe(i)], i
+
+    def _stripe(self, i):
+        return i % len(self.stripes)
+
+    def _slot(self, dom_tld):
+        """_record of dom_tld, None unless it is tracked."""
+        i = self._id(dom_tld)
+        if i is None:
+            return None
+        slot = self._record(i)
+        return slot if slot[0]['alive'][slot[1]] else None
+
+    def _column(self, field, count=None):
+        """field of the first count domain ids (default all), as one array."""
+        if count is None:
+            count = len(self.domain_ids)
+        if not count:
+            return np.zeros(0, dtype=self.RECORD[field])
+        last = (count - 1) // self.CHUNK
+        self._chunk(last)
+        return np.concatenate([chunk[field] for chunk in self._chunks[:last + 1]])[:count]
+
+    def _tracked(self, *fields):
+        """Names of the tracked domains and their fields, from one consistent count."""
+        count = len(self.domain_ids)
+        alive = self._column('alive', count).astype(bool)
+        all_names = self.domain_ids.names(count)
+        names = [all_names[i] for i in np.flatnonzero(alive).tolist()]
+        return (names, *[self._column(field, count)[alive] for field in fields])
+
+    def _alive_names(self):
+        return self._tracked()[0]
+
+    # Completion stream
+    def _refresh(self, chunk, slot, i):
+        """
+        Bring the state, histogram bucket and top table entry of domain id i
+        in line with its record, under its stripe. Returns the state event
+        if the state changed, else None.
+        """
+        missing, total, _, alive, state, old, top = chunk[slot].item()
+        if not alive:
+            missing = 0
+        k = self._stripe(i)
+
+        bucket = max(missing, 0).bit_length() + 1 if alive else 0
+        if bucket != old:
+            if old:
+                self._hist[k, old - 1] -= 1
+            if bucket:
+                self._hist[k, bucket - 1] += 1
+            chunk['bucket'][slot] = bucket
+
+        if top or missing > self._floor[k]:
+            self._retop(chunk, slot, i, k, missing, top - 1)
+        elif missing > self._ceiling[k]:
+            # Left out of the table
+            self._ceiling[k] = missing
+
+        if not alive:
+            new = IDLE
+        elif missing > 0:
+            new = UNFINISHED
+        else:
+            new = FINISHED if missing == 0 and total > 0 else IDLE
+        if new == state:
+            return None
+        chunk['state'][slot] = new
+        return (i, new, -1)
+
+    def _retop(self, chunk, slot, i, k, missing, pos):
+        """
+        Top table of stripe k after the backlog of domain id i, at position
+        pos of the table (-1 if out of it), changed to missing. The floor
+        is the smallest backlog of the table, 0 while it has room.
+        """
+        ids, backlogs, floor = self._top[k], self._top_missing[k], self._floor[k]
+        if pos >= 0:
+            old = backlogs[pos]
+            if missing <= 0:
+                ids[pos], backlogs[pos] = -1, 0
+                chunk['top'][slot] = 0
+                self._floor[k] = 0
+                return
+            backlogs[pos] = missing
+            if missing < floor:
+                self._floor[k] = missing
+            if old != floor:
+                return
+        elif missing > 0:
+            pos = int(backlogs.argmin())
+            if ids[pos] >= 0:
+                evicted, evicted_slot, _, _ = self._record(int(ids[pos]))
+                evicted['top'][evicted_slot] = 0
+                self._ceiling[k] = max(self._ceiling[k], backlogs[pos])
+            ids[pos], backlogs[pos] = i, missing
+            chunk['top'][slot] = pos + 1
+        self._floor[k] = backlogs.min()
+
+    def _rebuild_top(self, k):
+        """
+        Top table of stripe k recomputed from the records of its domains,
+        under its stripe; the ceiling is then the largest backlog left out.
+        """
+        count = len(self.domain_ids)
+        if not count:
+            return
+        last = (count - 1) // self.CHUNK
+        self._chunk(last)
+        n = len(self.stripes)
+        with self._locked(self.stripes[k]):
+            ids, backlogs = [], []
+            for j, chunk in enumerate(self._chunks[:last + 1]):
+                base = j * self.CHUNK
+                start, stop = (k - base) % n, min(self.CHUNK, count - base)
+                records = chunk[start:stop:n]
+                records['top'] = 0
+                ids.append(np.arange(base + start, base + stop, n))
+                backlogs.append(np.where(records['alive'] > 0, records['missing'], 0))
+            ids, backlogs = np.concatenate(ids), np.concatenate(backlogs)
+            ranked = np.argsort(-backlogs, kind='stable')
+            ranked = ranked[backlogs[ranked] > 0]
+            self._top[k], self._top_missing[k] = -1, 0
+            for pos, x in enumerate(ranked[:self.TOP].tolist()):
+                i = int(ids[x])
+                self._top[k, pos], self._top_missing[k, pos] = i, backlogs[x]
+                chunk, slot, _, _ = self._record(i)
+                chunk['top'][slot] = pos + 1
+            self._floor[k] = self._top_missing[k].min()
+            self._ceiling[k] = backlogs[ranked[self.TOP]] if len(ranked) > self.TOP else 0
+
+    def _event_chunk(self, j):
+        if j >= len(self._event_chunks):
+            for k in range(len(self._event_chunks), self._published(1)):
+                shm = shared_memory.SharedMemory(name=f"{self._control.name}_e{k}")
+                self._event_shms.append(shm)
+                self._event_chunks.append(np.ndarray((self.EVENT_CHUNK,), dtype=self.EVENT, buffer=shm.buf))
+        return self._event_chunks[j]
+
+    def _emit(self, *events):
+        """Append (domain id, kind, target id) events, None ones skipped, to the stream."""
+        events = [e for e in events if e is not None]
+        if not events:
+            return
+        with self._events_lock:
+            count = self._published(2)
+            for event in events:
+                j, k = divmod(count, self.EVENT_CHUNK)
+                if j == self._published(1):
+                    if j:
+                        self._event_chunk(j - 1)
+                    shm = shared_memory.SharedMemory(
+                        name=f"{self._control.name}_e{j}", create=True,
+                        size=self.EVENT_CHUNK * self.EVENT.itemsize)
+                    self._event_shms.append(shm)
+                    self._event_chunks.append(np.ndarray((self.EVENT_CHUNK,), dtype=self.EVENT, buffer=shm.buf))
+                    self._publish(1, j + 1)
+                self._event_chunk(j)[k] = event
+                count += 1
+            # Published last: readers only see whole events
+            self._publish(2, count)
+
+    def events_count(self):
+        """Events published so far: the position of the next one."""
+        return self._published(2)
+
+    def events(self, since=0, limit=None):
+        """
+        Completion events from position since: a list of (position, dom_tld,
+        kind, target) and the position to ask for next. kind is 'finished',
+        'unfinished' or 'idle' (the domain state changed to it) or
+        'redirected' (to target, None when the redirect was dropped).
+        """
+        count = self._published(2)
+        if limit is not None:
+            count = min(count, since + limit)
+        out = []
+        if since >= count:
+            return out, max(since, 0)
+        names = self.domain_ids.names()
+        for k, (dom, kind, target) in enumerate(self._event_records(since, count), since):
+            out.append((k, names[dom], EVENTS[kind], names[target] if target >= 0 else None))
+        return out, count
+
+    def _event_records(self, start, end):
+        records = []
+        while start < end:
+            j, k = divmod(start, self.EVENT_CHUNK)
+            n = min(end - start, self.EVENT_CHUNK - k)
+            records.extend(self._event_chunk(j)[k:k + n].tolist())
+            start += n
+        return records
+
+    def _sync(self):
+        """This process' view of the domain states, with the new events applied."""
+        with self._reader_lock:
+            reader = self._reader
+            count = self._published(2)
+            if reader['read'] < count:
+                records = self._event_records(reader['read'], count)
+                names = self.domain_ids.names()
+                finished, unfinished, redirects = reader['finished'], reader['unfinished'], reader['redirects']
+                for dom, kind, target in records:
+                    name = names[dom]
+                    if kind == REDIRECTED:
+                        if target >= 0:
+                            redirects[name] = names[target]
+                        else:
+                            redirects.pop(name, None)
+                    elif kind == FINISHED:
+                        unfinished.discard(name)
+                        finished.add(name)
+                    elif kind == UNFINISHED:
+                        finished.discard(name)
+                        unfinished.add(name)
+                    else:
+                        finished.discard(name)
+                        unfinished.discard(name)
+                reader['read'] = count
+            return reader
+
+    @staticmethod
+    def _reset(chunk, slot, missing=0, total=0, last_call=np.nan):
+        """Counters of a (re)added domain; call _refresh() next."""
+        chunk['missing'][slot] = missing
+        chunk['total'][slot] = total
+        chunk['last_call'][slot] = last_call
+        chunk['alive'][slot] = 1
+
+    # Dict views
+    def _set(self, dom_tld, field, value):
+        i, = self._intern([dom_tld])
+        chunk, slot, stripe, i = self._record(i)
+        with stripe:
+            if not chunk['alive'][slot]:
+                self._reset(chunk, slot)
+            chunk[field][slot] = value
+            self._emit(self._refresh(chunk, slot, i))
+
+    def _remove(self, dom_tld):
+        slot = self._slot(dom_tld)
+        if slot is None:
+            return False
+        chunk, slot, stripe, i = slot
+        with stripe:
+            chunk['alive'][slot] = 0
+            self._emit(self._refresh(chunk, slot, i))
+        return True
+
+    def _clear(self):
+        chunks = self._published_chunks()
+        if chunks:
+            self._chunk(chunks - 1)
+        events = []
+        for j, chunk in enumerate(self._chunks):
+            events.extend((j * self.CHUNK + k, IDLE, -1) for k in np.flatnonzero(chunk['state']).tolist())
+            chunk['alive'] = 0
+            chunk['state'] = IDLE
+            chunk['bucket'] = 0
+            chunk['top'] = 0
+        self._hist[:] = 0
+        self._top[:] = -1
+        self._top_missing[:] = 0
+        self._floor[:] = 0
+        self._ceiling[:] = 0
+        self._emit(*events)
+
+    # SharedDomainStats API
+    def serialize(self) -> dict:
+        archived = dict(self.archive.rows()) if self.archive is not None else {}
+        with self.lock:
+            names, missing, total, last_call = self._tracked('missing', 'total', 'last_call')
+            engines = {k: row['engine'] for k, row in archived.items()}
+            engines.update(self.dom_engine)
+            return {
+                "dom_missing": dict(zip(names, missing.tolist())),
+                "dom_total": dict(zip(names, total.tolist())),
+                "dom_last_call": {
+                    # NaN: never called
+                    k: datetime.fromtimestamp(v).isoformat() if v == v else None
+                    for k, v in zip(names, last_call.tolist())
+                },
+                # Only set engines are stored
+                "dom_engine": {k: engines.get(k) for k in names},
+                "dom_redirects": dict(self.dom_redirects),
+                "local_stats": {**{k: row['local_stats'] for k, row in archived.items()}, **self.local_stats},
+            }
+
+    def restore(self, state: dict):
+        with self.lock:
+            if self.archive is not None:
+                self.archive.clear()
+            self._clear()
+            self._emit(*[(i, REDIRECTED, -1) for i in self._intern(list(self.dom_redirects.keys()))])
+            self.dom_engine.clear()
+            self.dom_redirects.clear()
+            self.local_stats.clear()
+
+            missing = state.get("dom_missing", {})
+            total = state.get("dom_total", {})
+            last_call = state.get("dom_last_call", {})
+            names = list(dict.fromkeys([*missing, *total]))
+            for dom_tld, i in zip(names, self._intern(names)):
+                chunk, slot, stripe, i = self._record(i)
+                v = last_call.get(dom_tld)
+                with stripe:
+                    self._reset(chunk, slot, missing.get(dom_tld, 0), total.get(dom_tld, 0),
+                                datetime.fromisoformat(v).timestamp() if v else np.nan)
+                    self._emit(self._refresh(chunk, slot, i))
+            self.dom_engine.update({k: v for k, v in state.get("dom_engine", {}).items() if v is not None})
+            redirects = state.get("dom_redirects", {})
+            self.dom_redirects.update(redirects)
+            self._emit(*zip(self._intern(list(redirects)), [REDIRECTED] * len(redirects),
+                            self._intern(list(redirects.values()))))
+            self.local_stats.update(state.get("local_stats", {}))
+
+    def add_domain(self, dom_tld):
+        i, = self._intern([dom_tld])
+        chunk, slot, stripe, i = self._record(i)
+        with stripe:
+            self._reset(chunk, slot)
+            self._emit(self._refresh(chunk, slot, i))
+        if self._owner():
+            self.local_stats[dom_tld] = {}
+
+    def _owner(self):
+        # local_stats live in the creating process (the controller): workers
+        # only keep the shm record, their stats go through qstats
+        return os.getpid() == self._owner_pid
+
+    def _archivable(self):
+        # The domains with something to move
+        with self._reader_lock:
+            return [dom_tld for dom_tld in self._sync()['finished'] if dom_tld in self.local_stats]
+
+    def _archive(self, dom_tlds):
+        rows = {}
+        for dom_tld in dom_tlds:
+            slot = self._slot(dom_tld)
+            if slot is None:
+                # Redirected to another domain since found finished
+                continue
+            chunk, slot, stripe, i = slot
+            with self._locked(stripe):
+                if chunk['state'][slot] != FINISHED:
+                    continue
+                total, last_call = int(chunk['total'][slot]), float(chunk['last_call'][slot])
+            rows[dom_tld] = {
+                'missing': 0, 'total': total,
+                'last_call': datetime.fromtimestamp(last_call).isoformat() if last_call == last_call else None,
+                'engine': self.dom_engine.get(dom_tld),
+                'local_stats': self.local_stats.get(dom_tld, {}),
+            }
+        self.archive.put_many(rows)
+        return sum(self._drop_archived(dom_tld) for dom_tld in rows)
+
+    def _drop_archived(self, dom_tld):
+        slot = self._slot(dom_tld)
+        if slot is None:
+            self.dom_engine.pop(dom_tld, None)
+            self.local_stats.pop(dom_tld, None)
+            return True
+        chunk, slot, stripe, i = slot
+        # Under the stripe: a reserve counting it again revives it before or after
+        with self._locked(stripe):
+            if chunk['state'][slot] != FINISHED:
+                # Counted again before the row landed: keep it live
+                self.archive.pop(dom_tld)
+                return False
+            self.dom_engine.pop(dom_tld, None)
+            self.local_stats.pop(dom_tld, None)
+        return True
+
+    def _unarchive(self, dom_tld):
+        if self.archive is None:
+            return None
+        row = self.archive.pop(dom_tld)
+        if row is not None and row['engine'] is not None:
+            self.dom_engine[dom_tld] = row['engine']
+        return row
+
+    def _revive(self, dom_tld):
+        """A finished domain counted again: its engine and local_stats back from the archive."""
+        row = self._unarchive(dom_tld)
+        if row is not None:
+            self._forward_local_stats(dom_tld, row['local_stats'])
+
+    def domain_rows(self):
+        archived = dict(self.archive.rows()) if self.archive is not None else {}
+        names, missing, total, last_call = self._tracked('missing', 'total', 'last_call')
+        engines = dict(self.dom_engine)
+        for dom_tld, m, t, c in zip(names, missing.tolist(), total.tolist(), last_call.tolist()):
+            row = archived.get(dom_tld)
+            yield dom_tld, {
+                'missing': m, 'total': t,
+                'last_call': datetime.fromtimestamp(c) if c == c else None,
+                'engine': row['engine'] if row is not None else engines.get(dom_tld),
+                'local_stats': row['local_stats'] if row is not None else self.local_stats.get(dom_tld, {}),
+            }
+
+    def register_redirect(self, original_dom_tld, final_dom_tld):
+        """Register a domain redirect and transfer stats to final domain"""
+        if original_dom_tld == final_dom_tld:
+            return final_dom_tld
+
+        with self.lock:
+            self.dom_redirects[original_dom_tld] = final_dom_tld
+            if self._slot(final_dom_tld) is None:
+                self.add_domain(final_dom_tld)
+            orig_id, final_id = self._intern([original_dom_tld, final_dom_tld])
+            self._emit((orig_id, REDIRECTED, final_id))
+
+            orig = self._slot(original_dom_tld)
+            if orig is not None:
+                final = self._slot(final_dom_tld)
+                # Both stripes, in a fixed order
+                stripes = [self.stripes[k] for k in sorted({self._stripe(orig_id), self._stripe(final_id)})]
+                for stripe in stripes:
+                    stripe.acquire()
+                try:
+                    for field in ('missing', 'total'):
+                        final[0][field][final[1]] += orig[0][field][orig[1]]
+                    orig[0]['alive'][orig[1]] = 0
+                    self._emit(self._refresh(orig[0], orig[1], orig_id),
+                               self._refresh(final[0], final[1], final_id))
+                finally:
+                    for stripe in reversed(stripes):
+                        stripe.release()
+
+                if original_dom_tld in self.local_stats:
+                    merged = self.local_stats.setdefault(final_dom_tld, {})
+                    for key, value in self.local_stats.pop(original_dom_tld).items():
+                        if isinstance(value, (int, float)):
+                            merged[key] = merged.get(key, 0) + value
+                        else:
+                            merged[key] = value
+                self.dom_engine.pop(original_dom_tld, None)
+
+                self.logger.info(f"Redirect registered: {original_dom_tld} -> {final_dom_tld}")
+
+        return final_dom_tld
+
+    def _add(self, dom_tld, missing, total):
+        slot = self._slot(dom_tld)
+        if slot is None:
+            return
+        chunk, slot, stripe, i = slot
+        with self._locked(stripe):
+            revived = missing > 0 and chunk['state'][slot] == FINISHED
+            chunk['missing'][slot] += missing
+            chunk['total'][slot] += total
+            # Under the stripe: the events of a domain keep the order of its writes
+            event = self._refresh(chunk, slot, i)
+            if event:
+                self._emit(event)
+        if revived:
+            self._revive(dom_tld)
+
+    def reduce_missing(self, dom_tld):
+        self._add(dom_tld, -1, 0)
+
+    def reduce_total(self, dom_tld):
+        self._add(dom_tld, 0, -1)
+
+    def add_missing_total(self, dom_tld):
+        self._add(dom_tld, 1, 1)
+
+    def set_last_call(self, dom_tld):
+        slot = self._slot(dom_tld)
+        if slot is not None:
+            slot[0]['last_call'][slot[1]] = time.time()
+
+    def is_domain_finished(self, dom_tld):
+        slot = self._slot(self.get_final_domain(dom_tld))
+        return slot is not None and slot[0]['missing'][slot[1]] == 0
+
+    def get_finished_domains(self):
+        """Returns all finished domains, including original names that redirected"""
+        with self._reader_lock:
+            reader = self._sync()
+            finished = set(reader['finished'])
+            finished.update(orig for orig, final in reader['redirects'].items() if final in finished)
+        return list(finished)
+
+    def get_unfinished_domains(self):
+        with self._reader_lock:
+            return list(self._sync()['unfinished'])
+
+    def count_finished(self):
+        return len(self._sync()['finished'])
+
+    def count_unfinished(self):
+        return len(self._sync()['unfinished'])
+
+    def get_tot_domains(self):
+        return len(self.dom_missing)
+
+    def count_by(self, condition_fn):
+        count = len(self.domain_ids)
+        alive = self._column('alive', count).astype(bool)
+        return sum(1 for v in self._column('missing', count)[alive].tolist() if condition_fn(v))
+
+    def get_sorted_missing(self, reverse=True):
+        return dict(sorted(self.dom_missing.items(), key=lambda item: item[1], reverse=reverse))
+
+    def backlog_summary(self, k=20):
+        """
+        Read from the top tables and histograms of the stripes; the tables
+        fallen below a domain left out of them are rebuilt first, in time
+        linear in the domains of their stripes. k is capped to the size of
+        the tables.
+        """
+        for stripe in np.flatnonzero(self._floor < self._ceiling).tolist():
+            self._rebuild_top(stripe)
+        used = self._top >= 0
+        top = zip(self._top[used].tolist(), self._top_missing[used].tolist())
+        return {
+            'top': [(self.domain_ids.name(i), v) for i, v in heapq.nlargest(k, top, key=lambda item: item[1])],
+            'histogram': _histogram(self._hist.sum(axis=0)),
+        }
+
+    def reserve(self, dom_tld, n, max_pages=None):
+        """
+        Under the stripe of dom_tld only: domains of other stripes never wait.
+        A new domain is added under it too, by the first process to get there.
+        """
+        i, = self._intern([dom_tld])
+        chunk, slot, stripe, i = self._record(i)
+        with self._locked(stripe):
+            added = not chunk['alive'][slot]
+            if added:
+                self._reset(chunk, slot)
+            total = int(chunk['total'][slot])
+            count = n if max_pages is None else max(0, min(n, max_pages - total))
+            revived = count > 0 and chunk['state'][slot] == FINISHED
+            if count:
+                chunk['total'][slot] = total + count
+                chunk['missing'][slot] += count
+            if count or added:
+                event = self._refresh(chunk, slot, i)
+                if event:
+                    self._emit(event)
+        if added and self._owner():
+            self.local_stats.setdefault(dom_tld, {})
+        if revived:
+            self._revive(dom_tld)
+        return count
+
+    def release(self, dom_tld, n=1):
+        self._add(dom_tld, -n, -n)
+
+    def close(self):
+        """Detach from the segments; the creating process also unlinks them."""
+        if self._control is None:
+            return
+        owner = self._owner()
+        if owner:
+            # Also the segments created by other processes
+            if self._published_chunks():
+                self._chunk(self._published_chunks() - 1)
+            if self._published(1):
+                self._event_chunk(self._published(1) - 1)
+        self._chunks, self._event_chunks = [], []
+        self._summary = self._hist = self._top = self._top_missing = self._floor = self._ceiling = None
+        for shm in self._chunk_shms + self._event_shms + [self._summary_shm, self._control]:
+            try:
+                shm.close()
+                if owner:
+                    shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._chunk_shms, self._event_shms, self._control = [], [], None
@@ -0,0 +1,195 @@
+""" crawlers/cls_frontier.py """
+import os
+import pickle
+import shutil
+import tempfile
+from collections import deque
+from pathlib import Path
+from queue import Queue
+
+from ispider_core.crawlers.cls_queue_transport import BatchQueueMixin, LeaseTable, journal_dir, write_snapshot
+from ispider_core.utils.priorities import RequestPriority
+from ispider_core.utils.interning import intern_request
+
+
+class _Lane:
+    """FIFO of one priority level: memory head, then disk segments, oldest first."""
+
+    def __init__(self, spill_dir, segment_items):
+        self.spill_dir = spill_dir
+        self.segment_items = segment_items
+        self.head = deque()
+        self.segments = deque()   # closed segments: (path, items)
+        self.writer = None        # open segment file
+        self.writer_path = None
+        self.writer_items = 0
+        self.spilled = 0
+        self.next_segment = 0
+
+    def __len__(self):
+        return len(self.head) + self.spilled
+
+    def spill(self, item):
+        if self.writer is None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self.writer_path = self.spill_dir / f"seg_{self.next_segment:08d}.pkl"
+            self.writer = open(self.writer_path, 'ab')
+            self.writer_items = 0
+            self.next_segment += 1
+
+        pickle.dump(item, self.writer, protocol=pickle.HIGHEST_PROTOCOL)
+        self.writer_items += 1
+        self.spilled += 1
+
+        if self.writer_items >= self.segment_items:
+            self.close_writer()
+
+    def close_writer(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.segments.append((self.writer_path, self.writer_items))
+        self.writer = None
+
+    def page_in(self):
+        """Load the oldest segment into memory, return the number of items loaded."""
+        if not self.segments:
+            # Only the segment being written is left
+            self.close_writer()
+
+        path, items = self.segments.popleft()
+        with open(path, 'rb') as f:
+            for _ in range(items):
+                self.head.append(pickle.load(f))
+        os.remove(path)
+        self.spilled -= items
+        return items
+
+    def segments_count(self):
+        return len(self.segments) + (1 if self.writer is not None else 0)
+
+
+class SpillingFrontier(BatchQueueMixin, Queue):
+    """
+    Frontier for qout that keeps at most FRONTIER_MEMORY_ITEMS requests
+    in memory. Past that threshold new requests are appended to segment files
+    on disk, and segments are paged back in, oldest first, as the frontier
+    drains.
+
+    Requests are split in lanes by RequestPriority level (QUEUE_PRIORITIES),
+    the lowest non empty level is always served first, FIFO inside a lane.
+
+    It is served by a Manager process, so it inherits the blocking get/put
+    semantics of queue.Queue and only overrides the storage hooks.
+    With FRONTIER_JOURNAL it is journaled under path_data/journal/qout.
+
+    Segments go to a directory of their own under FRONTIER_SPILL_DIR,
+    removed by close(): they are never resumed from (the journal or the
+    checkpoint snapshot is), and another crawl may spill next to it.
+    """
+
+    def __init__(self, conf, resume=None):
+        self.memory_items = conf.get('FRONTIER_MEMORY_ITEMS') or 1_000_000
+        self.segment_items = conf.get('FRONTIER_SEGMENT_ITEMS') or max(1, self.memory_items // 10)
+        base = Path(conf.get('FRONTIER_SPILL_DIR') or Path(conf['path_data']) / 'frontier')
+        base.mkdir(parents=True, exist_ok=True)
+        self.spill_dir = Path(tempfile.mkdtemp(prefix='run_', dir=base))
+        self.priority = RequestPriority.from_conf(conf)
+        super().__init__(maxsize=0)
+        self.leases = LeaseTable()
+        self._open_journal(
+            journal_dir(conf, 'qout'), bool(conf.get('RESUME')) if resume is None else resume,
+            conf.get('FRONTIER_JOURNAL_COMPACT_MIN', 100_000))
+
+    # queue.Queue storage hooks, called under the queue mutex
+    def _init(self, maxsize):
+        self.lanes = {}
+        self.in_memory = 0
+
+    def _qsize(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def _put(self, item):
+        item = intern_request(item)
+        level = self.priority.level(item)
+        lane = self.lanes.get(level)
+        if lane is None:
+            lane = self.lanes[level] = _Lane(self.spill_dir / f"p{level:04d}", self.segment_items)
+
+        if self.journal is not None:
+            self.journal.put(level, item)
+
+        if not lane.spilled and self.in_memory < self.memory_items:
+            lane.head.append(item)
+            self.in_memory += 1
+            return
+        lane.spill(item)
+
+    def _get(self):
+        level = min(k for k, lane in self.lanes.items() if len(lane))
+        lane = self.lanes[level]
+        if self.journal is not None:
+            self.journal.got(level)
+        if not lane.head:
+            self.in_memory += lane.page_in()
+        self.in_memory -= 1
+        return lane.head.popleft()
+
+    def stats(self):
+        with self.mutex:
+            return {
+                'memory': self.in_memory,
+                'disk': sum(lane.spilled for lane in self.lanes.values()),
+                'segments': sum(lane.segments_count() for lane in self.lanes.values()),
+                'by_priority': self._backlog(),
+            }
+
+    def backlog(self):
+        """Queued requests by priority label."""
+        with self.mutex:
+            return self._backlog()
+
+    def _backlog(self):
+        return {
+            self.priority.label(k): len(lane)
+            for k, lane in sorted(self.lanes.items()) if len(lane)
+        }
+
+    def snapshot(self, path):
+        """
+        Write the queued and leased items to path without removing them, return how many.
+        Spilled segments are hard-linked under the mutex and read after,
+        so the frontier is only blocked for the in-memory copy.
+        """
+        parts = []
+        with self.mutex:
+            for _, lane in sorted(self.lanes.items()):
+                lane.close_writer()
+                parts.append(list(lane.head))
+                for seg_path, items in lane.segments:
+                    link = seg_path.with_name(f"snap_{seg_path.name}")
+                    os.link(seg_path, link)
+                    parts.append((link, items))
+            parts.append(self.leases.items())
+
+        def items():
+            for part in parts:
+                if isinstance(part, list):
+                    yield part
+                    continue
+                link, n = part
+                with open(link, 'rb') as f:
+                    yield [pickle.load(f) for _ in range(n)]
+                os.remove(link)
+
+        return write_snapshot(path, items())
+
+    def close(self):
+        with self.mutex:
+            for lane in self.lanes.values():
+                if lane.writer is not None:
+                    lane.writer.close()
+                    lane.writer = None
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            if self.journal is not None:
+                self.journal.close()
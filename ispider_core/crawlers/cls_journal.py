@@ -0,0 +1,191 @@
+""" crawlers/cls_journal.py """
+import os
+import pickle
+from collections import deque
+from pathlib import Path
+
+
+class FrontierJournal:
+    """
+    Append-only log of a queue made of FIFO lanes, one per priority level
+    (BatchQueue, SpillingFrontier).
+
+    Enqueues are logged with their level, dequeues only as a count per
+    level: lanes are FIFO, so replaying the puts and popping that many
+    items from each lane gives back the queue content.
+
+    Files in the journal directory:
+    - seg_N.log: records appended as the queue is used, a record is
+      ('p', [(level, item), ...]) or ('g', {level: count})
+    - snap_N.log: the queue content after all the segments <= N,
+      written by compaction; older files are then removed
+
+    Records are buffered and written in batches; checkpoint() makes them
+    durable and costs only what changed since the previous one.
+    Not thread safe: the owning queue calls it under its mutex.
+    """
+    BUFFER_ITEMS = 1000
+
+    def __init__(self, path, compact_min=100_000, compact_ratio=2):
+        self.path = Path(path)
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self.puts = []
+        self.gets = {}
+        self.buffered = 0
+        self.writer = None
+        self.segment = 0
+        self.since_snapshot = 0     # entries logged after the last snapshot
+        self.closed_entries = 0     # ... of which in closed segments
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        segments = self._files('seg_')
+        snapshots = self._files('snap_')
+        self.segment = max(segments + snapshots, default=0)
+
+    def _files(self, prefix):
+        return sorted(int(p.stem[len(prefix):]) for p in self.path.glob(f"{prefix}*.log"))
+
+    def _seg_path(self, n):
+        return self.path / f"seg_{n:08d}.log"
+
+    def _snap_path(self, n):
+        return self.path / f"snap_{n:08d}.log"
+
+    # Logging
+    def put(self, level, item):
+        self.puts.append((level, item))
+        self._added()
+
+    def got(self, level):
+        self.gets[level] = self.gets.get(level, 0) + 1
+        self._added()
+
+    def _added(self):
+        self.buffered += 1
+        if self.buffered >= self.BUFFER_ITEMS:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records, puts before gets."""
+        if not self.buffered:
+            return
+        if self.writer is None:
+            self.segment += 1
+            self.writer = open(self._seg_path(self.segment), 'ab')
+        if self.puts:
+            pickle.dump(('p', self.puts), self.writer, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.gets:
+            pickle.dump(('g', self.gets), self.writer, protocol=pickle.HIGHEST_PROTOCOL)
+        self.since_snapshot += self.buffered
+        self.puts, self.gets, self.buffered = [], {}, 0
+
+    def checkpoint(self):
+        """Make the records durable and close the segment, return the last closed segment."""
+        self.flush()
+        if self.writer is not None:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.writer.close()
+            self.writer = None
+        self.closed_entries = self.since_snapshot
+        return self.segment
+
+    def needs_compaction(self, live):
+        return self.closed_entries > max(self.compact_min, self.compact_ratio * live)
+
+    # Reading
+    @staticmethod
+    def _read(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+                except (pickle.UnpicklingError, ValueError, IndexError):
+                    # Truncated tail after a crash
+                    return
+
+    def replay(self, upto=None):
+        """Queue content as {level: deque of items}, from the last snapshot and the following segments."""
+        lanes = {}
+        snapshots = [n for n in self._files('snap_') if upto is None or n <= upto]
+        start = snapshots[-1] if snapshots else 0
+        paths = [self._snap_path(start)] if snapshots else []
+        paths += [self._seg_path(n) for n in self._files('seg_') if n > start and (upto is None or n <= upto)]
+
+        for path in paths:
+            for kind, data in self._read(path):
+                if kind == 'p':
+                    for level, item in data:
+                        lanes.setdefault(level, deque()).append(item)
+                else:
+                    for level, n in data.items():
+                        lane = lanes.get(level, ())
+                        for _ in range(min(n, len(lane))):
+                            lane.popleft()
+        return lanes
+
+    # Compaction
+    def compact(self, upto):
+        """
+        Replace the segments <= upto (closed by checkpoint()) with one
+        snapshot. Only reads and removes closed files, so the queue can
+        keep logging in the meanwhile. None if already compacted that far.
+        """
+        snapshots = self._files('snap_')
+        if snapshots and snapshots[-1] >= upto:
+            return None
+        lanes = self.replay(upto)
+        self.write_snapshot(upto, lanes)
+        return sum(len(lane) for lane in lanes.values())
+
+    def write_snapshot(self, n, lanes):
+        tmp = self.path / f"snap_{n:08d}.tmp"
+        with open(tmp, 'wb') as f:
+            for level, lane in sorted(lanes.items()):
+                items = list(lane)
+                for i in range(0, len(items), self.BUFFER_ITEMS):
+                    chunk = [(level, item) for item in items[i:i + self.BUFFER_ITEMS]]
+                    pickle.dump(('p', chunk), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._snap_path(n))
+
+        for m in self._files('seg_'):
+            if m <= n:
+                os.remove(self._seg_path(m))
+        for m in self._files('snap_'):
+            if m < n:
+                os.remove(self._snap_path(m))
+
+    def compacted(self, entries_removed):
+        """Account a compaction done outside the owner lock."""
+        self.since_snapshot -= entries_removed
+        self.closed_entries = 0
+
+    def reset(self, lanes=None, n=1):
+        """
+        Start over from lanes (the current queue content), or empty,
+        as snapshot n: a resumed journal keeps the number it was replayed
+        up to, so the checkpoint that referenced it stays valid.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.puts, self.gets, self.buffered = [], {}, 0
+        # Past n: not part of what is restarted from. The files <= n stay
+        # until the new snapshot is in place, a crash meanwhile loses nothing
+        for prefix, path in (('seg_', self._seg_path), ('snap_', self._snap_path)):
+            for m in self._files(prefix):
+                if m > n:
+                    os.remove(path(m))
+        for tmp in self.path.glob('*.tmp'):
+            tmp.unlink()
+        self.segment = n
+        self.write_snapshot(self.segment, lanes or {})
+        self.since_snapshot = self.closed_entries = 0
+
+    def close(self):
+        self.checkpoint()
@@ -21,10 +21,13 @@ class QueueOut:
         self.engine_selector = engine.EngineSelector(conf['ENGINES'])
         self.q = q
 
-    def fullfill_q(self, url, dom_tld, rd, depth=0, engine='httpx'):
+    def fullfill_q(self, url, dom_tld, rd, depth=0, engine='httpx', batch=None):
         self.dom_stats.add_missing_total(dom_tld)
         reqA = (url, rd, dom_tld, 0, depth, engine)
-        self.q.put(reqA)
+        if batch is not None:
+            batch.append(reqA)
+        else:
+            self.q.put(reqA)
 
 
     def fullfill(self, stage):
@@ -33,6 +36,7 @@ class QueueOut:
         total = len(self.conf['domains'])
         self.logger.info(f"[{stage}] Fullfill the queue for {total} domains")
         processed = 0
+        batch = []
 
         for url in self.conf['domains']:
             try:
@@ -72,12 +76,19 @@ class QueueOut:
                 # Add the domain with its original name
                 self.dom_stats.add_domain(dom_tld)
                 self.logger.debug(f"Added {dom_tld}")
-                self.fullfill_q(url, dom_tld, rd='landing_page', depth=0, engine=self.engine_selector.next())
+                self.fullfill_q(url, dom_tld, rd='landing_page', depth=0, engine=self.engine_selector.next(), batch=batch)
+
+                if len(batch) >= 10000:
+                    self.q.put_many(batch)
+                    batch = []
 
             except Exception as e:
                 self.logger.error(e)
                 continue
 
+        if batch:
+            self.q.put_many(batch)
+
         try:
             tt = round((time.time() - t0), 5)
             self.logger.info(f"Queue Fullfilled, QSize: {self.q.qsize()} [already finished: {str(self.tot_finished)}]")
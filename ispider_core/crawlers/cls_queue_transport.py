@@ -0,0 +1,631 @@
+""" crawlers/cls_queue_transport.py """
+import os
+import time
+import itertools
+import pickle
+import struct
+import threading
+import multiprocessing as mp
+from collections import Counter, deque
+from multiprocessing import shared_memory
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from queue import Queue, Empty, Full
+
+from ispider_core.crawlers.cls_journal import FrontierJournal
+from ispider_core.utils.priorities import RequestPriority
+from ispider_core.utils.interning import intern_request
+
+
+SNAPSHOT_CHUNK = 10000
+
+
+def write_snapshot(path, parts):
+    """Write the items of parts (lists, in queue order) to path in pickled chunks, return how many."""
+    n = 0
+    with open(path, 'wb') as f:
+        for part in parts:
+            for i in range(0, len(part), SNAPSHOT_CHUNK):
+                chunk = part[i:i + SNAPSHOT_CHUNK]
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                n += len(chunk)
+    return n
+
+
+def read_snapshot(path):
+    """Yield the chunks of items written by write_snapshot."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class LeaseTable:
+    """
+    Items handed out by get_many(lease=True) and not acknowledged yet with
+    ack(): requests being fetched, or waiting in the domain scheduler.
+    Queue snapshots include them, so a resumed crawl gets them back.
+
+    Between hold() and release(), acknowledged items are kept too: a
+    checkpoint sees an item leased until its effects (seen filter, new
+    requests) were there before the checkpoint started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leased = Counter()
+        self.held = None
+
+    def lease(self, items):
+        with self.lock:
+            self.leased.update(items)
+
+    def ack(self, items):
+        """Forget items, return the ones that were not leased here."""
+        rest = []
+        with self.lock:
+            for item in items:
+                n = self.leased.get(item, 0)
+                if not n:
+                    rest.append(item)
+                    continue
+                if n == 1:
+                    del self.leased[item]
+                else:
+                    self.leased[item] = n - 1
+                if self.held is not None:
+                    self.held.append(item)
+        return rest
+
+    def hold(self):
+        with self.lock:
+            if self.held is None:
+                self.held = []
+
+    def release(self):
+        with self.lock:
+            self.held = None
+
+    def items(self):
+        """Leased items, and the ones acknowledged since hold()."""
+        with self.lock:
+            return [*self.leased.elements(), *(self.held or [])]
+
+
+class BatchQueueMixin:
+    """
+    put_many/get_many for queue.Queue subclasses served by a Manager:
+    a whole block of requests crosses the process boundary in one call.
+
+    Also the optional FrontierJournal of queues made of FIFO lanes
+    by priority level: _put/_get log to self.journal when set, and the
+    LeaseTable of the items taken with get_many(lease=True).
+    """
+    journal = None
+
+    def put_many(self, items, block=True, timeout=None):
+        for item in items:
+            self.put(item, block, timeout)
+
+    def get_many(self, max_items, block=True, timeout=None, lease=False):
+        """
+        Wait for the first item like get(), then take what is ready up to
+        max_items. With lease, they stay in snapshots until ack(items).
+        """
+        with self.not_empty:
+            if not self.not_empty.wait_for(self._qsize, timeout if block else 0):
+                raise Empty
+            items = []
+            while len(items) < max_items and self._qsize():
+                items.append(self._get())
+            if lease:
+                self.leases.lease(items)
+            self.not_full.notify_all()
+        return items
+
+    def ack(self, items):
+        """Items of get_many(lease=True) that were handled, return the ones not leased here."""
+        return self.leases.ack(items)
+
+    def hold_acks(self):
+        self.leases.hold()
+
+    def release_acks(self):
+        self.leases.release()
+
+    def _open_journal(self, journal_dir, resume=False, compact_min=100_000):
+        """
+        Log the queue to journal_dir. On resume, rebuild it from there first:
+        resume is True to replay the whole journal, or the segment number
+        recorded by a checkpoint to replay up to it.
+        """
+        if journal_dir is None:
+            return
+        journal = FrontierJournal(journal_dir, compact_min=compact_min)
+        lanes = {}
+        start = 1
+        if resume:
+            upto = None if resume is True else resume
+            for lane in journal.replay(upto).values():
+                for item in lane:
+                    self._put(item)
+                    lanes.setdefault(self.priority.level(item), []).append(item)
+            start = upto or max(journal.segment, 1)
+        # Restart the journal from the rebuilt content, levels may have changed
+        journal.reset(lanes, start)
+        self.journal = journal
+
+    def checkpoint(self, compact=True, leased=None):
+        """
+        Make the journal durable up to now and return the last segment
+        written, to replay up to it (None when the queue has no journal).
+        The journal has no leased items: with leased, they are written
+        there, see write_snapshot. With compact, compact_journal() follows.
+        """
+        if self.journal is None:
+            return None
+        with self.mutex:
+            upto = self.journal.checkpoint()
+            items = self.leases.items()
+        if leased is not None:
+            write_snapshot(leased, [items])
+        if compact:
+            self.compact_journal(upto)
+        return upto
+
+    def compact_journal(self, upto):
+        """
+        Compact the journal up to segment upto when it grew past
+        FRONTIER_JOURNAL_COMPACT_MIN and twice the queued items.
+        """
+        with self.mutex:
+            compact = self.journal.needs_compaction(self._qsize())
+            closed = self.journal.closed_entries
+        if compact:
+            # Closed segments only: the queue keeps working meanwhile
+            self.journal.compact(upto)
+            with self.mutex:
+                self.journal.compacted(closed)
+
+
+class BatchQueue(BatchQueueMixin, Queue):
+    """
+    Manager-served queue with batch operations and optional priorities:
+    one FIFO lane per RequestPriority level, lowest level served first.
+
+    The producer can block in wait_below() until consumers drain the queue
+    under a low-water mark, and put_many() tells how long the queue sat
+    empty before the new items arrived.
+    """
+
+    def __init__(self, maxsize=0, priorities=None, by_depth=True,
+            journal_dir=None, resume=False, compact_min=100_000):
+        self.priority = RequestPriority(priorities, by_depth)
+        super().__init__(maxsize)
+        self.below = threading.Condition(self.mutex)
+        self.leases = LeaseTable()
+        self._open_journal(journal_dir, resume, compact_min)
+
+    def _init(self, maxsize):
+        self.lanes = {}
+        self.count = 0
+        self.empty_since = time.monotonic()
+
+    def _qsize(self):
+        return self.count
+
+    def _put(self, item):
+        item = intern_request(item)
+        level = self.priority.level(item)
+        lane = self.lanes.get(level)
+        if lane is None:
+            lane = self.lanes[level] = deque()
+        lane.append(item)
+        self.count += 1
+        self.empty_since = None
+        if self.journal is not None:
+            self.journal.put(level, item)
+
+    def _get(self):
+        level = min(k for k, lane in self.lanes.items() if lane)
+        self.count -= 1
+        if not self.count:
+            self.empty_since = time.monotonic()
+        self.below.notify_all()
+        if self.journal is not None:
+            self.journal.got(level)
+        return self.lanes[level].popleft()
+
+    def put_many(self, items, block=True, timeout=None):
+        """Put items, return the seconds the queue had been empty before them."""
+        with self.mutex:
+            empty_for = time.monotonic() - self.empty_since if self.empty_since is not None else 0
+        super().put_many(items, block, timeout)
+        return empty_for
+
+    def snapshot(self, path):
+        """Write the queued and leased items to path without removing them, return how many."""
+        with self.mutex:
+            parts = [list(lane) for _, lane in sorted(self.lanes.items())]
+            parts.append(self.leases.items())
+        return write_snapshot(path, parts)
+
+    def wait_below(self, n, timeout=None):
+        """Block until fewer than n items are queued or timeout expires, return the queue size."""
+        with self.below:
+            self.below.wait_for(lambda: self.count < n, timeout)
+            return self.count
+
+    def backlog(self):
+        """Queued requests by priority label."""
+        with self.mutex:
+            return {
+                self.priority.label(k): len(lane)
+                for k, lane in sorted(self.lanes.items()) if lane
+            }
+
+
+class QueueManager(BaseManager):
+    pass
+
+QueueManager.register('BatchQueue', BatchQueue)
+QueueManager.register('LeaseTable', LeaseTable)
+
+
+class ShmRingQueue:
+    """
+    Queue with the same API as the Manager queue (put/get/qsize/empty/...),
+    but items move through a shared-memory byte ring instead of being pickled
+    through the Manager server process.
+
+    Each record is a 4-byte length followed by the pickled item, or by the
+    item encoded with codec (dumps/loads, like interning.RequestCodec).
+    The ring is guarded by one multiprocessing lock, two conditions wake up
+    blocked producers and consumers. The header also keeps when the ring
+    became empty (time.monotonic(), system wide), for put_many().
+
+    With an overflow queue (put_many/get_many/snapshot, like a Manager
+    BatchQueue), producers never block: a batch the ring can't take goes
+    there, and so do the next ones until it is empty again. Consumers take
+    the ring items first, then the overflow ones: FIFO order is kept.
+
+    Items taken with get_many(lease=True) are kept in leases, a LeaseTable
+    shared by the processes (a Manager proxy), until ack(items); without
+    leases, only the overflow keeps track of its own.
+
+    Like any multiprocessing lock, it must reach other processes by
+    inheritance (mp.Process args), not through a Pool task.
+    """
+    # head offset, tail offset, items count, items in overflow, empty since
+    _HEADER = struct.Struct('<QQQqd')
+    _LEN = struct.Struct('<I')
+
+    def __init__(self, maxsize=0, capacity=64 * 1024 * 1024, codec=None, overflow=None, leases=None):
+        self.maxsize = maxsize
+        self.capacity = capacity
+        self.codec = codec
+        self.overflow = overflow
+        self.leases = leases
+        self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER.size + capacity)
+        self._HEADER.pack_into(self._shm.buf, 0, 0, 0, 0, 0, time.monotonic())
+        self._lock = mp.Lock()
+        self._not_empty = mp.Condition(self._lock)
+        self._not_full = mp.Condition(self._lock)
+        self._owner_pid = os.getpid()
+
+    def __getstate__(self):
+        return {
+            'maxsize': self.maxsize,
+            'capacity': self.capacity,
+            'codec': self.codec,
+            'overflow': self.overflow,
+            'leases': self.leases,
+            'name': self._shm.name,
+            'lock': self._lock,
+            'not_empty': self._not_empty,
+            'not_full': self._not_full,
+            'owner_pid': self._owner_pid,
+        }
+
+    def __setstate__(self, state):
+        self.maxsize = state['maxsize']
+        self.capacity = state['capacity']
+        self.codec = state['codec']
+        self.overflow = state['overflow']
+        self.leases = state['leases']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._lock = state['lock']
+        self._not_empty = state['not_empty']
+        self._not_full = state['not_full']
+        self._owner_pid = state['owner_pid']
+
+    def _dumps(self, item):
+        if self.codec is not None:
+            return self.codec.dumps(item)
+        return pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _loads(self, data):
+        if self.codec is not None:
+            return self.codec.loads(data)
+        return pickle.loads(data)
+
+    # Ring helpers, always called under the lock
+    def _header(self):
+        return self._HEADER.unpack_from(self._shm.buf, 0)
+
+    def _write(self, offset, data):
+        base = self._HEADER.size
+        pos = offset % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self._shm.buf[base + pos:base + pos + first] = data[:first]
+        if first < len(data):
+            self._shm.buf[base:base + len(data) - first] = data[first:]
+
+    def _read(self, offset, size):
+        base = self._HEADER.size
+        pos = offset % self.capacity
+        first = min(size, self.capacity - pos)
+        data = bytes(self._shm.buf[base + pos:base + pos + first])
+        if first < size:
+            data += bytes(self._shm.buf[base:base + size - first])
+        return data
+
+    def _has_room(self, head, tail, count, need, items=1):
+        if self.maxsize > 0 and count + items > self.maxsize:
+            return False
+        return self.capacity - (tail - head) >= need
+
+    @staticmethod
+    def _remaining(deadline):
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+
+    def put(self, item, block=True, timeout=None):
+        self.put_many([item], block, timeout)
+
+    def get(self, block=True, timeout=None):
+        return self.get_many(1, block, timeout)[0]
+
+    def ack(self, items):
+        """Items of get_many(lease=True) that were handled, return the ones not leased here."""
+        if self.leases is not None:
+            items = self.leases.ack(items)
+        if self.overflow is not None and items:
+            items = self.overflow.ack(items)
+        return items
+
+    def hold_acks(self):
+        if self.leases is not None:
+            self.leases.hold()
+        if self.overflow is not None:
+            self.overflow.hold_acks()
+
+    def release_acks(self):
+        if self.leases is not None:
+            self.leases.release()
+        if self.overflow is not None:
+            self.overflow.release_acks()
+
+    def put_many(self, items, block=True, timeout=None):
+        """
+        Put all the items or none of them (Full), return the seconds the
+        ring had been empty before them. With an overflow queue, a batch
+        the ring can't take right now goes there instead.
+        """
+        records = []
+        for item in items:
+            data = self._dumps(item)
+            records.append(self._LEN.pack(len(data)) + data)
+            if len(records[-1]) > self.capacity:
+                raise ValueError(f"Item of {len(records[-1])} bytes exceeds ring capacity {self.capacity}")
+        if not records:
+            return 0
+        need = sum(len(record) for record in records)
+        fits = need <= self.capacity and (self.maxsize <= 0 or len(records) <= self.maxsize)
+        if not fits and self.overflow is None:
+            raise ValueError(f"Batch of {len(records)} items and {need} bytes can never fit the ring")
+
+        if self.overflow is not None:
+            block = False
+        deadline = time.monotonic() + timeout if (block and timeout is not None) else None
+        with self._not_full:
+            head, tail, count, spilled, empty_since = self._header()
+            empty_for = time.monotonic() - empty_since if count == 0 else 0
+            if spilled > 0:
+                # Behind the items already spilled, not ahead of them
+                fits = False
+            while fits and not self._has_room(head, tail, count, need, len(records)):
+                remaining = self._remaining(deadline)
+                if not block or (remaining is not None and remaining <= 0):
+                    if self.overflow is None:
+                        raise Full
+                    fits = False
+                    break
+                self._not_empty.notify_all()
+                self._not_full.wait(remaining)
+                head, tail, count, spilled, empty_since = self._header()
+
+            if fits:
+                for record in records:
+                    self._write(tail, record)
+                    tail += len(record)
+                self._HEADER.pack_into(self._shm.buf, 0, head, tail, count + len(records), spilled, 0)
+                self._not_empty.notify_all()
+                return empty_for
+
+        # Ring full, or items already spilled: the batch waits in the overflow queue
+        self.overflow.put_many(list(items))
+        self._add_spilled(len(records))
+        return 0
+
+    def _add_spilled(self, n):
+        with self._not_empty:
+            head, tail, count, spilled, empty_since = self._header()
+            self._HEADER.pack_into(self._shm.buf, 0, head, tail, count, spilled + n, empty_since)
+            if n > 0:
+                self._not_empty.notify_all()
+
+    def _get_overflow(self, max_items, lease):
+        """Items taken from the overflow queue, [] when it has none."""
+        with self._lock:
+            if self._header()[3] <= 0:
+                return []
+        try:
+            items = self.overflow.get_many(max_items, block=False, lease=lease)
+        except Empty:
+            return []
+        self._add_spilled(-len(items))
+        return items
+
+    def get_many(self, max_items, block=True, timeout=None, lease=False):
+        """
+        Wait for the first item like get(), then take what is ready up to
+        max_items. With lease, they stay in snapshots until ack(items).
+        """
+        lease = lease and self.leases is not None
+        deadline = time.monotonic() + timeout if (block and timeout is not None) else None
+        while True:
+            chunks = []
+            with self._not_empty:
+                head, tail, count, spilled, empty_since = self._header()
+                while count == 0 and spilled <= 0:
+                    remaining = self._remaining(deadline)
+                    if not block or (remaining is not None and remaining <= 0):
+                        raise Empty
+                    self._not_empty.wait(remaining)
+                    head, tail, count, spilled, empty_since = self._header()
+                while count and len(chunks) < max_items:
+                    size = self._LEN.unpack(self._read(head, self._LEN.size))[0]
+                    chunks.append(self._read(head + self._LEN.size, size))
+                    head += self._LEN.size + size
+                    count -= 1
+                if chunks:
+                    if count == 0:
+                        # Empty ring: rewind offsets so they never grow unbounded
+                        head = tail = 0
+                        empty_since = time.monotonic()
+                    self._HEADER.pack_into(self._shm.buf, 0, head, tail, count, spilled, empty_since)
+                    # Wake producers blocked on a full ring and wait_below() alike
+                    self._not_full.notify_all()
+                    if lease:
+                        # Under the lock, like snapshot(): the items are always in one of them
+                        items = [self._loads(data) for data in chunks]
+                        self.leases.lease(items)
+                        return items
+            if chunks:
+                return [self._loads(data) for data in chunks]
+
+            # Ring drained: the spilled items, all put after the ring ones
+            items = self._get_overflow(max_items, lease)
+            if items:
+                return items
+
+    def wait_below(self, n, timeout=None):
+        """Block until fewer than n items are queued or timeout expires, return the queue size."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._not_full:
+            count = self._header()[2]
+            while count >= n:
+                remaining = self._remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    break
+                self._not_full.wait(remaining)
+                count = self._header()[2]
+            return count
+
+    def checkpoint(self, compact=True, leased=None):
+        """No journal: checkpoints take a snapshot() of the ring instead."""
+        return None
+
+    def snapshot(self, path):
+        """Write the queued and leased items to path without removing them, return how many."""
+        with self._lock:
+            head, tail, count, spilled, empty_since = self._header()
+            raw = self._read(head, tail - head)
+            leased = self.leases.items() if self.leases is not None else []
+
+        items = []
+        offset = 0
+        for _ in range(count):
+            size = self._LEN.unpack_from(raw, offset)[0]
+            offset += self._LEN.size
+            items.append(self._loads(raw[offset:offset + size]))
+            offset += size
+        if self.overflow is None:
+            return write_snapshot(path, [items, leased])
+
+        spill_path = Path(path).with_name(f"{Path(path).name}.overflow")
+        self.overflow.snapshot(spill_path)
+        try:
+            return write_snapshot(path, itertools.chain([items, leased], read_snapshot(spill_path)))
+        finally:
+            spill_path.unlink(missing_ok=True)
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self._lock:
+            head, tail, count, spilled, empty_since = self._header()
+            return count + max(spilled, 0)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        with self._lock:
+            count = self._header()[2]
+            return self.maxsize > 0 and count >= self.maxsize
+
+    def close(self):
+        """Detach from the segment; the creating process also unlinks it."""
+        try:
+            self._shm.close()
+            if os.getpid() == self._owner_pid:
+                self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def journal_dir(conf, name):
+    """Journal directory of the queue name ('qin', 'qout'), None if FRONTIER_JOURNAL is off."""
+    if not conf.get('FRONTIER_JOURNAL') or name is None:
+        return None
+    return Path(conf['path_data']) / 'journal' / name
+
+
+def build_queue(conf, manager, maxsize=0, capacity=None, name=None, resume=None, codec=None, overflow=None):
+    """
+    Build a crawl queue using the transport selected by conf['QUEUE_TRANSPORT']:
+    - 'manager': BatchQueue served by manager, a started BaseManager
+      with BatchQueue and LeaseTable registered, like QueueManager (default).
+      Journaled under path_data/journal/<name> with FRONTIER_JOURNAL.
+    - 'shm': ShmRingQueue, shared-memory ring buffer, always FIFO, no journal,
+      items encoded with codec when given, spilling to overflow when full,
+      its leases in a LeaseTable served by manager
+
+    resume overrides conf['RESUME'] for the journal, see BatchQueueMixin._open_journal.
+    """
+    transport = conf.get('QUEUE_TRANSPORT', 'manager')
+
+    if transport == 'manager':
+        return manager.BatchQueue(
+            maxsize=maxsize,
+            priorities=conf.get('QUEUE_PRIORITIES'),
+            by_depth=conf.get('QUEUE_PRIORITY_BY_DEPTH', True),
+            journal_dir=journal_dir(conf, name),
+            resume=bool(conf.get('RESUME')) if resume is None else resume,
+            compact_min=conf.get('FRONTIER_JOURNAL_COMPACT_MIN', 100_000))
+
+    if transport == 'shm':
+        capacity = capacity or conf.get('QUEUE_SHM_BYTES', 64 * 1024 * 1024)
+        return ShmRingQueue(maxsize=maxsize, capacity=capacity, codec=codec, overflow=overflow,
+                            leases=manager.LeaseTable())
+
+    raise ValueError(f"Unknown QUEUE_TRANSPORT: {transport}")
@@ -1,60 +1,304 @@
-import multiprocessing
-
-import hashlib
-import pathlib
+import math
 import os
+import shutil
+import struct
+import tempfile
+import threading
+import weakref
 import multiprocessing
+from collections import Counter
+from multiprocessing import shared_memory
+from pathlib import Path
 
-from pybloom_live import BloomFilter
+import numpy as np
 
-from ispider_core.utils.ifiles import get_dump_file_name  # or include get_dump_file_name directly here
+from ispider_core.utils import domains, seen_index
 from ispider_core.utils.logger import LoggerFactory
+from ispider_core.utils.seen_index import fingerprint
 
 from multiprocessing.managers import BaseManager
 
+
+# Third probe hash, from the fingerprint times the 64-bit golden ratio
+MIX = 0x9E3779B97F4A7C15
+MASK64 = 0xFFFFFFFFFFFFFFFF
+MASK32 = 0xFFFFFFFF
+
+
+def is_checked(reqA):
+    # Just internal urls, and not retries
+    return reqA[1] == 'internal_url' and reqA[3] == 0
+
+
+def drop_seen(seen_filter, reqsA, dom_stats, mark=False, unique=False, canonicalizer=None):
+    """
+    Requests of reqsA not seen yet, checked in one call; the domain counters
+    of the dropped ones are reduced. With unique, duplicates within reqsA
+    are dropped too. mark implies unique, and marks the returned ones as seen.
+    With a UrlCanonicalizer, requests are looked up, deduplicated and marked
+    by the key of their url, and returned as they are.
+    """
+    keys = canonicalizer.key_reqs(reqsA) if canonicalizer is not None else reqsA
+    idx = list(_kept(keys, seen_filter.filter_unseen(keys)))
+    if mark or unique:
+        unique_idx, seen = [], set()
+        for i in idx:
+            if is_checked(keys[i]):
+                if (keys[i][0], keys[i][2]) in seen:
+                    continue
+                seen.add((keys[i][0], keys[i][2]))
+            unique_idx.append(i)
+        idx = unique_idx
+    if mark:
+        seen_filter.mark_seen([keys[i] for i in idx])
+
+    kept = [reqsA[i] for i in idx]
+    if len(kept) < len(reqsA):
+        dropped = Counter(reqA[2] for reqA in reqsA)
+        dropped.subtract(reqA[2] for reqA in kept)
+        for dom_tld, n in dropped.items():
+            if n:
+                dom_stats.release(dom_tld, n)
+    return kept
+
+
+def _kept(reqsA, kept):
+    """Indexes in reqsA of kept, an ordered subsequence of reqsA."""
+    it = iter(kept)
+    nxt = next(it, None)
+    for i, reqA in enumerate(reqsA):
+        if nxt is not None and reqA == nxt:
+            yield i
+            nxt = next(it, None)
+
+
 class SeenFilter:
-    def __init__(self, conf, lock, capacity=10_000_000, error_rate=0.001):
+    """
+    Scalable Bloom filter of the requests already fetched or released.
+
+    Starts with one stage sized for SEEN_FILTER_CAPACITY requests. When the
+    last stage is full a new one is added, GROWTH times bigger and with a
+    TIGHTENING times lower error rate: the false positive rate stays under
+    SEEN_FILTER_ERROR_RATE however many requests are added, and small
+    crawls only use a small filter.
+
+    Each request is hashed once to a 64-bit fingerprint, the num_slices
+    probes of a stage (one per slice of bits_per_slice bits) are derived
+    from it by enhanced double hashing: the i*i*h3 term keeps probe sets
+    distinct on the small first stages, where plain double hashing only
+    has bits_per_slice**2 of them. filter_unseen/mark_seen work on whole
+    blocks: probes are computed and tested with numpy, under one lock
+    acquisition.
+    """
+    SMALL_BLOCK = 4
+    LOAD_BLOCK = 1_000_000
+    GROWTH = 2
+    TIGHTENING = 0.5
+    MAX_STAGES = 32
+    MIN_SLICE_BITS = 4096   # enough distinct probe sets however small the stage
+    FILE_MAGIC = b'ISPSEEN3'
+    _FILE_HEADER = struct.Struct('<8sQdQ')  # magic, first stage capacity, error rate, stages
+    _STAGE_COUNT = struct.Struct('<Q')
+
+    def __init__(self, conf, lock, capacity=None, error_rate=None):
         self.conf = conf
         self.lock = lock
-        self.bloom = BloomFilter(capacity=capacity, error_rate=error_rate)
         self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._setup(capacity or conf.get('SEEN_FILTER_CAPACITY', 1_000_000),
+                    error_rate or conf.get('SEEN_FILTER_ERROR_RATE', 0.001))
+        self.arrays = []
+        self.counts = []
+        self._grow()
 
         self._load_existing_hashes()
 
-    def _hash_from_req(self, reqA):
-        rd = reqA[1]
-        url = reqA[0]
-        dom_tld = reqA[2]
+    def _setup(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.geometries = []
 
-        h = hashlib.sha256(str(f"{url}|{dom_tld}").encode('utf-8')).hexdigest()
-        return h
+    @classmethod
+    def stage_geometry(cls, capacity, error_rate, i):
+        """(capacity, num_slices, bits_per_slice, num_bytes) of stage i."""
+        # The stages error rates add up to at most error_rate
+        return cls.geometry(capacity * cls.GROWTH ** i,
+                            error_rate * (1 - cls.TIGHTENING) * cls.TIGHTENING ** i)
+
+    @classmethod
+    def geometry(cls, capacity, error_rate):
+        """(capacity, num_slices, bits_per_slice, num_bytes) of a Bloom filter."""
+        num_slices = int(math.ceil(math.log(1.0 / error_rate, 2)))
+        bits_per_slice = max(cls.MIN_SLICE_BITS, int(math.ceil(
+            (capacity * abs(math.log(error_rate))) / (num_slices * (math.log(2) ** 2)))))
+        return capacity, num_slices, bits_per_slice, (num_slices * bits_per_slice + 7) // 8
 
     def _load_existing_hashes(self):
-        path_dumps = self.conf['path_dumps']
-        for path in pathlib.Path(path_dumps).rglob("*.html"):
-            h = hashlib.sha256(str(path).encode('utf-8')).hexdigest()
-            with self.lock:
-                self.bloom.add(h)
+        """Requests fetched by previous runs, from the seen index of path_dumps."""
+        loaded = 0
+        for index in seen_index.load(self.conf):
+            for i in range(0, len(index), self.LOAD_BLOCK):
+                with self.lock:
+                    loaded += self._set_array(index['fp'][i:i + self.LOAD_BLOCK])
+        if loaded:
+            self.logger.info(f"Seen filter: {loaded} requests fetched by previous runs")
 
     def bloom_len(self):
-        return len(self.bloom)
+        self._sync()
+        return int(sum(self.counts[:len(self.arrays)]))
 
-    def req_in_seen(self, reqA):
-        # Just internal urls
-        if reqA[1] != 'internal_url':
-            return False
+    def stats(self):
+        """Items, stages, fill ratio, estimated false positive rate and bytes used."""
+        with self.lock:
+            self._sync()
+            stages = [(self.geometries[i], int(self.counts[i])) for i in range(len(self.arrays))]
+        capacity = sum(geometry[0] for geometry, _ in stages)
+        items = sum(count for _, count in stages)
+        # A stage answers wrongly when the k probes hit set bits
+        not_fp = 1.0
+        for (_, k, m, _), count in stages:
+            not_fp *= 1 - (1 - math.exp(-count / m)) ** k
+        return {
+            'items': items,
+            'stages': len(stages),
+            'capacity': capacity,
+            'fill_ratio': round(items / capacity, 4),
+            'fp_rate': 1 - not_fp,
+            'bytes': sum(geometry[3] for geometry, _ in stages),
+        }
 
-        # Avoid if retry
-        if reqA[3] > 0:
-            return False
+    # Stages, SharedSeenFilter keeps them in shared memory
+    def _grow(self):
+        i = len(self.arrays)
+        if i >= self.MAX_STAGES:
+            raise IndexError(f"Seen filter full: {self.MAX_STAGES} stages")
+        self.geometries.append(self.stage_geometry(self.capacity, self.error_rate, i))
+        self.arrays.append(np.zeros(self.geometries[i][3], dtype=np.uint8))
+        self.counts.append(0)
+
+    def _sync(self):
+        """Catch up with stages added by other processes."""
+
+    # Bits, the callers hold the lock when needed
+    @staticmethod
+    def _probes(fps, k, m):
+        """Probe positions, one row of k per fingerprint."""
+        fps = np.asarray(fps, dtype=np.uint64)
+        h1 = fps.astype(np.uint32)
+        h2 = (fps >> np.uint64(32)).astype(np.uint32) | np.uint32(1)
+        h3 = ((fps * np.uint64(MIX)) >> np.uint64(32)).astype(np.uint32)
+        i = np.arange(k, dtype=np.uint32)
+        # 32-bit hash per slice, wrapping; mapped to [0, m) by multiply-shift
+        x = h1[:, None] + i * h2[:, None] + (i * i) * h3[:, None]
+        m = np.uint64(m)
+        return ((x.astype(np.uint64) * m) >> np.uint64(32)) + i.astype(np.uint64) * m
 
-        h = self._hash_from_req(reqA)
+    def _test_stage(self, i, fps):
+        _, k, m, _ = self.geometries[i]
+        bits = self.arrays[i]
+        if len(fps) <= self.SMALL_BLOCK:
+            # Cheaper than setting up the arrays
+            out = []
+            for fp in fps:
+                h1, h2, h3 = fp & MASK32, (fp >> 32) | 1, (fp * MIX & MASK64) >> 32
+                out.append(all(
+                    bits[p >> 3] >> (p & 7) & 1
+                    for p in ((((h1 + j * h2 + j * j * h3) & MASK32) * m >> 32) + j * m
+                              for j in range(k))))
+            return out
+        return self._hits(i, fps).tolist()
+
+    def _hits(self, i, fps):
+        """Numpy bool array, whether stage i has all the bits of each fingerprint set."""
+        _, k, m, _ = self.geometries[i]
+        pos = self._probes(fps, k, m)
+        got = (self.arrays[i][pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+        return got.all(axis=1)
+
+    def _set_stage(self, i, fps):
+        _, k, m, _ = self.geometries[i]
+        pos = self._probes(fps, k, m).ravel()
+        bit = (pos & np.uint64(7)).astype(np.uint8)
+        np.bitwise_or.at(self.arrays[i], pos >> np.uint64(3), np.uint8(1) << bit)
+
+    def _test(self, fps):
+        """For each fingerprint, whether a stage has all its bits set."""
+        self._sync()
+        todo = list(range(len(fps)))
+        # Newest first, recent duplicates are the most likely
+        for i in reversed(range(len(self.arrays))):
+            if not todo:
+                break
+            found = self._test_stage(i, [fps[j] for j in todo])
+            todo = [j for j, f in zip(todo, found) if not f]
+        out = [True] * len(fps)
+        for j in todo:
+            out[j] = False
+        return out
+
+    def _set(self, fps):
+        """Add the fingerprints not found in any stage to the last one, return how many."""
+        fps = list(dict.fromkeys(fps))
+        new = [fp for fp, found in zip(fps, self._test(fps)) if not found]
+        added = len(new)
+        while new:
+            i = len(self.arrays) - 1
+            room = self.geometries[i][0] - int(self.counts[i])
+            if room <= 0:
+                self._grow()
+                continue
+            chunk, new = new[:room], new[room:]
+            self._set_stage(i, chunk)
+            self.counts[i] += len(chunk)
+        return added
+
+    def _set_array(self, fps):
+        """_set for a large uint64 array, without leaving numpy."""
+        self._sync()
+        fps = np.sort(fps)
+        fps = fps[np.concatenate(([True], fps[1:] != fps[:-1]))]
+        for i in range(len(self.arrays)):
+            if self.counts[i]:
+                fps = fps[~self._hits(i, fps)]
+        added = len(fps)
+        while len(fps):
+            i = len(self.arrays) - 1
+            room = self.geometries[i][0] - int(self.counts[i])
+            if room <= 0:
+                self._grow()
+                continue
+            chunk, fps = fps[:room], fps[room:]
+            self._set_stage(i, chunk)
+            self.counts[i] += len(chunk)
+        return added
+
+    def _contains_many(self, fps):
         with self.lock:
-            in_bloom = h in self.bloom
+            return self._test(fps)
 
-        # self.logger.debug(f"[{h}] {reqA} req_in_seen in bloom: {in_bloom}")
-        
-        return in_bloom
+    def _add_many(self, fps):
+        with self.lock:
+            self._set(fps)
+
+    # Batch API
+    def filter_unseen(self, reqsA):
+        """reqsA without the requests already seen, order kept. Only internal urls are checked."""
+        reqsA = list(reqsA)
+        idx = [i for i, reqA in enumerate(reqsA) if is_checked(reqA)]
+        if not idx:
+            return reqsA
+        found = self._contains_many([fingerprint(reqsA[i][0], reqsA[i][2]) for i in idx])
+        seen = {i for i, f in zip(idx, found) if f}
+        return [reqA for i, reqA in enumerate(reqsA) if i not in seen]
+
+    def mark_seen(self, reqsA):
+        if reqsA:
+            self._add_many([fingerprint(reqA[0], reqA[2]) for reqA in reqsA])
+
+    # Single request API
+    def req_in_seen(self, reqA):
+        if not is_checked(reqA):
+            return False
+        return self._contains_many([fingerprint(reqA[0], reqA[2])])[0]
 
     def resp_to_req(self, resp):
         url = resp['url']
@@ -64,17 +308,928 @@ class SeenFilter:
         return reduced_reqA
 
     def add_to_seen_req(self, reqA):
-        h = self._hash_from_req(reqA)
+        self.mark_seen([reqA])
+
+    def release(self, dom_tlds):
+        """Domains finished: only PartitionedSeenFilter can forget them, return how many were."""
+        return 0
+
+    # Persistence
+    def save(self, path):
+        # Copy under the lock, write without holding it
+        with self.lock:
+            self._sync()
+            stages = [(int(self.counts[i]), self.arrays[i].tobytes()) for i in range(len(self.arrays))]
+        with open(path, 'wb') as f:
+            f.write(self._FILE_HEADER.pack(self.FILE_MAGIC, self.capacity, self.error_rate, len(stages)))
+            for count, data in stages:
+                f.write(self._STAGE_COUNT.pack(count))
+                f.write(data)
+
+    @classmethod
+    def read_file(cls, path):
+        """(capacity, error_rate, [(count, bytes) per stage]) of a saved filter."""
+        with open(path, 'rb') as f:
+            header = f.read(cls._FILE_HEADER.size)
+            if len(header) < cls._FILE_HEADER.size or not header.startswith(cls.FILE_MAGIC):
+                raise ValueError(f"{path} is not a seen filter file (saved by an older version?)")
+            _, capacity, error_rate, n = cls._FILE_HEADER.unpack(header)
+            stages = []
+            for i in range(n):
+                count, = cls._STAGE_COUNT.unpack(f.read(cls._STAGE_COUNT.size))
+                size = cls.stage_geometry(capacity, error_rate, i)[3]
+                data = f.read(size)
+                if len(data) != size:
+                    raise ValueError(f"{path} is truncated")
+                stages.append((count, data))
+        return capacity, error_rate, stages
+
+    def load(self, path):
+        capacity, error_rate, stages = self.read_file(path)
+        with self.lock:
+            self._setup(capacity, error_rate)
+            self.arrays, self.counts = [], []
+            for count, data in stages:
+                self._grow()
+                self.arrays[-1][:] = np.frombuffer(data, dtype=np.uint8)
+                self.counts[-1] = count
+
+
+class SharedSeenFilter(SeenFilter):
+    """
+    SeenFilter whose stages live in shared-memory segments: every process
+    holding it (crawlers, queue_in_srv, stats) tests and sets the bits
+    itself, with no round-trip through a Manager process.
+
+    A control segment holds the geometry, the number of stages and their
+    item counts; stage i is the segment named after it with suffix _i.
+    A stage is created before being published in the control segment, and
+    other processes attach to it on their next lookup.
+
+    Lookups read the bits without locking. Adds and growth take a
+    multiprocessing lock (an OS semaphore, not a Manager proxy), as setting
+    a bit rewrites its whole byte.
+
+    Like any multiprocessing lock, it must reach other processes by
+    inheritance (mp.Process args), not through a Pool task.
+    """
+    _CONTROL = struct.Struct('<QdQ')  # first stage capacity, error rate, stages
+
+    def __init__(self, conf, lock=None, capacity=None, error_rate=None):
+        self.conf = conf
+        self.lock = lock or multiprocessing.Lock()
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._control = None
+        self._create(capacity or conf.get('SEEN_FILTER_CAPACITY', 1_000_000),
+                     error_rate or conf.get('SEEN_FILTER_ERROR_RATE', 0.001))
+        self._grow()
+
+        self._load_existing_hashes()
+
+    def _create(self, capacity, error_rate):
+        """New control segment with no stages, replacing the current segments."""
+        self.close()
+        self._control = shared_memory.SharedMemory(
+            create=True, size=self._CONTROL.size + 8 * self.MAX_STAGES)
+        self._owner_pid = os.getpid()
+        self._CONTROL.pack_into(self._control.buf, 0, capacity, error_rate, 0)
+        self._attach()
+
+    def _attach(self):
+        capacity, error_rate, _ = self._CONTROL.unpack_from(self._control.buf, 0)
+        self._setup(capacity, error_rate)
+        self._sync_lock = threading.Lock()
+        self._stages = []
+        self.arrays = []
+        self.counts = np.ndarray((self.MAX_STAGES,), dtype=np.uint64,
+                                 buffer=self._control.buf, offset=self._CONTROL.size)
+        self._sync()
+
+    def _stage_name(self, i):
+        return f"{self._control.name}_{i}"
+
+    def _published(self):
+        return self._CONTROL.unpack_from(self._control.buf, 0)[2]
+
+    def _add_stage(self, shm):
+        i = len(self.arrays)
+        self.geometries.append(self.stage_geometry(self.capacity, self.error_rate, i))
+        self._stages.append(shm)
+        self.arrays.append(np.ndarray((self.geometries[i][3],), dtype=np.uint8, buffer=shm.buf))
+
+    def _grow(self):
+        # Under the lock: only one process adds stages
+        self._sync()
+        i = len(self.arrays)
+        if i >= self.MAX_STAGES:
+            raise IndexError(f"Seen filter full: {self.MAX_STAGES} stages")
+        size = self.stage_geometry(self.capacity, self.error_rate, i)[3]
+        with self._sync_lock:
+            self._add_stage(shared_memory.SharedMemory(name=self._stage_name(i), create=True, size=size))
+        struct.pack_into('<Q', self._control.buf, 16, i + 1)
+
+    def _sync(self):
+        if len(self.arrays) < self._published():
+            with self._sync_lock:
+                for i in range(len(self.arrays), self._published()):
+                    self._add_stage(shared_memory.SharedMemory(name=self._stage_name(i)))
+
+    def __getstate__(self):
+        return {
+            'conf': self.conf,
+            'lock': self.lock,
+            'name': self._control.name,
+            'owner_pid': self._owner_pid,
+        }
+
+    def __setstate__(self, state):
+        self.conf = state['conf']
+        self.lock = state['lock']
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._control = shared_memory.SharedMemory(name=state['name'])
+        self._owner_pid = state['owner_pid']
+        self._attach()
+
+    def _contains_many(self, fps):
+        return self._test(fps)
+
+    def load(self, path):
+        """
+        Load a saved filter. Stages are overwritten in place when the
+        geometry matches, otherwise the segments are replaced, so only
+        before the filter is shared with other processes.
+        """
+        capacity, error_rate, stages = self.read_file(path)
+        with self.lock:
+            self._sync()
+            if (capacity, error_rate) != (self.capacity, self.error_rate) or len(self.arrays) > len(stages):
+                self._create(capacity, error_rate)
+            for i, (count, data) in enumerate(stages):
+                if i == len(self.arrays):
+                    self._grow()
+                self.arrays[i][:] = np.frombuffer(data, dtype=np.uint8)
+                self.counts[i] = count
+
+    def close(self):
+        """Detach from the segments; the creating process also unlinks them."""
+        if self._control is None:
+            return
+        # The arrays export the segment buffers, they must go first
+        self.arrays, self.counts = [], None
+        owner = os.getpid() == self._owner_pid
+        for shm in self._stages + [self._control]:
+            try:
+                shm.close()
+                if owner:
+                    shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._stages, self._control = [], None
+
+
+def exact_dir(conf):
+    return Path(conf.get('SEEN_EXACT_DIR') or Path(conf['path_data']) / 'seen_exact')
+
+
+class ExactSeenFilter(SeenFilter):
+    """
+    Exact set of request fingerprints, for crawls that can't afford the
+    Bloom filter false positives. Same API as SeenFilter.
+
+    - memory tier: open addressing table (linear probing, 0 = empty slot)
+      of 2 * SEEN_EXACT_MEMORY_ITEMS slots rounded up to a power of two
+    - disk tier: sorted runs of fingerprints, memory-mapped, under
+      SEEN_EXACT_DIR (default path_data/seen_exact). When the table is
+      full it is written as a new run and emptied; a run is merged with
+      the previous one while that is not bigger, so there are O(log n)
+      runs, each looked up by binary search.
+
+    RAM stays bounded by the table whatever the number of requests. Only
+    two requests with the same 64-bit fingerprint (probability about
+    n**2 / 2**65) are mistaken for each other.
+    """
+    FILE_MAGIC = b'ISPSEENX'
+    _FILE_HEADER = struct.Struct('<8sQ')  # magic, items
+    COPY_BLOCK = 1 << 20
+
+    def __init__(self, conf, lock, memory_items=None):
+        self.conf = conf
+        self.lock = lock
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._setup(memory_items or conf.get('SEEN_EXACT_MEMORY_ITEMS', 4_000_000))
+        exact_dir(conf).mkdir(parents=True, exist_ok=True)
+        self.dir = Path(tempfile.mkdtemp(prefix='seen_', dir=exact_dir(conf)))
+        self._finalizer = weakref.finalize(self, shutil.rmtree, str(self.dir), True)
+        self.table = np.zeros(self.slots, dtype=np.uint64)
+        self.count = 0
+        self.generation = 0
+        self.run_ids, self.runs = [], []
+
+        self._load_existing_hashes()
+
+    def _setup(self, memory_items):
+        self.memory_items = memory_items
+        self.slots = 1 << max(4, (2 * memory_items - 1).bit_length())
+        self.mask = self.slots - 1
+
+    @staticmethod
+    def clear(conf):
+        """Remove the runs left by previous crawls."""
+        shutil.rmtree(exact_dir(conf), ignore_errors=True)
+
+    def bloom_len(self):
+        self._sync()
+        return int(self.count) + sum(len(run) for run in self.runs)
+
+    def stats(self):
+        """As SeenFilter.stats, stages being the table and the runs, fill_ratio the table's."""
+        with self.lock:
+            self._sync()
+            count, runs = int(self.count), [len(run) for run in self.runs]
+        return {
+            'items': count + sum(runs),
+            'stages': 1 + len(runs),
+            'capacity': self.memory_items,
+            'fill_ratio': round(count / self.memory_items, 4),
+            'fp_rate': 0.0,
+            'bytes': self.table.nbytes,
+            'disk_bytes': 8 * sum(runs),
+        }
+
+    # Runs, SharedExactSeenFilter lists them in shared memory
+    def _run_path(self, run_id):
+        return self.dir / f"run_{run_id:08d}.u64"
+
+    def _open_runs(self, run_ids):
+        self.run_ids = list(run_ids)
+        self.runs = [np.memmap(self._run_path(r), dtype=np.uint64, mode='r') for r in self.run_ids]
+
+    def _publish_runs(self, run_ids):
+        self.generation += 1
+        self._open_runs(run_ids)
+
+    def _flush(self):
+        """Write the table as a new run, merged with the previous ones not bigger, and empty it."""
+        new = np.sort(self.table[self.table != 0])
+        first, size = len(self.runs), len(new)
+        while first > 0 and len(self.runs[first - 1]) <= size:
+            first -= 1
+            size += len(self.runs[first])
+        merged = range(first, len(self.runs))
+        run_id = self.generation + 1
+        out = np.memmap(self._run_path(run_id), dtype=np.uint64, mode='w+', shape=(size,))
+        out[:len(new)] = new
+        at = len(new)
+        for i in merged:
+            out[at:at + len(self.runs[i])] = self.runs[i]
+            at += len(self.runs[i])
+        if merged:
+            out.sort()
+        out.flush()
+        del out
+
+        dropped = [self.run_ids[i] for i in merged]
+        self._publish_runs([r for r in self.run_ids if r not in dropped] + [run_id])
+        for r in dropped:
+            # Processes still mapping them read on until they catch up
+            self._run_path(r).unlink()
+        self.table[:] = 0
+        self.count = 0
+
+    # Fingerprints, the callers hold the lock
+    @staticmethod
+    def _keys(fps):
+        # 0 marks the empty slots: fingerprint 0 is stored as 1
+        keys = np.array(fps, dtype=np.uint64)
+        keys[keys == 0] = 1
+        return keys
+
+    def _table_find(self, keys):
+        """Whether each key is in the table, and the slot where its probing stopped."""
+        pos = (keys & np.uint64(self.mask)).astype(np.int64)
+        found = np.zeros(len(keys), dtype=bool)
+        active = np.arange(len(keys))
+        while active.size:
+            slot = self.table[pos[active]]
+            hit = slot == keys[active]
+            found[active[hit]] = True
+            active = active[~hit & (slot != 0)]
+            pos[active] = (pos[active] + 1) & self.mask
+        return found, pos
+
+    def _found(self, keys):
+        found, _ = self._table_find(keys)
+        for run in self.runs:
+            todo = np.flatnonzero(~found)
+            if not todo.size:
+                break
+            idx = np.searchsorted(run, keys[todo])
+            idx[idx == len(run)] = 0
+            found[todo[run[idx] == keys[todo]]] = True
+        return found
+
+    def _table_insert(self, keys):
+        """Place keys, distinct and in no tier, in their first free slot."""
+        _, pos = self._table_find(keys)
+        pending = np.arange(len(keys))
+        while pending.size:
+            free = self.table[pos[pending]] == 0
+            # One key per free slot, the others probe on
+            slots, first = np.unique(pos[pending[free]], return_index=True)
+            winners = pending[free][first]
+            self.table[slots] = keys[winners]
+            placed = np.zeros(len(keys), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            pos[pending] = (pos[pending] + 1) & self.mask
+        self.count += len(keys)
+
+    def _test(self, fps):
+        self._sync()
+        return self._found(self._keys(fps)).tolist()
+
+    def _set(self, fps):
+        self._sync()
+        keys = np.sort(self._keys(fps))
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        keys = keys[~self._found(keys)]
+        added = len(keys)
+        while len(keys):
+            room = self.memory_items - int(self.count)
+            if room <= 0:
+                self._flush()
+                continue
+            chunk, keys = keys[:room], keys[room:]
+            self._table_insert(chunk)
+        return added
+
+    def _set_array(self, fps):
+        return self._set(fps)
+
+    # Persistence: all the fingerprints, unsorted
+    def save(self, path):
+        # Runs are never modified: only the table is copied under the lock
+        with self.lock:
+            self._sync()
+            parts = [self.table[self.table != 0]] + list(self.runs)
+        with open(path, 'wb') as f:
+            f.write(self._FILE_HEADER.pack(self.FILE_MAGIC, sum(len(part) for part in parts)))
+            for part in parts:
+                for i in range(0, len(part), self.COPY_BLOCK):
+                    f.write(np.ascontiguousarray(part[i:i + self.COPY_BLOCK]).tobytes())
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(self._FILE_HEADER.size)
+        if len(header) < self._FILE_HEADER.size or not header.startswith(self.FILE_MAGIC):
+            raise ValueError(f"{path} is not an exact seen filter file")
+        _, n = self._FILE_HEADER.unpack(header)
+        data = np.memmap(path, dtype=np.uint64, mode='r', offset=self._FILE_HEADER.size, shape=(n,))
+        with self.lock:
+            self._sync()
+            old = list(self.run_ids)
+            self.table[:] = 0
+            self.count = 0
+            run_id = self.generation + 1
+            if n:
+                out = np.memmap(self._run_path(run_id), dtype=np.uint64, mode='w+', shape=(n,))
+                for i in range(0, n, self.COPY_BLOCK):
+                    out[i:i + self.COPY_BLOCK] = data[i:i + self.COPY_BLOCK]
+                out.sort()
+                out.flush()
+                del out
+            self._publish_runs([run_id] if n else [])
+            for r in old:
+                self._run_path(r).unlink()
+
+
+class SharedExactSeenFilter(ExactSeenFilter):
+    """
+    ExactSeenFilter whose table lives in shared memory and whose runs are
+    listed in a control segment, for every process to use directly.
+
+    Unlike SharedSeenFilter, lookups take the multiprocessing lock too:
+    the table is emptied when written as a run. Processes reopen the runs
+    when the generation in the control segment changes.
+    """
+    MAX_RUNS = 64
+    _CONTROL = struct.Struct('<QQQ')  # memory_items, count, generation
+
+    def __init__(self, conf, lock=None, memory_items=None):
+        self.conf = conf
+        self.lock = lock or multiprocessing.Lock()
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        memory_items = memory_items or conf.get('SEEN_EXACT_MEMORY_ITEMS', 4_000_000)
+        exact_dir(conf).mkdir(parents=True, exist_ok=True)
+        self.dir = Path(tempfile.mkdtemp(prefix='seen_', dir=exact_dir(conf)))
+        self._setup(memory_items)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self._CONTROL.size + 8 * (1 + self.MAX_RUNS) + 8 * self.slots)
+        self._owner_pid = os.getpid()
+        self._CONTROL.pack_into(self._shm.buf, 0, memory_items, 0, 0)
+        self._attach()
+
+        self._load_existing_hashes()
+
+    def _attach(self):
+        memory_items, _, _ = self._CONTROL.unpack_from(self._shm.buf, 0)
+        self._setup(memory_items)
+        self._runs_list = np.ndarray((1 + self.MAX_RUNS,), dtype=np.uint64,
+                                     buffer=self._shm.buf, offset=self._CONTROL.size)
+        self.table = np.ndarray((self.slots,), dtype=np.uint64, buffer=self._shm.buf,
+                                offset=self._CONTROL.size + 8 * (1 + self.MAX_RUNS))
+        self._seen_generation = None
+        self.run_ids, self.runs = [], []
+
+    def _field(self, i):
+        return self._CONTROL.unpack_from(self._shm.buf, 0)[i]
+
+    def _set_field(self, i, value):
+        struct.pack_into('<Q', self._shm.buf, 8 * i, value)
+
+    count = property(lambda self: self._field(1), lambda self, value: self._set_field(1, value))
+    generation = property(lambda self: self._field(2), lambda self, value: self._set_field(2, value))
+
+    def _sync(self):
+        if self._seen_generation != self.generation:
+            n = int(self._runs_list[0])
+            self._open_runs(int(r) for r in self._runs_list[1:1 + n])
+            self._seen_generation = self.generation
+
+    def _publish_runs(self, run_ids):
+        if len(run_ids) > self.MAX_RUNS:
+            raise IndexError(f"Exact seen filter: more than {self.MAX_RUNS} runs")
+        self._runs_list[1:1 + len(run_ids)] = run_ids
+        self._runs_list[0] = len(run_ids)
+        self.generation += 1
+        self._sync()
+
+    def __getstate__(self):
+        return {
+            'conf': self.conf,
+            'lock': self.lock,
+            'name': self._shm.name,
+            'dir': str(self.dir),
+            'owner_pid': self._owner_pid,
+        }
+
+    def __setstate__(self, state):
+        self.conf = state['conf']
+        self.lock = state['lock']
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self.dir = Path(state['dir'])
+        self._owner_pid = state['owner_pid']
+        self._attach()
+
+    def close(self):
+        """Detach from the segment; the creating process also unlinks it and removes the runs."""
+        if self._shm is None:
+            return
+        self.table = self._runs_list = None
+        self.runs = []
+        owner = os.getpid() == self._owner_pid
+        try:
+            self._shm.close()
+            if owner:
+                self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        if owner:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        self._shm = None
+
+
+class PartitionedSeenFilter(SeenFilter):
+    """
+    Bloom filter partitioned by domain. Each domain gets a partition sized
+    for SEEN_PARTITION_CAPACITY requests (default MAX_PAGES_POR_DOMAIN, the
+    most a domain can queue); release() frees the partitions of finished
+    domains for the next new ones. Memory follows the number of active
+    domains instead of the number crawled, and the false positive rate of
+    a domain only depends on its own requests.
+
+    Partitions are the rows of arenas of ARENA_ROWS partitions, a new arena
+    is added when no row is free. A directory (open addressing on the
+    domain key, 0 = empty, 1 = released) maps domains to rows, a stack
+    holds the free rows; both are rebuilt when an arena is added.
+
+    Requests of a domain without partition are not seen. The seen index
+    of previous runs is loaded for the domains in conf['domains'] only.
+    """
+    ARENA_ROWS = 256
+    EMPTY, RELEASED = 0, 1
+    FILE_MAGIC = b'ISPSEENP'
+    _FILE_HEADER = struct.Struct('<8sQdQ')  # magic, partition capacity, error rate, partitions
+    _PARTITION = struct.Struct('<QQ')       # domain key, items
+
+    def __init__(self, conf, lock, capacity=None, error_rate=None):
+        self.conf = conf
+        self.lock = lock
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._setup(capacity or conf.get('SEEN_PARTITION_CAPACITY') or conf.get('MAX_PAGES_POR_DOMAIN', 5000),
+                    error_rate or conf.get('SEEN_FILTER_ERROR_RATE', 0.001))
+        self.arenas = []
+        self.dir_keys = None
+        self._new_directory(0)
+
+        self._load_existing_hashes()
+
+    def _setup(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.part = self.geometry(capacity, error_rate)
+
+    # Storage, SharedPartitionedSeenFilter keeps it in shared memory
+    def _add_arena(self):
+        self.arenas.append((np.zeros(self.ARENA_ROWS, dtype=np.uint64),
+                            np.zeros((self.ARENA_ROWS, self.part[3]), dtype=np.uint8)))
+
+    def _alloc_directory(self, size, rows):
+        self.dir_keys = np.zeros(size, dtype=np.uint64)
+        self.dir_rows = np.zeros(size, dtype=np.int64)
+        self.free = np.zeros(rows, dtype=np.int64)
+
+    @staticmethod
+    def _directory_size(rows):
+        # At most a quarter used by live domains
+        return 1 << max(6, (4 * rows - 1).bit_length())
+
+    def _new_directory(self, rows):
+        """Directory and free stack for rows partitions, with the current domains."""
+        used = self._partitions() if self.dir_keys is not None else []
+        self._alloc_directory(self._directory_size(rows), rows)
+        self.dir_used = 0
+        for key, row in used:
+            self._insert(key, row)
+        taken = {row for _, row in used}
+        free = [row for row in range(rows - 1, -1, -1) if row not in taken]
+        self.free[:len(free)] = free
+        self.free_top = len(free)
+
+    # Directory, the callers hold the lock
+    @classmethod
+    def _key(cls, dom_tld):
+        key = seen_index.domain_key(dom_tld)
+        return key if key > cls.RELEASED else key + 2
+
+    def _find(self, key):
+        mask = len(self.dir_keys) - 1
+        i = key & mask
+        while True:
+            k = self.dir_keys[i]
+            if k == key:
+                return i
+            if k == self.EMPTY:
+                return -1
+            i = (i + 1) & mask
+
+    def _insert(self, key, row):
+        mask = len(self.dir_keys) - 1
+        i = key & mask
+        while self.dir_keys[i] != self.EMPTY:
+            i = (i + 1) & mask
+        self.dir_keys[i] = key
+        self.dir_rows[i] = row
+        self.dir_used += 1
+
+    def _rows(self, keys, create=False):
+        """Row of each domain key, -1 for the domains without partition unless create."""
+        rows = {}
+        for key in set(keys):
+            i = self._find(key)
+            if i >= 0:
+                rows[key] = int(self.dir_rows[i])
+            elif create:
+                if not self.free_top:
+                    self._add_arena()
+                    self._new_directory(len(self.arenas) * self.ARENA_ROWS)
+                elif self.dir_used >= len(self.dir_keys) // 2:
+                    # Released entries fill the directory
+                    self._new_directory(len(self.arenas) * self.ARENA_ROWS)
+                self.free_top -= 1
+                rows[key] = int(self.free[self.free_top])
+                self._insert(key, rows[key])
+            else:
+                rows[key] = -1
+        return np.array([rows[key] for key in keys], dtype=np.int64)
+
+    # Bits
+    def _partition_bits(self, rows, fps):
+        """Arena of each request and byte, bit of each of its probes."""
+        _, k, m, nbytes = self.part
+        pos = self._probes(fps, k, m)
+        arena, row = rows // self.ARENA_ROWS, rows % self.ARENA_ROWS
+        byte = row[:, None] * nbytes + (pos >> np.uint64(3)).astype(np.int64)
+        return arena, byte, (pos & np.uint64(7)).astype(np.uint8)
+
+    def _hits_rows(self, rows, fps):
+        found = np.zeros(len(rows), dtype=bool)
+        if not len(rows):
+            return found
+        arena, byte, bit = self._partition_bits(rows, fps)
+        for a in np.unique(arena):
+            sel = arena == a
+            bits = self.arenas[a][1].reshape(-1)
+            found[sel] = ((bits[byte[sel]] >> bit[sel]) & 1).all(axis=1)
+        return found
+
+    def _mark(self, keys, fps):
+        """Add fingerprints with their domain keys, return how many were new."""
+        self._sync()
+        pairs = list(dict.fromkeys(zip(keys, fps)))
+        if not pairs:
+            return 0
+        keys, fps = [p[0] for p in pairs], [p[1] for p in pairs]
+        rows = self._rows(keys, create=True)
+        new = ~self._hits_rows(rows, fps)
+        rows, fps = rows[new], np.asarray(fps, dtype=np.uint64)[new]
+        if len(rows):
+            arena, byte, bit = self._partition_bits(rows, fps)
+            for a in np.unique(arena):
+                sel = arena == a
+                counts, bits = self.arenas[a]
+                np.bitwise_or.at(bits.reshape(-1), byte[sel].ravel(), (np.uint8(1) << bit[sel]).ravel())
+                np.add.at(counts, rows[sel] % self.ARENA_ROWS, np.uint64(1))
+        return len(rows)
+
+    # Batch API
+    def filter_unseen(self, reqsA):
+        reqsA = list(reqsA)
+        idx = [i for i, reqA in enumerate(reqsA) if is_checked(reqA)]
+        if not idx:
+            return reqsA
         with self.lock:
-            self.bloom.add(h)
+            self._sync()
+            rows = self._rows([self._key(reqsA[i][2]) for i in idx])
+            found = np.zeros(len(idx), dtype=bool)
+            known = rows >= 0
+            found[known] = self._hits_rows(
+                rows[known], [fingerprint(reqsA[i][0], reqsA[i][2]) for i, k in zip(idx, known) if k])
+        seen = {i for i, f in zip(idx, found) if f}
+        return [reqA for i, reqA in enumerate(reqsA) if i not in seen]
+
+    def mark_seen(self, reqsA):
+        if reqsA:
+            keys = [self._key(reqA[2]) for reqA in reqsA]
+            fps = [fingerprint(reqA[0], reqA[2]) for reqA in reqsA]
+            with self.lock:
+                self._mark(keys, fps)
 
+    def req_in_seen(self, reqA):
+        return not self.filter_unseen([reqA])
+
+    def release(self, dom_tlds):
+        """Forget finished domains, their partitions go back to the free rows."""
+        released = 0
+        with self.lock:
+            self._sync()
+            for dom_tld in dom_tlds:
+                i = self._find(self._key(dom_tld))
+                if i < 0:
+                    continue
+                row = int(self.dir_rows[i])
+                counts, bits = self.arenas[row // self.ARENA_ROWS]
+                counts[row % self.ARENA_ROWS] = 0
+                bits[row % self.ARENA_ROWS] = 0
+                self.dir_keys[i] = self.RELEASED
+                self.free[self.free_top] = row
+                self.free_top += 1
+                released += 1
+        return released
+
+    def _load_existing_hashes(self):
+        """Requests fetched by previous runs for the domains of this crawl."""
+        doms = []
+        for url in self.conf.get('domains') or []:
+            if url:
+                _, dom, tld, _ = domains.get_url_parts(url)
+                doms.append(self._key(f"{dom}.{tld}"))
+        doms = np.array(doms, dtype=np.uint64)
+        loaded = 0
+        for index in seen_index.load(self.conf):
+            for i in range(0, len(index), self.LOAD_BLOCK):
+                block = index[i:i + self.LOAD_BLOCK]
+                keys = block['dom'].astype(np.uint64)
+                keys[keys <= self.RELEASED] += np.uint64(2)
+                mine = np.isin(keys, doms)
+                with self.lock:
+                    loaded += self._mark(keys[mine].tolist(), block['fp'][mine].tolist())
+        if loaded:
+            self.logger.info(f"Seen filter: {loaded} requests fetched by previous runs")
+
+    # Stats
+    def _partitions(self):
+        """(domain key, row) of the domains with a partition."""
+        used = self.dir_keys > self.RELEASED
+        return list(zip(self.dir_keys[used].tolist(), self.dir_rows[used].tolist()))
+
+    def bloom_len(self):
+        with self.lock:
+            self._sync()
+            return int(sum(counts.sum() for counts, _ in self.arenas))
+
+    def stats(self):
+        """As SeenFilter.stats with arenas as stages, fp_rate being the one of the fullest partition."""
+        with self.lock:
+            self._sync()
+            counts = [int(self.arenas[row // self.ARENA_ROWS][0][row % self.ARENA_ROWS])
+                      for _, row in self._partitions()]
+            arenas = len(self.arenas)
+        _, k, m, nbytes = self.part
+        return {
+            'items': sum(counts),
+            'stages': arenas,
+            'partitions': len(counts),
+            'capacity': self.capacity * len(counts),
+            'fill_ratio': round(sum(counts) / (self.capacity * len(counts)), 4) if counts else 0.0,
+            'fp_rate': (1 - math.exp(-max(counts) / m)) ** k if counts else 0.0,
+            'bytes': arenas * self.ARENA_ROWS * nbytes,
+        }
+
+    # Persistence
     def save(self, path):
         with self.lock:
-            with open(path, 'wb') as f:
-                self.bloom.tofile(f)
+            self._sync()
+            parts = []
+            for key, row in self._partitions():
+                counts, bits = self.arenas[row // self.ARENA_ROWS]
+                parts.append((key, int(counts[row % self.ARENA_ROWS]), bits[row % self.ARENA_ROWS].tobytes()))
+        with open(path, 'wb') as f:
+            f.write(self._FILE_HEADER.pack(self.FILE_MAGIC, self.capacity, self.error_rate, len(parts)))
+            for key, count, data in parts:
+                f.write(self._PARTITION.pack(key, count))
+                f.write(data)
 
     def load(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(self._FILE_HEADER.size)
+            if len(header) < self._FILE_HEADER.size or not header.startswith(self.FILE_MAGIC):
+                raise ValueError(f"{path} is not a partitioned seen filter file")
+            _, capacity, error_rate, n = self._FILE_HEADER.unpack(header)
+            nbytes = self.geometry(capacity, error_rate)[3]
+            parts = []
+            for _ in range(n):
+                key, count = self._PARTITION.unpack(f.read(self._PARTITION.size))
+                data = f.read(nbytes)
+                if len(data) != nbytes:
+                    raise ValueError(f"{path} is truncated")
+                parts.append((key, count, data))
         with self.lock:
-            with open(path, 'rb') as f:
-                self.bloom = BloomFilter.fromfile(f)
+            self._reset(capacity, error_rate)
+            rows = self._rows([key for key, _, _ in parts], create=True)
+            for (_, count, data), row in zip(parts, rows):
+                counts, bits = self.arenas[row // self.ARENA_ROWS]
+                counts[row % self.ARENA_ROWS] = count
+                bits[row % self.ARENA_ROWS] = np.frombuffer(data, dtype=np.uint8)
+
+    def _reset(self, capacity, error_rate):
+        """Empty, with partitions of another geometry."""
+        self._setup(capacity, error_rate)
+        self.arenas = []
+        self.dir_keys = None
+        self._new_directory(0)
+
+
+class SharedPartitionedSeenFilter(PartitionedSeenFilter):
+    """
+    PartitionedSeenFilter in shared memory. A control segment holds the
+    geometry, the number of arenas and the directory state; arena i is the
+    segment named after it with suffix _ai, the directory and free stack
+    the one with suffix _dN, N being bumped each time it is rebuilt.
+
+    Unlike SharedSeenFilter, lookups also take the multiprocessing lock:
+    a released partition may be handed to another domain meanwhile.
+    """
+    _CONTROL = struct.Struct('<QdQQQQ')  # partition capacity, error rate, arenas, directory generation, used, free top
+
+    def __init__(self, conf, lock=None, capacity=None, error_rate=None):
+        self.conf = conf
+        self.lock = lock or multiprocessing.Lock()
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._control = None
+        self._create(capacity or conf.get('SEEN_PARTITION_CAPACITY') or conf.get('MAX_PAGES_POR_DOMAIN', 5000),
+                     error_rate or conf.get('SEEN_FILTER_ERROR_RATE', 0.001))
+
+        self._load_existing_hashes()
+
+    def _create(self, capacity, error_rate):
+        """New control segment with no partitions, replacing the current segments."""
+        self.close()
+        self._control = shared_memory.SharedMemory(create=True, size=self._CONTROL.size)
+        self._owner_pid = os.getpid()
+        self._CONTROL.pack_into(self._control.buf, 0, capacity, error_rate, 0, 0, 0, 0)
+        self._attach()
+        self._new_directory(0)
+
+    def _attach(self):
+        capacity, error_rate = self._CONTROL.unpack_from(self._control.buf, 0)[:2]
+        self._setup(capacity, error_rate)
+        self._arena_shms, self.arenas = [], []
+        self._dir_shm, self._dir_gen = None, 0
+        self.dir_keys = self.dir_rows = self.free = None
+        self._sync()
+
+    def _field(self, i):
+        return self._CONTROL.unpack_from(self._control.buf, 0)[i]
+
+    def _set_field(self, i, value):
+        struct.pack_into('<Q', self._control.buf, 8 * i, value)
+
+    dir_used = property(lambda self: self._field(4), lambda self, value: self._set_field(4, value))
+    free_top = property(lambda self: self._field(5), lambda self, value: self._set_field(5, value))
+
+    def _map_arena(self, shm):
+        self._arena_shms.append(shm)
+        self.arenas.append((
+            np.ndarray((self.ARENA_ROWS,), dtype=np.uint64, buffer=shm.buf),
+            np.ndarray((self.ARENA_ROWS, self.part[3]), dtype=np.uint8, buffer=shm.buf,
+                       offset=8 * self.ARENA_ROWS)))
+
+    def _map_directory(self, shm, gen):
+        """Switch to directory segment shm, return the previous one."""
+        rows = self._field(2) * self.ARENA_ROWS
+        size = self._directory_size(rows)
+        old, self._dir_shm, self._dir_gen = self._dir_shm, shm, gen
+        self.dir_keys = np.ndarray((size,), dtype=np.uint64, buffer=shm.buf)
+        self.dir_rows = np.ndarray((size,), dtype=np.int64, buffer=shm.buf, offset=8 * size)
+        self.free = np.ndarray((rows,), dtype=np.int64, buffer=shm.buf, offset=16 * size)
+        if old is not None:
+            old.close()
+        return old
+
+    def _sync(self):
+        for i in range(len(self.arenas), self._field(2)):
+            self._map_arena(shared_memory.SharedMemory(name=f"{self._control.name}_a{i}"))
+        gen = self._field(3)
+        if gen != self._dir_gen:
+            self._map_directory(shared_memory.SharedMemory(name=f"{self._control.name}_d{gen}"), gen)
+
+    def _add_arena(self):
+        i = len(self.arenas)
+        size = 8 * self.ARENA_ROWS + self.ARENA_ROWS * self.part[3]
+        self._map_arena(shared_memory.SharedMemory(name=f"{self._control.name}_a{i}", create=True, size=size))
+        self._set_field(2, i + 1)
+
+    def _alloc_directory(self, size, rows):
+        gen = self._field(3) + 1
+        shm = shared_memory.SharedMemory(name=f"{self._control.name}_d{gen}", create=True,
+                                         size=16 * size + 8 * max(rows, 1))
+        self._set_field(3, gen)
+        old = self._map_directory(shm, gen)
+        if old is not None:
+            old.unlink()
+
+    def _reset(self, capacity, error_rate):
+        # Replaces the segments: only before the filter is shared
+        self._create(capacity, error_rate)
+
+    def __getstate__(self):
+        return {
+            'conf': self.conf,
+            'lock': self.lock,
+            'name': self._control.name,
+            'owner_pid': self._owner_pid,
+        }
+
+    def __setstate__(self, state):
+        self.conf = state['conf']
+        self.lock = state['lock']
+        self.logger = LoggerFactory.create_logger(self.conf, "ispider.log", stdout_flag=True)
+        self._control = shared_memory.SharedMemory(name=state['name'])
+        self._owner_pid = state['owner_pid']
+        self._attach()
+
+    def close(self):
+        """Detach from the segments; the creating process also unlinks them."""
+        if self._control is None:
+            return
+        # The arrays export the segment buffers, they must go first
+        self.arenas, self.dir_keys, self.dir_rows, self.free = [], None, None, None
+        owner = os.getpid() == self._owner_pid
+        for shm in self._arena_shms + [self._dir_shm, self._control]:
+            if shm is None:
+                continue
+            try:
+                shm.close()
+                if owner:
+                    shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._arena_shms, self._dir_shm, self._control = [], None, None
+
 
+def seen_filter_class(conf, shared=False):
+    """
+    Seen filter class of conf['SEEN_FILTER_BACKEND']: 'bloom' (default,
+    SeenFilter), 'exact' (ExactSeenFilter) or 'partitioned'
+    (PartitionedSeenFilter); with shared, the variant living in shared memory.
+    """
+    backend = conf.get('SEEN_FILTER_BACKEND', 'bloom')
+    if backend == 'bloom':
+        return SharedSeenFilter if shared else SeenFilter
+    if backend == 'exact':
+        return SharedExactSeenFilter if shared else ExactSeenFilter
+    if backend == 'partitioned':
+        return SharedPartitionedSeenFilter if shared else PartitionedSeenFilter
+    raise ValueError(f"Unknown SEEN_FILTER_BACKEND: {backend}")
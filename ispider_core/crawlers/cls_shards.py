@@ -0,0 +1,315 @@
+""" crawlers/cls_shards.py """
+import threading
+from pathlib import Path
+from queue import Empty
+
+from ispider_core.crawlers.cls_counters import COUNTERS, StatsBuffer, apply_counters, stats_report
+from ispider_core.crawlers.cls_domain_scheduler import DomainScheduler
+from ispider_core.crawlers.cls_domain_stats import SharedDomainStats
+from ispider_core.crawlers.cls_frontier import SpillingFrontier
+from ispider_core.crawlers.cls_queue_transport import BatchQueue
+from ispider_core.crawlers.cls_seen_filter import drop_seen, seen_filter_class
+from ispider_core.utils import seen_index
+from ispider_core.utils.canonical import UrlCanonicalizer
+from ispider_core.utils.priorities import RequestPriority
+
+# SharedDomainStats dicts reported to the controller
+REPORTED = ('dom_missing', 'dom_total', 'dom_redirects')
+
+
+def shard_of(dom_tld, shards):
+    """
+    Shard owning dom_tld: stable across processes and runs (unlike hash()).
+    From the domain key of the seen index, so each shard loads its part.
+    """
+    return seen_index.domain_key(dom_tld) % shards
+
+
+class ShardRouter:
+    """
+    Stands for qout in the controller when EXECUTION_MODE is 'sharded':
+    requests are sent to the inbox of the shard owning their domain,
+    in one message per shard.
+    """
+    def __init__(self, inboxes):
+        self.inboxes = inboxes
+
+    def put(self, reqA, block=True, timeout=None):
+        self.put_many([reqA])
+
+    def put_many(self, items, block=True, timeout=None):
+        by_shard = {}
+        for reqA in items:
+            by_shard.setdefault(shard_of(reqA[2], len(self.inboxes)), []).append(reqA)
+        for i, reqsA in by_shard.items():
+            self.inboxes[i].put(reqsA)
+
+    def hand_off(self, dom_tld, missing, total, reqsA):
+        """Counters and requests of a domain reached by another shard, for its owner (Shard.take_over)."""
+        self.inboxes[shard_of(dom_tld, len(self.inboxes))].put(
+            {'dom_tld': dom_tld, 'missing': missing, 'total': total, 'reqs': reqsA})
+
+    def qsize(self):
+        """Messages (batches of requests) not yet received by the shards."""
+        return sum(q.qsize() for q in self.inboxes)
+
+
+class _TrackedDict(dict):
+    """dict remembering the keys set or deleted since the last take_dirty()."""
+
+    def __init__(self):
+        super().__init__()
+        self.dirty = set()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty.add(key)
+
+    def forget(self, key, default=None):
+        """Remove key without reporting it: another shard reports it from now on."""
+        self.dirty.discard(key)
+        return super().pop(key, default)
+
+    def take_dirty(self):
+        """Return (updates, deletes) since the last call."""
+        dirty, self.dirty = self.dirty, set()
+        updates = {k: self[k] for k in dirty if k in self}
+        return updates, [k for k in dirty if k not in self]
+
+
+class _LocalManager:
+    """Builds SharedDomainStats on plain, tracked dicts instead of Manager proxies."""
+
+    def dict(self):
+        return _TrackedDict()
+
+
+class Shard:
+    """
+    Crawl state owned by one worker process in sharded mode: frontier,
+    politeness scheduler, seen filter and domain counters of the domains
+    for which shard_of() gives this worker. Nothing here is shared;
+    the controller only receives the coarse report().
+
+    next_requests() runs in the fetch loop thread, manage_resps in the
+    handler thread; the local lock guards what both of them touch.
+
+    With router, the ShardRouter of all the shards, a domain of another
+    shard reached by a redirect is handed to its owner (hand_off()), and
+    the seen filter loads only the seen index records of this shard.
+    """
+
+    def __init__(self, mod, conf, logger, seed=None, domain_ids=None, router=None):
+        self.mod = mod
+        self.conf = conf
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.router = router
+        # Requests of other shards' domains, see put_many()
+        self.outgoing = {}
+
+        self.dom_stats = SharedDomainStats(_LocalManager(), logger, self.lock, StatsBuffer())
+        self.dom_stats.domain_ids = domain_ids
+        for dom_tld, (missing, total) in (seed or {}).items():
+            self.dom_stats.add_domain(dom_tld)
+            self.dom_stats.dom_missing[dom_tld] = missing
+            self.dom_stats.dom_total[dom_tld] = total
+        for name in REPORTED:
+            # The controller sent the seed, no need to report it back
+            getattr(self.dom_stats, name).take_dirty()
+
+        seen_conf = conf if router is None else {**conf, 'seen_index_shard': (mod, len(router.inboxes))}
+        self.seen_filter = seen_filter_class(conf)(seen_conf, threading.Lock())
+        self.canonicalizer = UrlCanonicalizer(conf)
+
+        if conf.get('FRONTIER_MEMORY_ITEMS'):
+            spill_dir = Path(conf.get('FRONTIER_SPILL_DIR') or Path(conf['path_data']) / 'frontier')
+            # Not journaled: what is left is given back to qout when closing
+            self.frontier = SpillingFrontier({
+                **conf, 'FRONTIER_SPILL_DIR': spill_dir / f"shard{mod}", 'FRONTIER_JOURNAL': False})
+        else:
+            self.frontier = BatchQueue(
+                priorities=conf.get('QUEUE_PRIORITIES'),
+                by_depth=conf.get('QUEUE_PRIORITY_BY_DEPTH', True))
+
+        self.scheduler = DomainScheduler(
+            min_delay=conf.get('DELAY_DOMAIN_SEC', 0.5),
+            priority=RequestPriority.from_conf(conf),
+            max_per_domain=conf.get('SCHEDULER_MAX_PENDING_DOMAIN', 1000))
+        self.max_pending = conf.get('SCHEDULER_MAX_PENDING') or conf['QUEUE_MAX_SIZE']
+
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def __len__(self):
+        return self.frontier.qsize() + len(self.scheduler)
+
+    def receive(self, reqsA):
+        """Requests routed by the controller: landing pages, new domains, resumed queues."""
+        with self.lock:
+            for reqA in reqsA:
+                dom_tld = reqA[2]
+                if dom_tld not in self.dom_stats.dom_missing:
+                    # Domain added after the shard started
+                    self.dom_stats.add_domain(dom_tld)
+                    self.dom_stats.dom_missing[dom_tld] = 1
+                    self.dom_stats.dom_total[dom_tld] = 1
+        self.frontier.put_many(reqsA)
+
+    def take_over(self, msg):
+        """A domain of this shard handed off by another one, see ShardRouter.hand_off()."""
+        dom_tld = msg['dom_tld']
+        with self.lock:
+            if dom_tld not in self.dom_stats.dom_missing:
+                self.dom_stats.add_domain(dom_tld)
+            self.dom_stats.dom_missing[dom_tld] += msg['missing']
+            self.dom_stats.dom_total[dom_tld] += msg['total']
+        if msg['reqs']:
+            self.frontier.put_many(msg['reqs'])
+
+    def _receive_message(self, msg):
+        if isinstance(msg, dict):
+            self.take_over(msg)
+        else:
+            self.receive(msg)
+
+    def pull_inbox(self, inbox, timeout=0):
+        """Receive all the messages waiting in inbox, waiting up to timeout for the first."""
+        try:
+            self._receive_message(inbox.get(timeout=timeout) if timeout else inbox.get_nowait())
+            while True:
+                self._receive_message(inbox.get_nowait())
+        except Empty:
+            pass
+
+    def owns(self, dom_tld):
+        return self.router is None or shard_of(dom_tld, len(self.router.inboxes)) == self.mod
+
+    def put(self, reqA, block=True, timeout=None):
+        self.put_many([reqA])
+
+    def put_many(self, reqsA, block=True, timeout=None):
+        """Requests found by the handler: to the frontier, those of other shards kept for hand_off()."""
+        own = []
+        for reqA in reqsA:
+            if self.owns(reqA[2]):
+                own.append(reqA)
+            else:
+                self.outgoing.setdefault(reqA[2], []).append(reqA)
+        if own:
+            self.frontier.put_many(own)
+
+    def hand_off(self):
+        """
+        Send the domains of other shards that a redirect brought here, their
+        counters and requests, to their owner. They leave this shard's state
+        unreported: only the owner reports them.
+        """
+        if self.router is None:
+            return
+        with self.lock:
+            foreign = [dom_tld for dom_tld in self.dom_stats.dom_missing if not self.owns(dom_tld)]
+            counts = {}
+            for dom_tld in foreign:
+                counts[dom_tld] = (self.dom_stats.dom_missing.forget(dom_tld, 0),
+                                   self.dom_stats.dom_total.forget(dom_tld, 0))
+                for d in (self.dom_stats.dom_last_call, self.dom_stats.dom_engine, self.dom_stats.local_stats):
+                    d.pop(dom_tld, None)
+        outgoing, self.outgoing = self.outgoing, {}
+        for dom_tld in set(counts) | set(outgoing):
+            missing, total = counts.get(dom_tld, (0, 0))
+            self.router.hand_off(dom_tld, missing, total, outgoing.get(dom_tld, []))
+
+    def next_requests(self, n, exclusion_list):
+        """Up to n requests whose domain delay has elapsed, frontier -> scheduler -> fetch."""
+        room = self.max_pending - len(self.scheduler)
+        if room > 0:
+            try:
+                block = self.frontier.get_many(room, block=False)
+                deferred = self.scheduler.push_many(drop_seen(
+                    self.seen_filter, block, self.dom_stats, canonicalizer=self.canonicalizer))
+                if deferred:
+                    self.frontier.put_many(deferred)
+            except Empty:
+                pass
+
+        out = []
+        while len(out) < n:
+            ready = self.scheduler.pop_ready(n - len(out))
+            if not ready:
+                break
+            # Seen ones dropped, the others marked as seen on release
+            for reqA in drop_seen(self.seen_filter, ready, self.dom_stats, mark=True,
+                                  canonicalizer=self.canonicalizer):
+                if reqA[2] in exclusion_list:
+                    self.dom_stats.reduce_missing(reqA[2])
+                    continue
+                out.append(reqA)
+        return out
+
+    def next_eligible_in(self):
+        return self.scheduler.next_eligible_in()
+
+    def add_counters(self, counters):
+        with self.lock:
+            for k in COUNTERS:
+                self.counters[k] += counters.get(k, 0)
+
+    def report(self):
+        """Changes since the last report, see apply_report()."""
+        stats, puts, since = self.dom_stats.qstats.take()
+
+        with self.lock:
+            counters, self.counters = self.counters, dict.fromkeys(COUNTERS, 0)
+            out = {name: getattr(self.dom_stats, name).take_dirty() for name in REPORTED}
+
+        # Domains finished since the last report, no-op unless partitioned
+        finished = [dom_tld for dom_tld, missing in out['dom_missing'][0].items() if missing == 0]
+        if finished:
+            self.seen_filter.release(finished)
+
+        out.update({'mod': self.mod, 'counters': counters, 'pending': len(self),
+                    'lock_wait': self.dom_stats.take_lock_wait(), **stats_report(stats, puts, since)})
+        return out
+
+    def drain(self):
+        """Remove and return every request not fetched yet."""
+        out = self.scheduler.drain()
+        while True:
+            try:
+                out.extend(self.frontier.get_many(10000, block=False))
+            except Empty:
+                return out
+
+    def close(self):
+        if isinstance(self.frontier, SpillingFrontier):
+            self.frontier.close()
+
+
+def inbox_requests(msg, dom_stats, lock):
+    """Requests of a message left in an inbox; a hand-off also gives its counters to dom_stats."""
+    if not isinstance(msg, dict):
+        return msg
+    with lock:
+        dom_tld = msg['dom_tld']
+        dom_stats.dom_missing[dom_tld] = dom_stats.dom_missing.get(dom_tld, 0) + msg['missing']
+        dom_stats.dom_total[dom_tld] = dom_stats.dom_total.get(dom_tld, 0) + msg['total']
+    return msg['reqs']
+
+
+def apply_report(report, dom_stats, script_controller, lock):
+    """Merge a Shard.report() into the controller's shared state."""
+    with lock:
+        for name in REPORTED:
+            updates, deletes = report[name]
+            target = getattr(dom_stats, name)
+            if updates:
+                target.update(updates)
+            for k in deletes:
+                target.pop(k, None)
+
+    apply_counters(report, script_controller, lock)
+    dom_stats.apply_stats(report['stats'])
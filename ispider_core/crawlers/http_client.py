@@ -1,6 +1,7 @@
 from datetime import datetime
 import asyncio
 import functools
+import time
 
 import httpx
 
@@ -60,4 +61,115 @@ def fetch_all(reqsA, lock_driver, conf, mod=0, headers={}):
         seleniumbase_results = handle_seleniumbase(seleniumbase_reqs, lock_driver, conf, mod)
         results.extend(seleniumbase_results)
         
-    return results
\ No newline at end of file
+    return results
+
+
+class FetchWindow:
+    """
+    Long-lived fetch context for the sliding window loop: one httpx client
+    for the whole worker life, thread pools for the blocking engines.
+    """
+    def __init__(self, lock_driver, conf, mod=0, headers={}):
+        self.lock_driver = lock_driver
+        self.conf = conf
+        self.mod = mod
+        self.headers = headers
+        self.client = None
+        self.curl_pool = None
+        self.seleniumbase_pool = None
+
+    async def __aenter__(self):
+        timeout = httpx.Timeout(30, connect=self.conf['TIMEOUT'])
+        limits = httpx.Limits(max_connections=100)
+        self.client = httpx.AsyncClient(timeout=timeout, limits=limits, follow_redirects=True, headers=self.headers)
+        self.curl_pool = ThreadPoolExecutor(max_workers=self.conf['ASYNC_BLOCK_SIZE'])
+        self.seleniumbase_pool = ThreadPoolExecutor(max_workers=1)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.client.aclose()
+        self.curl_pool.shutdown(wait=False)
+        self.seleniumbase_pool.shutdown(wait=False)
+
+    async def fetch(self, reqA):
+        engine = reqA[5]
+        if engine == "httpx":
+            return await mod_httpx.fetch_with_httpx(reqA, self.client, self.mod, self.conf)
+
+        loop = asyncio.get_running_loop()
+        if engine == "curl":
+            return await loop.run_in_executor(
+                self.curl_pool, mod_curl.fetch_with_curl, reqA, self.conf)
+        if engine == "seleniumbase":
+            return await loop.run_in_executor(
+                self.seleniumbase_pool, mod_seleniumbase.fetch_with_seleniumbase,
+                reqA, self.lock_driver, self.mod, self.conf)
+
+        raise ValueError(f"Unknown engine: {engine}")
+
+
+async def sliding_window(get_reqs, fetch, handle, window, idle_timeout=60, poll=0.5):
+    """
+    Keep up to `window` fetches in flight and start a new one as soon as any
+    completes, instead of waiting for the slowest request of a block.
+
+    get_reqs(n, timeout): blocking call, run in a thread. Returns up to n
+        requests (possibly none), or None to stop.
+    fetch(reqA): coroutine returning the response.
+    handle(done): blocking call, run in a single handler thread alongside the
+        fetches. done is a list of (reqA, resp), resp is the raised exception
+        if the fetch failed.
+
+    Returns when get_reqs returns None, or nothing arrived for idle_timeout
+    seconds, after in-flight fetches and pending handlings are completed.
+    """
+    loop = asyncio.get_running_loop()
+    inflight = {}
+    handling = set()
+    idle_since = time.monotonic()
+    stop = False
+
+    with ThreadPoolExecutor(max_workers=1) as getter, ThreadPoolExecutor(max_workers=1) as handler:
+        while not stop or inflight:
+            free = window - len(inflight)
+            if free > 0 and not stop:
+                # Block on the queue only when there is nothing else to wait for
+                timeout = 0 if (inflight or handling) else 1
+                reqs = await loop.run_in_executor(getter, get_reqs, free, timeout)
+                if reqs is None:
+                    stop = True
+                    reqs = []
+                for reqA in reqs:
+                    inflight[asyncio.ensure_future(fetch(reqA))] = reqA
+
+            if not inflight:
+                if handling:
+                    await asyncio.wait(handling)
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > idle_timeout:
+                    break
+                continue
+
+            idle_since = time.monotonic()
+            done, _ = await asyncio.wait(inflight, timeout=poll, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                continue
+
+            results = []
+            for task in done:
+                reqA = inflight.pop(task)
+                try:
+                    results.append((reqA, task.result()))
+                except Exception as e:
+                    results.append((reqA, e))
+
+            # Handling runs in its own thread, bounded so fetches can't outrun it
+            if len(handling) >= window:
+                await asyncio.wait(handling, return_when=asyncio.FIRST_COMPLETED)
+            fut = loop.run_in_executor(handler, handle, results)
+            handling.add(fut)
+            fut.add_done_callback(handling.discard)
+
+        if handling:
+            await asyncio.wait(handling)
+
@@ -0,0 +1,139 @@
+
+import asyncio
+import time
+from pathlib import Path
+
+from ispider_core.crawlers import http_client
+from ispider_core.crawlers import cls_shards
+from ispider_core.crawlers.stage_unified import manage_resps
+
+from ispider_core.utils.logger import LoggerFactory
+from ispider_core.utils import headers
+from ispider_core.utils import queues
+
+from ispider_core.seo import SeoRunner
+
+
+def seen_path(conf, mod):
+    return Path(conf['path_data']) / f"unified_seen_shard{mod}.pkl"
+
+
+async def sharded_sliding(
+    shard, conf, exclusion_list, lock_driver,
+    script_controller, inbox, progress, logger, hdrs, seo_runner):
+    '''
+    Sliding window loop over the shard's own state: requests come from the
+    local frontier through the local scheduler, extracted links go back to
+    the local frontier. Only the inbox and the progress reports cross the
+    process boundary.
+    '''
+    mod = shard.mod
+    report_every = conf.get('SHARD_REPORT_SEC', 2)
+    last_report = time.time()
+    last_pull = 0
+
+    def get_reqs(n, timeout):
+        nonlocal last_report, last_pull
+        now = time.time()
+        if now - last_report > report_every:
+            if not script_controller['running_state']:
+                return None
+            progress.put(shard.report())
+            last_report = now
+
+        if not len(shard):
+            # Nothing local to do: wait for new domains
+            shard.pull_inbox(inbox, timeout)
+            last_pull = time.time()
+        elif now - last_pull > 1:
+            shard.pull_inbox(inbox)
+            last_pull = now
+
+        reqsA = shard.next_requests(n, exclusion_list)
+        if not reqsA and timeout and len(shard):
+            time.sleep(min(timeout, shard.next_eligible_in() or timeout))
+        return reqsA
+
+    def handle(done):
+        counters = dict.fromkeys(cls_shards.COUNTERS, 0)
+        resps = []
+        for reqA, resp in done:
+            if isinstance(resp, Exception):
+                logger.error(f"[{mod}] Fetch error for {reqA[0]}: {resp}")
+                shard.dom_stats.reduce_missing(reqA[2])
+                continue
+            resps.append(resp)
+
+        qbuf = queues.PutBuffer(shard)
+        try:
+            manage_resps(
+                resps, mod, exclusion_list, shard.seen_filter,
+                shard.dom_stats, counters, conf, logger, hdrs, qbuf, seo_runner, shard.canonicalizer)
+        except Exception as e:
+            logger.error(f"[{mod}] Error managing responses: {e}")
+        finally:
+            qbuf.flush()
+            # Domains of other shards reached by a redirect
+            shard.hand_off()
+
+        counters['tot_counter'] += len(done)
+        shard.add_counters(counters)
+
+    async with http_client.FetchWindow(lock_driver, conf, mod, hdrs) as window:
+        await http_client.sliding_window(
+            get_reqs, window.fetch, handle, conf['ASYNC_BLOCK_SIZE'])
+
+
+def sharded(mod, conf, exclusion_list, lock_driver,
+        script_controller, inbox, progress, qout, seed, domain_ids=None, inboxes=None):
+    '''
+    Worker of EXECUTION_MODE 'sharded': crawls, end to end, the domains
+    for which cls_shards.shard_of() gives mod.
+
+    ** inbox: requests routed to this shard by the controller
+    ** progress: receives the shard reports, merged by the controller
+    ** qout: requests not fetched yet are given back here when closing,
+             so they are saved with the controller state
+    ** seed: {dom_tld: (missing, total)} of the shard domains at start
+    ** domain_ids: InternTable of the controller, for the dom_id of the JSON records
+    ** inboxes: the inboxes of all the shards, to hand off the domains of
+                other shards reached by a redirect
+    '''
+    logger = LoggerFactory.create_logger(conf, "ispider.log", stdout_flag=True)
+
+    script_controller['running_state'] = 9
+
+    hdrs = headers.get_header('basics')
+    seo_runner = SeoRunner(conf, logger)
+    router = cls_shards.ShardRouter(inboxes) if inboxes else None
+    shard = cls_shards.Shard(mod, conf, logger, seed, domain_ids, router)
+
+    if conf['RESUME'] and seen_path(conf, mod).exists():
+        shard.seen_filter.load(seen_path(conf, mod))
+
+    try:
+        asyncio.run(sharded_sliding(
+            shard, conf, exclusion_list, lock_driver,
+            script_controller, inbox, progress, logger, hdrs, seo_runner))
+
+    except KeyboardInterrupt:
+        logger.warning("Subprocess interrupted by keyboard")
+
+    except Exception as e:
+        logger.error(f"[{mod}] Error in shard: {e}")
+
+    try:
+        pending = shard.drain()
+        if pending:
+            logger.info(f"[{mod}] Giving back {len(pending)} requests not fetched")
+            qout.put_many(pending)
+        progress.put(shard.report())
+        shard.seen_filter.save(seen_path(conf, mod))
+    except Exception as e:
+        logger.error(f"[{mod}] Error closing shard: {e}")
+    finally:
+        shard.close()
+
+    logger.debug(f"Closing shard {mod}")
+
+    return None
@@ -11,11 +11,15 @@ from ispider_core.crawlers import http_client
 from ispider_core.crawlers import http_filters
 from ispider_core.crawlers import http_retries
 from ispider_core.crawlers import stage_unified_helpers
+from ispider_core.crawlers import cls_counters
 
 from ispider_core.utils.logger import LoggerFactory
 from ispider_core.utils import headers
 from ispider_core.utils import ifiles
 from ispider_core.utils import domains
+from ispider_core.utils import queues
+from ispider_core.utils import seen_index
+from ispider_core.utils.canonical import UrlCanonicalizer
 
 from ispider_core.parsers.html_parser import HtmlParser
 from ispider_core.parsers.sitemaps_parser import SitemapParser
@@ -24,13 +28,48 @@ from ispider_core.seo import SeoRunner
 
 def call_and_manage_resps(
     reqAL, mod, lock_driver, exclusion_list, seen_filter,
-    dom_stats, script_controller, conf, logger, hdrs, qout, seo_runner):
+    dom_stats, script_controller, conf, logger, hdrs, qout, seo_runner, canonicalizer=None):
 
     html_parser = HtmlParser(logger, conf)
     
     ## Fetch the block
     resps = http_client.fetch_all(reqAL, lock_driver, conf, mod, hdrs)
-    
+
+    # Requests produced by the whole block go to qout in one message
+    qbuf = queues.PutBuffer(qout)
+    try:
+        manage_resps(
+            resps, mod, exclusion_list, seen_filter,
+            dom_stats, script_controller, conf, logger, hdrs, qbuf, seo_runner, canonicalizer)
+    finally:
+        qbuf.flush()
+
+
+def manage_resps(
+    resps, mod, exclusion_list, seen_filter,
+    dom_stats, script_controller, conf, logger, hdrs, qout, seo_runner, canonicalizer=None):
+
+    # Fetched requests, added to the seen filter and index once for the block
+    fetched = []
+    try:
+        _manage_resps(
+            resps, fetched, mod, exclusion_list, seen_filter,
+            dom_stats, script_controller, conf, logger, hdrs, qout, seo_runner, canonicalizer)
+    finally:
+        try:
+            if canonicalizer is not None:
+                # Under the key of their url, like the lookups
+                fetched = canonicalizer.key_reqs(fetched)
+            seen_filter.mark_seen(fetched)
+            seen_index.append(conf, fetched)
+        except Exception as e:
+            logger.error(e)
+
+
+def _manage_resps(
+    resps, fetched, mod, exclusion_list, seen_filter,
+    dom_stats, script_controller, conf, logger, hdrs, qout, seo_runner, canonicalizer):
+
     for resp in resps:
         # VARIABLE Prepare
         status_code = resp['status_code']
@@ -44,6 +83,9 @@ def call_and_manage_resps(
         current_engine = resp['engine']
         resp['user_agent'] = hdrs['user-agent']
         sub_dom_tld = resp.get('final_url_sub_domain_tld', dom_tld)
+        if dom_stats.domain_ids is not None:
+            # Written with the response, the name is in the /spider/ids table
+            resp['dom_id'] = dom_stats.domain_ids.intern(dom_tld)
 
         # Handle redirects for landing pages
         if rd == 'landing_page' and resp.get('was_redirected', False):
@@ -105,7 +147,7 @@ def call_and_manage_resps(
 
         # **********************
         # INCREASE COUNTERS
-        dom_stats.increase_script_counters(rd, script_controller)
+        cls_counters.count_response(rd, script_controller)
 
         # ***********************
         # UNIFIED ACTIONS MANAGEMENT
@@ -116,18 +158,16 @@ def call_and_manage_resps(
                 resp, dom_stats, current_engine, conf, logger, qout)
         
             # EXTRACT LINKS
-            stage_unified_helpers.unified_link_extraction(
-                resp, dom_stats, qout, conf, logger, current_engine)
+            saved = stage_unified_helpers.unified_link_extraction(
+                resp, dom_stats, qout, conf, logger, current_engine, seen_filter, canonicalizer)
+            if saved:
+                script_controller['canonical_saved'] = script_controller.get('canonical_saved', 0) + saved
 
         except Exception as e:
             logger.error(f"Unified processing error for {url}: {e}")
 
         # Add to seen filter
-        try:
-            reduced_reqA = seen_filter.resp_to_req(resp)
-            seen_filter.add_to_seen_req(reduced_reqA)
-        except Exception as e:
-            logger.error(e)
+        fetched.append(seen_filter.resp_to_req(resp))
 
         # Reduce dom count Up Down by 1
         dom_stats.reduce_missing(dom_tld)
@@ -142,10 +182,113 @@ def call_and_manage_resps(
         ifiles.write_positive_json(resp, conf, mod)
 
 
+async def unified_sliding(
+    mod, conf, exclusion_list, seen_filter, counters, lock_driver,
+    script_controller, dom_stats, qin, qout, logger, hdrs, seo_runner, canonicalizer):
+    '''
+    Sliding window loop: ASYNC_BLOCK_SIZE requests always in flight on a
+    long-lived event loop, responses handled in a separate thread while the
+    next fetches run. Counters go to counters, a WorkerCounters.
+    Requests are leased from qin until handled, see BatchQueueMixin.get_many.
+    '''
+    last_check = 0
+
+    def get_reqs(n, timeout):
+        nonlocal last_check
+        if time.time() - last_check > 1:
+            if not script_controller['running_state']:
+                return None
+            last_check = time.time()
+        try:
+            reqsA = qin.get_many(n, block=timeout > 0, timeout=timeout, lease=True)
+        except Empty:
+            return []
+
+        kept, excluded = [], []
+        for reqA in reqsA:
+            if reqA[2] in exclusion_list:
+                dom_stats.reduce_missing(reqA[2])
+                logger.debug(f"{reqA[2]} excluded {reqA[0]}")
+                excluded.append(reqA)
+                continue
+            kept.append(reqA)
+        if excluded:
+            qin.ack(excluded)
+        return kept
+
+    def handle(done):
+        resps = []
+        for reqA, resp in done:
+            if isinstance(resp, Exception):
+                logger.error(f"[{mod}] Fetch error for {reqA[0]}: {resp}")
+                dom_stats.reduce_missing(reqA[2])
+                continue
+            resps.append(resp)
+
+        qbuf = queues.PutBuffer(qout)
+        try:
+            manage_resps(
+                resps, mod, exclusion_list, seen_filter,
+                dom_stats, counters, conf, logger, hdrs, qbuf, seo_runner, canonicalizer)
+        except Exception as e:
+            logger.error(f"[{mod}] Error managing responses: {e}")
+        finally:
+            qbuf.flush()
+        # Seen and new requests in qout: a checkpoint no longer needs them
+        qin.ack([reqA for reqA, _ in done])
+
+        counters['tot_counter'] += len(done)
+        counters.maybe_publish()
+
+    async with http_client.FetchWindow(lock_driver, conf, mod, hdrs) as window:
+        await http_client.sliding_window(
+            get_reqs, window.fetch, handle, conf['ASYNC_BLOCK_SIZE'])
+
+
+def unified_block(
+    mod, conf, exclusion_list, seen_filter, counters, lock_driver,
+    script_controller, dom_stats, qin, qout, logger, hdrs, seo_runner, canonicalizer):
+    '''
+    Block loop: fetch ASYNC_BLOCK_SIZE requests, wait for all of them,
+    then manage the responses. Requests are leased from qin until handled.
+    '''
+    urls = list()
+
+    while script_controller['running_state']:
+        try:
+            reqsA = qin.get_many(conf['ASYNC_BLOCK_SIZE'], timeout=60, lease=True)
+        except Empty:
+            break
+
+        for reqA in reqsA:
+            url = reqA[0]
+            rd = reqA[1]
+            dom_tld = reqA[2]
+
+            if dom_tld in exclusion_list:
+                dom_stats.reduce_missing(dom_tld)
+                logger.debug(f"{dom_tld} excluded {url}")
+                continue
+
+            urls.append(reqA)
+        
+        if urls:
+            call_and_manage_resps(
+                urls, mod, lock_driver, exclusion_list, seen_filter, 
+                dom_stats, counters, 
+                conf, logger, hdrs, qout, seo_runner, canonicalizer)
+            
+            counters['tot_counter'] += len(urls)
+            counters.maybe_publish()
+            
+            urls = list()
+        qin.ack(reqsA)
+
+
 def unified(mod, conf, exclusion_list, seen_filter, 
         lock, lock_driver, 
         script_controller, dom_stats,
-        qin, qout):
+        qin, qout, progress):
     
     '''
     Unified stage that combines crawl and spider functionality:
@@ -158,64 +301,41 @@ def unified(mod, conf, exclusion_list, seen_filter,
     ** dom_missing: dom_tld based controller
     ** qin: input queue
     ** qout: output queue
+    ** progress: receives the counter deltas, merged by the controller
     '''
     
     logger = LoggerFactory.create_logger(conf, "ispider.log", stdout_flag=True)
 
-    urls = list()
-
     # MAIN Cycle of unified processing
     script_controller['running_state'] = 9
     
     t0 = time.time()
     hdrs = headers.get_header('basics')
     seo_runner = SeoRunner(conf, logger)
+    canonicalizer = UrlCanonicalizer(conf)
+    counters = cls_counters.WorkerCounters(
+        mod, progress, dom_stats, conf.get('COUNTERS_FLUSH_SEC', 1))
 
-    try:
-
-        while script_controller['running_state']:
-            try:
-                reqA = qin.get(timeout=60)
-            except Empty:
-                break
+    args = (
+        mod, conf, exclusion_list, seen_filter, counters, lock_driver,
+        script_controller, dom_stats, qin, qout, logger, hdrs, seo_runner, canonicalizer)
 
-            url = reqA[0]
-            rd = reqA[1]
-            dom_tld = reqA[2]
-            
-            if dom_tld in exclusion_list:
-                dom_stats.reduce_missing(dom_tld)
-                logger.debug(f"{dom_tld} excluded {url}")
-                continue
-
-            urls.append(reqA)
-            
-            if len(urls) >= conf['ASYNC_BLOCK_SIZE'] or qin.qsize() == 0:
-                call_and_manage_resps(
-                    urls, mod, lock_driver, exclusion_list, seen_filter, 
-                    dom_stats, script_controller, 
-                    conf, logger, hdrs, qout, seo_runner)
-                
-                with lock:
-                    script_controller['tot_counter'] += len(urls)
-                
-                urls = list()
-
-        if len(urls) > 0:
-            logger.info(f"Last call and manage, urls: {len(urls)}")
-            call_and_manage_resps(
-                urls, mod, lock_driver, exclusion_list, seen_filter, 
-                dom_stats, script_controller, 
-                conf, logger, hdrs, qout, seo_runner)
-            
-            with lock:
-                script_controller['tot_counter'] += len(urls)
+    try:
+        if conf.get('FETCH_MODE', 'sliding') == 'sliding':
+            asyncio.run(unified_sliding(*args))
+        else:
+            unified_block(*args)
 
     except KeyboardInterrupt:
         logger.warning("Subprocess interrupted by keyboard")
 
     except Exception as e:
         logger.error(f"[{mod}] Error in worker: {e}")
+
+    try:
+        counters.publish()
+    except Exception as e:
+        logger.error(f"[{mod}] Error publishing counters: {e}")
         
     logger.debug(f"Closing worker {mod}")
     
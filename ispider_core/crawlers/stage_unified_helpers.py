@@ -29,8 +29,35 @@ def _apply_url_filters(links, conf):
     ]
     return links
 
-def extract_and_queue_html_links(c, dom_stats, qout, conf, logger, current_engine):
-    """Extract links from HTML content and add them to the queue"""
+def _drop_seen_links(links, dom_tld, depth, seen_filter):
+    """Links not fetched yet, checked in one seen filter call for the whole page."""
+    if seen_filter is None or not links:
+        return links
+    reqsA = [(link, 'internal_url', dom_tld, 0, depth, None) for link in links]
+    return [reqA[0] for reqA in seen_filter.filter_unseen(reqsA)]
+
+def _canonical_unseen_links(links, dom_tld, depth, seen_filter, canonicalizer):
+    """
+    Links whose canonical key was not fetched yet, the first one found per
+    key, and the requests saved by canonicalization: links sharing the key
+    of another one of the page, or of a seen link, that they differ from.
+    """
+    if canonicalizer is None or not canonicalizer.enabled:
+        return _drop_seen_links(links, dom_tld, depth, seen_filter), 0
+    groups = canonicalizer.group_links(links)
+    unseen = set(_drop_seen_links(list(groups), dom_tld, depth, seen_filter))
+    out, saved = [], 0
+    for key, group in groups.items():
+        if key in unseen:
+            out.append(group[0])
+            saved += len(group) - 1
+        else:
+            # The link equal to its key would have been found seen anyway
+            saved += len(group) - (key in group)
+    return out, saved
+
+def extract_and_queue_html_links(c, dom_stats, qout, conf, logger, current_engine, seen_filter=None, canonicalizer=None):
+    """Extract links from HTML content and add them to the queue, return the requests saved by canonicalization"""
     rd = c['request_discriminator']
     status_code = c['status_code']
     depth = c['depth']
@@ -38,54 +65,60 @@ def extract_and_queue_html_links(c, dom_stats, qout, conf, logger, current_engin
     sub_dom_tld = c.get('sub_dom_tld', dom_tld)
     
     if status_code != 200 or c['content'] is None:
-        return
+        return 0
     
     if rd not in ['landing_page', 'internal_url']:
-        return
+        return 0
         
     if depth + 1 > conf['WEBSITES_MAX_DEPTH']:
-        return
+        return 0
     
     # Extract links from HTML content
     html_parser = HtmlParser(logger, conf)
     links = html_parser.extract_urls_from_content(dom_tld, sub_dom_tld, c['content'])
 
     links = _apply_url_filters(links, conf)
+    links, saved = _canonical_unseen_links(links, dom_tld, depth + 1, seen_filter, canonicalizer)
 
     links = dom_stats.filter_and_add_links(dom_tld, links, conf['MAX_PAGES_POR_DOMAIN'])
-    for link in links:
-        # print(link)
-        qout.put((link, 'internal_url', dom_tld, 0, depth+1, current_engine))
+    if links:
+        qout.put_many([(link, 'internal_url', dom_tld, 0, depth+1, current_engine) for link in links])
+    return saved
 
 
-def extract_and_queue_sitemap_links(c, dom_stats, qout, conf, logger, current_engine):
-    """Extract links from sitemap content and add them to the queue"""
+def extract_and_queue_sitemap_links(c, dom_stats, qout, conf, logger, current_engine, seen_filter=None, canonicalizer=None):
+    """Extract links from sitemap content and add them to the queue, return the requests saved by canonicalization"""
     rd = c['request_discriminator']
     status_code = c['status_code']
     depth = c['depth']
     dom_tld = c['dom_tld']
 
     if status_code != 200 or c['content'] is None:
-        return
+        return 0
 
     if rd != 'sitemap':
-        return
+        return 0
 
     # Extract links from sitemap content
     smp = SitemapParser(logger, conf)
     sitemap_links = smp.extract_all_links(c['content'])
     sitemap_links = _apply_url_filters(sitemap_links, conf)
+    sitemap_links = [domains.add_https_protocol(link) for link in sitemap_links]
+    sitemap_links, saved = _canonical_unseen_links(sitemap_links, dom_tld, depth + 1, seen_filter, canonicalizer)
 
     links = dom_stats.filter_and_add_links(dom_tld, sitemap_links, conf['MAX_PAGES_POR_DOMAIN'])
-    for link in links:
-        link_with_protocol = domains.add_https_protocol(link)
-        qout.put((link_with_protocol, 'internal_url', dom_tld, 0, depth + 1, current_engine))
-
-
-def unified_link_extraction(c, dom_stats, qout, conf, logger, current_engine):
-    """Unified function to handle both HTML and sitemap link extraction"""
-    extract_and_queue_html_links(c, dom_stats, qout, conf, logger, current_engine)
-    extract_and_queue_sitemap_links(c, dom_stats, qout, conf, logger, current_engine)
+    if links:
+        qout.put_many([
+            (link, 'internal_url', dom_tld, 0, depth + 1, current_engine)
+            for link in links
+        ])
+    return saved
+
+
+def unified_link_extraction(c, dom_stats, qout, conf, logger, current_engine, seen_filter=None, canonicalizer=None):
+    """Unified function to handle both HTML and sitemap link extraction, return the requests saved by canonicalization"""
+    return (extract_and_queue_html_links(c, dom_stats, qout, conf, logger, current_engine, seen_filter, canonicalizer)
+            + extract_and_queue_sitemap_links(c, dom_stats, qout, conf, logger, current_engine, seen_filter, canonicalizer))
 
 def increase_script_controller_counters(rd, script_controller, lock):
     
@@ -1,91 +1,160 @@
 import time
-import random
-import multiprocessing as mp
+from collections import Counter
 from queue import Empty  # Import to catch queue exceptions
 
-# NEW: Track recently processed domains per worker
-from collections import defaultdict, deque
-import time
-
-from ispider_core.utils import queues
-from ispider_core.utils import ifiles
+from ispider_core.crawlers.cls_domain_scheduler import DomainScheduler
+from ispider_core.crawlers.cls_seen_filter import drop_seen
+from ispider_core.utils.canonical import UrlCanonicalizer
+from ispider_core.utils.priorities import RequestPriority
 
 from ispider_core.utils.logger import LoggerFactory
 
+
+def release_unseen(scheduler, limit, seen_filter, dom_stats, qin, qout, canonicalizer=None):
+    '''
+    Put up to limit requests whose domain delay passed into qin, return
+    them and the seconds qin had been empty before. Copies of a url that
+    waited together in the scheduler, or are released in the same batch,
+    go to qin once.
+    They are marked as seen once in qin, then acknowledged to qout: a
+    checkpoint meanwhile finds them in qin or still leased from qout.
+    With a canonicalizer, seen filter calls go by the key of the urls.
+    '''
+    popped = scheduler.pop_ready(limit)
+    ready = drop_seen(seen_filter, popped, dom_stats, unique=True, canonicalizer=canonicalizer)
+    empty_for = 0
+    if ready:
+        empty_for = qin.put_many(ready) or 0
+        seen_filter.mark_seen(canonicalizer.key_reqs(ready) if canonicalizer is not None else ready)
+    if popped:
+        qout.ack(popped)
+    return ready, empty_for
+
+
 def queue_in_srv(
-    script_controller, dom_stats, 
+    script_controller, dom_stats,
     seen_filter, conf, qin, qout):
-    
+    '''
+    Move requests from qout to qin through the per-domain politeness scheduler.
+    A request reaches qin only when DELAY_DOMAIN_SEC passed since the last
+    request released for the same domain. Past SCHEDULER_MAX_PENDING_DOMAIN
+    requests of a domain in the scheduler, the next ones go back to qout.
+    The loop blocks on qout (up to the next eligible time) instead of polling,
+    and on qin until workers drain it below the low-water mark.
+    Requests are leased from qout until they reach qin, or go back to it:
+    checkpoints include the ones waiting here.
+    '''
     logger = LoggerFactory.create_logger(conf, "ispider.log", stdout_flag=True)
-    
+
     Q_MAX = conf['QUEUE_MAX_SIZE']
     Q_BLOCK_MAX = max(min(Q_MAX, 5000), Q_MAX // 2)
-    Q_BLOCK_MIN = max(min(Q_MAX, 1000), Q_MAX // 10)
+    MAX_PENDING = conf.get('SCHEDULER_MAX_PENDING') or Q_MAX
+    # qin is refilled up to HIGH_WATER as soon as it drops below LOW_WATER
+    HIGH_WATER = Q_MAX // 2
+    LOW_WATER = min(conf.get('QUEUE_LOW_WATER') or HIGH_WATER // 2, HIGH_WATER)
 
-    to_insert = []
+    scheduler = DomainScheduler(
+        min_delay=conf.get('DELAY_DOMAIN_SEC', 0.5),
+        priority=RequestPriority.from_conf(conf),
+        max_per_domain=conf.get('SCHEDULER_MAX_PENDING_DOMAIN', 1000))
+    canonicalizer = UrlCanonicalizer(conf)
 
     logger.debug("Begin Queue Process")
-    
+
     t0 = time.time()
+    released_t0 = 0
+
+    # Only this process fills qin: the size is known after each put, and
+    # can only shrink until the next one
+    qin_size = qin.qsize()
+    work_since = None   # when a request became releasable, till the next refill
+    starved = 0         # seconds qin was empty while a request was releasable
+    refills = 0
+
+    def publish_stats(tdiff):
+        nonlocal released_t0
+        st = scheduler.stats()
+        script_controller.update({
+            'sched_pending': st['pending'],
+            'sched_domains': st['domains'],
+            'sched_released': st['released'],
+            'sched_deferred': st['deferred'],
+            'sched_rate': round((st['released'] - released_t0) / tdiff, 2) if tdiff else 0,
+            'qin_starved_sec': round(starved, 2),
+            'qin_refills': refills,
+        })
+        released_t0 = st['released']
 
-    recent_domains = defaultdict(lambda: deque(maxlen=100))  # Track last 100 domains per worker
-    domain_last_seen = {}
-    
     try:
         while True:
             # logger.info("QueueIN Cycle")
-            if time.time() - t0 > 5:
+            tdiff = time.time() - t0
+            if tdiff > 5:
                 if script_controller['running_state'] == 0:
-                    logger.info(f"Closing queue_in_srv, to insert: {len(to_insert)}")
+                    logger.info(f"Closing queue_in_srv, to insert: {len(scheduler)}")
                     break
+                publish_stats(tdiff)
                 t0 = time.time()
 
-            reqA = None
-            if not qout.empty():
+            # Pull from qout: block only when nothing can be released now
+            if len(scheduler) < MAX_PENDING:
+                wait = scheduler.next_eligible_in()
+                wait = 1 if wait is None else min(wait, 1)
                 try:
-                    reqA = qout.get(timeout=1)
-
-                    #--------------------
-                    # Verify if in seen
-                    if seen_filter.req_in_seen(reqA):
-                        dom_stats.reduce_missing(reqA[2])
-                        dom_stats.reduce_total(reqA[2])
-                        continue
-                    #--------------------
+                    reqsA = qout.get_many(
+                        min(Q_BLOCK_MAX, MAX_PENDING - len(scheduler)),
+                        block=wait > 0, timeout=wait, lease=True)
                 except Empty:
-                    pass
-
-            # logger.debug(f"[QIN] GOT from qout: {reqA}")
-
-            if reqA is not None:
-                to_insert.append(reqA)
-
-            if len(to_insert) < Q_BLOCK_MIN and qout.empty():
-                # logger.debug(f"Qwait case 1 --> INS: {len(to_insert)} -- BLOCK: {Q_BLOCK_MIN} -- OUT: {qout.qsize()} -- IN: {qin.qsize()}")
-                time.sleep(.5)  # Lower sleep time for responsiveness
-
-            if len(to_insert) >= Q_BLOCK_MAX or qout.empty():
-                while qin.qsize() >= Q_MAX // 2 and script_controller['running_state']:
-                    time.sleep(2)
-
-                # Ensure function exists before calling
-                to_insert = queues.sparse_q_elements_with_timing(
-                    to_insert, 
-                    domain_last_seen,
-                    min_delay=conf.get('DELAY_DOMAIN_SEC', 0.5)
-                )
-
-                for el in to_insert:
-                    seen_filter.add_to_seen_req(el)
-                    # logger.debug(f"[QIN] PUT into qin: {el}")
-                    qin.put(el)
-
-                to_insert.clear()
-
+                    reqsA = []
+
+                # Verify if in seen, one lookup for the block
+                unseen = drop_seen(seen_filter, reqsA, dom_stats, canonicalizer=canonicalizer)
+                deferred = scheduler.push_many(unseen)
+                if deferred:
+                    # Domains already full wait in qout, behind the other ones
+                    qout.put_many(deferred)
+                # Seen or given back: only the ones kept by the scheduler stay leased
+                done = deferred + list((Counter(reqsA) - Counter(unseen)).elements())
+                if done:
+                    qout.ack(done)
+                if deferred and len(deferred) == len(reqsA):
+                    # Nothing taken: read qout again after the next release
+                    time.sleep(min(scheduler.next_eligible_in() or 0, 1))
+
+            wait = scheduler.next_eligible_in()
+            if wait != 0:
+                if len(scheduler) >= MAX_PENDING:
+                    # qout is not read while full, sleep till the next release
+                    time.sleep(wait or 0)
+                continue
+
+            if work_since is None:
+                work_since = time.monotonic()
+
+            # Backpressure: wait for the workers to drain qin
+            if qin_size >= LOW_WATER:
+                qin_size = qin.wait_below(LOW_WATER, timeout=1)
+                if qin_size >= LOW_WATER:
+                    continue
+
+            ready, empty_for = release_unseen(
+                scheduler, min(HIGH_WATER - qin_size, Q_BLOCK_MAX), seen_filter, dom_stats, qin, qout,
+                canonicalizer)
+            if ready:
+                # logger.debug(f"[QIN] PUT into qin: {len(ready)}")
+                starved += min(empty_for, time.monotonic() - work_since)
+                qin_size += len(ready)
+                refills += 1
+                work_since = None
+
+        # Give back what was never released, so it is saved with qout
+        pending = scheduler.drain()
+        if pending:
+            qout.put_many(pending)
+            qout.ack(pending)
 
     except KeyboardInterrupt:
-        logger.warning(f"Keyboard Interrupt received. Missing to insert: {len(to_insert)}")
+        logger.warning(f"Keyboard Interrupt received. Missing to insert: {len(scheduler)}")
         logger.warning("Keyboard Interrupt received. Closing the q_in queue manager")
     except Exception as e:
         logger.fatal(f"Fatal error in qproc: {e}")
-
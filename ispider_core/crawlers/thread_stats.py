@@ -73,12 +73,12 @@ def stats_srv(
 
 
                     count_all_domains = shared_dom_stats.get_tot_domains()
-                    count_finished_domains = shared_dom_stats.count_by(lambda v: v == 0)
-                    count_unfinished_domains = count_all_domains - count_finished_domains
-                    count_bigger_domains = shared_dom_stats.count_by(lambda v: v > 100)
-                    sorted_dom_missing = shared_dom_stats.get_sorted_missing(reverse=True)
-                    bl = [f"{k}:{v}" for k, v in list(sorted_dom_missing.items())[:20]]
-                    sl = [f"{k}:{v}" for k, v in list(sorted_dom_missing.items()) if v > 0][-5:]
+                    count_finished_domains = shared_dom_stats.count_finished()
+                    count_unfinished_domains = shared_dom_stats.count_unfinished()
+                    backlogs = shared_dom_stats.backlog_summary(k=20)
+                    count_bigger_domains = sum(n for lo, _, n in backlogs['histogram'] if lo >= 128)
+                    bl = [f"{k}:{v}" for k, v in backlogs['top']]
+                    hl = [f"{lo}-{hi}:{n}" for lo, hi, n in backlogs['histogram']]
 
                     logger.info("******************* STATS ***********************")
                     logger.info(f"#### SPEED: {speed_mb} Kb/s")
@@ -87,15 +87,46 @@ def stats_srv(
                     logger.info(f"*** [Requests: {current_count}/{int((t0 - start.timestamp()) / 60)}m] "
                                 f"QOUT SIZE: {shared_qout.qsize()} QIN SIZE: {shared_qin.qsize()}")
                     logger.info(f"*** [Finished: {count_finished_domains}/{count_all_domains}] - Incomplete: {count_unfinished_domains} "
-                                f"- [More than 100: {count_bigger_domains}]")
+                                f"- [More than 127: {count_bigger_domains}]")
                     logger.info(f"Landings:  {shared_script_controller.get('landings', 0)}")
                     logger.info(f"Robots:    {shared_script_controller.get('robots', 0)}")
                     logger.info(f"Sitemaps:  {shared_script_controller.get('sitemaps', 0)}")
                     logger.info(f"Internals: {shared_script_controller.get('internal_urls', 0)}")
+                    logger.info(f"Canonical URLs: {shared_script_controller.get('canonical_saved', 0)} requests saved")
+                    try:
+                        fst = shared_qout.stats()
+                        logger.info(f"Frontier: {fst['memory']} in memory, {fst['disk']} on disk ({fst['segments']} segments)")
+                        logger.info(f"QOUT by priority: {fst['by_priority']}")
+                    except AttributeError:
+                        pass
+                    try:
+                        logger.info(f"QIN by priority: {shared_qin.backlog()}")
+                    except AttributeError:
+                        pass
+                    logger.info(f"Scheduler: released {shared_script_controller.get('sched_released', 0)} "
+                                f"({shared_script_controller.get('sched_rate', 0)}/s) - "
+                                f"pending {shared_script_controller.get('sched_pending', 0)} "
+                                f"on {shared_script_controller.get('sched_domains', 0)} domains - "
+                                f"deferred to qout {shared_script_controller.get('sched_deferred', 0)}")
+                    logger.info(f"QIN starved: {shared_script_controller.get('qin_starved_sec', 0)}s empty "
+                                f"while requests were ready, in {shared_script_controller.get('qin_refills', 0)} refills")
+                    lock_wait = shared_script_controller.get('lock_wait') or {}
+                    logger.info(f"Lock wait: {sum(lock_wait.values()):.2f}s - by worker "
+                                f"{ {mod: round(v, 2) for mod, v in sorted(lock_wait.items())} }")
+                    logger.info(f"Domain stats: {shared_script_controller.get('stats_puts', 0)} updates sent as "
+                                f"{shared_script_controller.get('stats_items', 0)} merged ones - "
+                                f"lag {shared_script_controller.get('stats_lag', 0)}s")
+                    if conf.get('EXECUTION_MODE', 'shared') == 'sharded':
+                        logger.info(f"Shards: {conf['POOLS']} - pending {shared_script_controller.get('shard_pending', 0)}")
                     logger.info(f"T5: {bl}")
-                    logger.info(f"B5: {sl}")
-
-                    logger.info(f"Seen Filter len: {seen_filter.bloom_len()}")
+                    logger.info(f"Backlogs: {hl}")
+
+                    seen = seen_filter.stats()
+                    logger.info(f"Seen Filter: {seen['items']} items in {seen['stages']} stages"
+                                + (f" ({seen['partitions']} domains)" if 'partitions' in seen else "") + " - "
+                                f"fill {seen['fill_ratio']:.1%} - est. FP rate {seen['fp_rate']:.2e} - "
+                                f"{seen['bytes'] / 2**20:.1f} MB"
+                                + (f" + {seen['disk_bytes'] / 2**20:.1f} MB on disk" if 'disk_bytes' in seen else ""))
 
                 except Exception as e:
                     logger.warning(f"Stats Not available at the moment: {e}")
@@ -18,9 +18,27 @@ MAXIMUM_RETRIES = 2
 # Number of concurrent connections per process during crawling
 ASYNC_BLOCK_SIZE = 4
 
+# How each process drives its ASYNC_BLOCK_SIZE connections
+# 'sliding': keeps ASYNC_BLOCK_SIZE requests in flight on a long-lived event
+#            loop, a new fetch starts as soon as any completes (default)
+# 'block': fetches a block of ASYNC_BLOCK_SIZE requests and waits for the
+#          slowest one before processing and starting the next block
+FETCH_MODE = 'sliding'
+
 # Number of parallel processes (based on your CPU core count)
 POOLS = 4
 
+# How the POOLS processes share the work
+# 'shared': any process fetches any domain, requests go through the central
+#           qout -> scheduler -> qin pipeline, counters are shared (default)
+# 'sharded': domains are partitioned by hash across the processes, each one
+#            owns frontier, scheduler, seen filter and counters of its
+#            domains and only reports progress to the controller every
+#            SHARD_REPORT_SEC. Always uses the 'sliding' FETCH_MODE.
+#            Resuming needs the same POOLS (seen filter saved per shard).
+EXECUTION_MODE = 'shared'
+SHARD_REPORT_SEC = 2
+
 # Maximum timeout for each connection (in seconds)
 TIMEOUT = 5
 
@@ -64,19 +82,146 @@ CRAWL_METHODS = ['robots', 'sitemaps']
 # Maximum queue size; 1 billion is acceptable on most systems
 QUEUE_MAX_SIZE = 100000
 
+# Transport used for the crawl queues (qin/qout)
+# 'manager': queues served by the multiprocessing Manager process (default)
+# 'shm': shared-memory ring buffers, no round-trip through the Manager server.
+#        Rings live in /dev/shm, so make sure it is big enough for both sizes.
+QUEUE_TRANSPORT = 'manager'
+
+# Ring sizes in bytes when QUEUE_TRANSPORT = 'shm'.
+# Workers never block on a full qout ring: the requests it can't take wait
+# in a Manager queue, served before the ring once it drains.
+QUEUE_SHM_BYTES = 64 * 1024 * 1024
+QUEUE_SHM_QOUT_BYTES = 512 * 1024 * 1024
+
+# With QUEUE_TRANSPORT = 'shm', requests cross the rings as compact records
+# (domain id, discriminator and engine ids, url) instead of pickled tuples.
+QUEUE_SHM_COMPACT = True
+
+# Seconds between two publications of the counters of a worker (pages,
+# bytes, landings, ...): they are kept in the worker meanwhile, and sent to
+# the controller as one delta, with no shared lock per response. The
+# per-domain stats (bytes, last status, robots, sitemaps) are merged and
+# sent in the same message, the stats log reports their lag.
+COUNTERS_FLUSH_SEC = 1
+
+# Where the seen filter (Bloom filter of fetched URLs) lives
+# 'shm': bits in shared memory, each process tests and sets them directly (default)
+# 'manager': served by a Manager process, every lookup is a round-trip
+SEEN_FILTER_TRANSPORT = 'shm'
+
+# Domain counters (dom_missing, dom_total, dom_last_call) transport
+# 'shm': shared-memory arrays indexed by domain id, updated under one of
+# DOMAIN_STATS_LOCK_STRIPES locks picked by domain (default)
+# 'manager': Manager dicts, every update is a round-trip under shared_lock
+DOMAIN_STATS_TRANSPORT = 'shm'
+DOMAIN_STATS_LOCK_STRIPES = 64
+
+# Every DOMAIN_ARCHIVE_SEC the domains finished since the previous pass are
+# moved to an SQLite file (DOMAIN_ARCHIVE_PATH, default
+# path_data/domain_archive.sqlite), so the memory of the domain stats
+# follows the domains in progress. 'shm' domain stats keep their compact
+# counters in memory and move engine and local stats. 0 disables it;
+# not used with EXECUTION_MODE 'sharded'.
+DOMAIN_ARCHIVE_SEC = 60
+DOMAIN_ARCHIVE_PATH = None
+
+# Seen filter sizing: it starts with room for SEEN_FILTER_CAPACITY URLs and
+# adds a twice bigger stage each time the last one is full, keeping the
+# false positive rate (URLs wrongly skipped) under SEEN_FILTER_ERROR_RATE
+SEEN_FILTER_CAPACITY = 1_000_000
+SEEN_FILTER_ERROR_RATE = 0.001
+
+# Seen filter backend
+# 'bloom': scalable Bloom filter above, a few URLs wrongly skipped (default)
+# 'exact': set of 64-bit URL fingerprints, no URL wrongly skipped. Up to
+# SEEN_EXACT_MEMORY_ITEMS are kept in RAM (16 bytes each), older ones in
+# sorted memory-mapped files under SEEN_EXACT_DIR (default data/seen_exact)
+# 'partitioned': one Bloom filter per domain, sized for SEEN_PARTITION_CAPACITY
+# URLs (default MAX_PAGES_POR_DOMAIN) and freed for new domains when the
+# domain is finished, checked every SEEN_RELEASE_SEC
+SEEN_FILTER_BACKEND = 'bloom'
+SEEN_EXACT_MEMORY_ITEMS = 4_000_000
+SEEN_EXACT_DIR = None
+SEEN_PARTITION_CAPACITY = None
+SEEN_RELEASE_SEC = 60
+
+# Canonical URLs: requests are deduplicated and looked up in the seen filter
+# by the canonical form of their url (query parameters sorted, fragment,
+# default port and tracking parameters dropped), the url found first is the
+# one fetched. CANONICAL_STRIP_PARAMS are fnmatch patterns, None for the
+# default list (utm_*, gclid, fbclid, ...), [] to keep them all
+CANONICAL_URLS = True
+CANONICAL_STRIP_PARAMS = None
+CANONICAL_LOWERCASE_PATH = False
+CANONICAL_STRIP_TRAILING_SLASH = True
+# http/https and www/bare host variants of a url share its key; off by
+# default, they are different resources on many sites
+CANONICAL_IGNORE_SCHEME = False
+CANONICAL_STRIP_WWW = False
+
+# Log qin/qout enqueues and dequeues to path_data/journal as they happen.
+# Saving the state then only syncs what changed since the previous save,
+# and RESUME replays the journal instead of loading the pickled queues.
+# The journal is compacted once it holds more than FRONTIER_JOURNAL_COMPACT_MIN
+# entries and twice the queued requests. Not available with the 'shm' transport.
+FRONTIER_JOURNAL = False
+FRONTIER_JOURNAL_COMPACT_MIN = 100_000
+
+# Write a checkpoint of the crawl (queues, seen filter, domain stats) to
+# path_data/checkpoints every CHECKPOINT_INTERVAL_SEC while crawling,
+# without pausing the workers. Requests being fetched or waiting in the
+# domain scheduler are in it too. RESUME starts from the newest complete one,
+# the last CHECKPOINT_KEEP are kept. None or 0 only saves at shutdown,
+# as does EXECUTION_MODE = 'sharded'.
+CHECKPOINT_INTERVAL_SEC = 300
+CHECKPOINT_KEEP = 2
+
+# Order in which queued requests are served (qout, qin and per domain in the
+# scheduler), by request discriminator: earlier ones go first, so the
+# discovery work is done before deep pages. Within the same discriminator,
+# shallower depths go first if QUEUE_PRIORITY_BY_DEPTH.
+# Set to None for plain FIFO queues. The 'shm' transport is always FIFO.
+QUEUE_PRIORITIES = ['robots', 'sitemap', 'landing_page', 'internal_url']
+QUEUE_PRIORITY_BY_DEPTH = True
+
+# Max requests kept in memory by the qout frontier.
+# Past this threshold new requests are appended to segment files under
+# FRONTIER_SPILL_DIR (default: path_data/frontier, one directory per run)
+# and paged back in as the queue drains, keeping memory flat regardless of
+# the frontier size. With QUEUE_TRANSPORT = 'shm', qout stays a ring and
+# the frontier only takes what the ring can't.
+# Set to None to use a plain QUEUE_TRANSPORT queue for qout.
+FRONTIER_MEMORY_ITEMS = 1_000_000
+FRONTIER_SEGMENT_ITEMS = 100_000
+FRONTIER_SPILL_DIR = None
+
 # Maximum depth to follow when crawling websites
 WEBSITES_MAX_DEPTH = 2
 
-# This feature is implemented but not yet thread-safe.
-# While counting, other workers might add links that aren't included in the count,
-# which can result in more pages being downloaded per domain than expected.
-# Adding this check under a lock could slow things down and needs further testing.
+# Maximum requests per domain. New links reserve their pages from this
+# budget in one atomic update (under the lock of the domain stripe with the
+# 'shm' domain stats), and links dropped before being fetched give them
+# back, so the cap holds exactly with any number of workers.
+# A redirect adds the pages of the original domain to the final one.
 MAX_PAGES_POR_DOMAIN = 5000
 
-# Milliseconds delay on the same domain
-# Don't consider it super safe, since this doesn't consider timeouts in calls
-# And time for the server to answer
-# DELAY_DOMAIN_MILL = 1000
+# Seconds between two requests released to the same domain.
+# Enforced by the per-domain scheduler when moving requests from qout to qin,
+# it doesn't consider timeouts in calls and time for the server to answer.
+DELAY_DOMAIN_SEC = 0.5
+
+# qin is refilled (up to QUEUE_MAX_SIZE / 2) as soon as the workers drain it
+# below this mark. None means QUEUE_MAX_SIZE / 4.
+QUEUE_LOW_WATER = None
+
+# Max requests held by the scheduler while waiting for their domain delay.
+# None means QUEUE_MAX_SIZE.
+SCHEDULER_MAX_PENDING = None
+
+# Max requests of one domain in the scheduler: the next ones stay in qout,
+# so a domain with a big sitemap doesn't keep the others out. None for no cap.
+SCHEDULER_MAX_PENDING_DOMAIN = 1000
 
 # Attempt to exclude certain file types.
 # Also inspects the first bytes of content for commonly excluded file types,
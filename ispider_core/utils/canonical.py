@@ -0,0 +1,93 @@
+"""
+Canonical form of the URLs, the key under which they are deduplicated and
+looked up in the seen filter: tracking parameters stripped, query parameters
+sorted, fragment dropped, host lowercased, default port and trailing slash
+removed. The trivially different URLs of a page share it, and are fetched
+once, under the first form found: the key itself is never fetched.
+"""
+import re
+import fnmatch
+from urllib.parse import urlsplit, urlunsplit
+
+from w3lib.url import canonicalize_url
+
+DEFAULT_STRIP_PARAMS = (
+    'utm_*', 'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi', 'ref_src',
+)
+
+# Anything else has to be percent-encoded first
+_SAFE = re.compile(r"^[A-Za-z0-9\-._~:/?\[\]@!$&'()*+,;=%]*$")
+_DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+class UrlCanonicalizer:
+    """
+    Rules from conf: CANONICAL_URLS (on by default), CANONICAL_STRIP_PARAMS
+    (fnmatch patterns, case insensitive), CANONICAL_LOWERCASE_PATH,
+    CANONICAL_STRIP_TRAILING_SLASH, CANONICAL_IGNORE_SCHEME and
+    CANONICAL_STRIP_WWW.
+    """
+
+    def __init__(self, conf):
+        self.enabled = conf.get('CANONICAL_URLS', True)
+        patterns = conf.get('CANONICAL_STRIP_PARAMS')
+        if patterns is None:
+            patterns = DEFAULT_STRIP_PARAMS
+        self.strip = re.compile('|'.join(fnmatch.translate(p) for p in patterns), re.I) if patterns else None
+        self.lowercase_path = conf.get('CANONICAL_LOWERCASE_PATH', False)
+        self.strip_trailing_slash = conf.get('CANONICAL_STRIP_TRAILING_SLASH', True)
+        self.ignore_scheme = conf.get('CANONICAL_IGNORE_SCHEME', False)
+        self.strip_www = conf.get('CANONICAL_STRIP_WWW', False)
+
+    def canonical(self, url):
+        if not _SAFE.match(url):
+            # Spaces, non-ASCII: encoded as browsers do
+            url = canonicalize_url(url, keep_fragments=True)
+        parts = urlsplit(url)
+
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        port = _DEFAULT_PORTS.get(scheme)
+        if port and netloc.endswith(port):
+            netloc = netloc[:-len(port)]
+        if self.strip_www and netloc.startswith('www.'):
+            netloc = netloc[4:]
+        if self.ignore_scheme:
+            # "//host/path": http and https share it
+            scheme = ''
+
+        path = parts.path or '/'
+        if self.lowercase_path:
+            path = path.lower()
+        if self.strip_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+
+        params = [p for p in parts.query.split('&') if p]
+        if self.strip:
+            params = [p for p in params if not self.strip.match(p.split('=', 1)[0])]
+        return urlunsplit((scheme, netloc, path, '&'.join(sorted(params)), ''))
+
+    def key(self, url):
+        """Dedup key of url: its canonical form, url itself when disabled or unparsable."""
+        if not self.enabled:
+            return url
+        try:
+            return self.canonical(url)
+        except ValueError:
+            return url
+
+    def group_links(self, links):
+        """{key: the distinct links with that key}, in the order of links."""
+        groups = {}
+        for link in links:
+            group = groups.setdefault(self.key(link), [])
+            if link not in group:
+                group.append(link)
+        return groups
+
+    def key_reqs(self, reqsA):
+        """reqsA with their url replaced by its key, for the seen filter calls."""
+        if not self.enabled:
+            return reqsA
+        return [(self.key(reqA[0]), *reqA[1:]) for reqA in reqsA]
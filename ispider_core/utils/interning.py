@@ -0,0 +1,157 @@
+"""
+Small integer ids for the strings repeated by every request tuple
+(url, rd, dom_tld, retries, depth, engine).
+
+Discriminators and engines are fixed lists, their ids are the same in
+every process and run. Domains get theirs from an InternTable shared by
+the processes of a crawl, the domain stats' domain_ids. RequestCodec turns
+requests into compact records with them, for the queues moving requests
+between processes; the JSON records carry the domain id as dom_id, and
+the API's /spider/ids maps the ids back to names.
+"""
+import sys
+import pickle
+import struct
+import multiprocessing as mp
+
+DISCRIMINATORS = ('landing_page', 'robots', 'sitemap', 'internal_url')
+ENGINES = (None, 'httpx', 'curl', 'seleniumbase')
+
+RD_IDS = {rd: i for i, rd in enumerate(DISCRIMINATORS)}
+ENGINE_IDS = {engine: i for i, engine in enumerate(ENGINES)}
+
+
+def intern_request(reqA):
+    """reqA sharing the rd, dom_tld and engine strings of the other queued requests."""
+    if type(reqA) is tuple and len(reqA) == 6 and type(reqA[2]) is str:
+        url, rd, dom_tld, retries, depth, engine = reqA
+        return (url, sys.intern(rd) if type(rd) is str else rd, sys.intern(dom_tld), retries, depth,
+                sys.intern(engine) if type(engine) is str else engine)
+    return reqA
+
+
+class InternTable:
+    """
+    Strings <-> ids shared by processes. Ids are assigned in order under a
+    multiprocessing lock and never change, so each process caches what it
+    looked up and only asks the Manager (a dict and a list) about strings
+    or ids it has not met yet.
+
+    Like any multiprocessing lock, it must reach other processes by
+    inheritance (mp.Process args).
+    """
+
+    def __init__(self, manager):
+        self._lock = mp.Lock()
+        self._count = mp.Value('q', 0, lock=False)
+        self._table = manager.dict()
+        self._list = manager.list()
+        self._ids = {}
+        self._names = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_ids'], state['_names'] = {}, []
+        return state
+
+    def __len__(self):
+        return self._count.value
+
+    def get(self, name):
+        """Id of name, None if it was never interned."""
+        i = self._ids.get(name)
+        if i is None:
+            i = self._table.get(name)
+            if i is not None:
+                self._ids[name] = i
+        return i
+
+    def intern(self, name):
+        i = self._ids.get(name)
+        return i if i is not None else self.intern_many([name])[0]
+
+    def intern_many(self, names, reserve=None):
+        """
+        Ids of names, assigning the missing ones. reserve(count), called
+        under the lock before new ids are published, lets the caller make
+        room for count ids.
+        """
+        out = [self._ids.get(name) for name in names]
+        if None not in out:
+            return out
+        with self._lock:
+            count = self._count.value
+            table = self._table
+            if len(names) > 16:
+                # Bulk: one round-trip for the whole table
+                table = dict(table)
+            new = {}
+            for k, name in enumerate(names):
+                if out[k] is None:
+                    out[k] = new.get(name, table.get(name))
+                if out[k] is None:
+                    out[k] = new[name] = count + len(new)
+            if new:
+                if reserve is not None:
+                    reserve(count + len(new))
+                # Names first: a published id always has its name
+                self._list.extend(list(new))
+                self._table.update(new)
+                self._count.value = count + len(new)
+        for name, i in zip(names, out):
+            self._ids[name] = i
+        return out
+
+    def reserve_assigned(self, reserve):
+        """
+        Call reserve(count) under the lock, count the ids assigned so far:
+        room for the ids assigned by intern_many calls without reserve.
+        """
+        with self._lock:
+            reserve(self._count.value)
+
+    def names(self, count=None):
+        """Names of the ids below count (default all), in id order."""
+        count = len(self) if count is None else count
+        if len(self._names) < count:
+            self._names.extend(self._list[len(self._names):count])
+        return self._names[:count]
+
+    def name(self, i):
+        if i >= len(self._names):
+            # Everything published so far, in one round-trip
+            self.names()
+        return self._names[i]
+
+
+class RequestCodec:
+    """
+    Request tuples as compact records: a header of ids and small integers
+    followed by the UTF-8 url, about half the bytes of a pickled tuple.
+    Anything else (or a request with an unknown discriminator or engine)
+    is pickled, behind a different tag byte.
+    """
+    _REQUEST = struct.Struct('<BIBBHH')  # tag, domain id, rd id, engine id, retries, depth
+    _PICKLED = b'\x00'
+    _TAG = 1
+
+    def __init__(self, domains):
+        self.domains = domains
+
+    def dumps(self, item):
+        if type(item) is tuple and len(item) == 6:
+            url, rd, dom_tld, retries, depth, engine = item
+            rd_id, engine_id = RD_IDS.get(rd), ENGINE_IDS.get(engine)
+            if (rd_id is not None and engine_id is not None and type(dom_tld) is str and type(url) is str
+                    and type(retries) is int and type(depth) is int
+                    and 0 <= retries < 65536 and 0 <= depth < 65536):
+                return self._REQUEST.pack(
+                    self._TAG, self.domains.intern(dom_tld), rd_id, engine_id, retries, depth) + url.encode('utf-8')
+        return self._PICKLED + pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        if data[0] != self._TAG:
+            return pickle.loads(data[1:])
+        _, dom_id, rd_id, engine_id, retries, depth = self._REQUEST.unpack_from(data)
+        return (data[self._REQUEST.size:].decode('utf-8'), DISCRIMINATORS[rd_id],
+                self.domains.name(dom_id), retries, depth, ENGINES[engine_id])
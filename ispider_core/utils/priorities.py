@@ -0,0 +1,36 @@
+class RequestPriority:
+    """
+    Map a request tuple to a priority level, lower levels are served first.
+
+    Levels follow conf['QUEUE_PRIORITIES'], a list of request discriminators
+    (discovery first), then depth when conf['QUEUE_PRIORITY_BY_DEPTH'] is set.
+    With no QUEUE_PRIORITIES every request gets level 0, i.e. plain FIFO.
+    """
+    MAX_DEPTH = 99
+
+    def __init__(self, order=None, by_depth=True):
+        self.order = list(order or [])
+        self.ranks = {rd: i for i, rd in enumerate(self.order)}
+        self.by_depth = by_depth
+
+    @classmethod
+    def from_conf(cls, conf):
+        return cls(conf.get('QUEUE_PRIORITIES'), conf.get('QUEUE_PRIORITY_BY_DEPTH', True))
+
+    @property
+    def enabled(self):
+        return bool(self.order)
+
+    def level(self, reqA):
+        if not self.order:
+            return 0
+        rank = self.ranks.get(reqA[1], len(self.order))
+        depth = min(reqA[4], self.MAX_DEPTH) if self.by_depth else 0
+        return rank * (self.MAX_DEPTH + 1) + depth
+
+    def label(self, level):
+        if not self.order:
+            return 'fifo'
+        rank, depth = divmod(level, self.MAX_DEPTH + 1)
+        rd = self.order[rank] if rank < len(self.order) else 'other'
+        return f"{rd}:d{depth}" if self.by_depth else rd
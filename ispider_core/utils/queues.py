@@ -3,6 +3,27 @@ from heapq import heapify, heappop, heappush
 
 import time
 
+
+class PutBuffer:
+    """
+    Collect put() calls on a crawl queue and send them with a single
+    put_many(), so a block of requests crosses the process boundary once.
+    """
+    def __init__(self, q):
+        self.q = q
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def put_many(self, items):
+        self.items.extend(items)
+
+    def flush(self):
+        if self.items:
+            self.q.put_many(self.items)
+            self.items = []
+
 def sparse_q_elements_with_timing(A, domain_last_seen, min_delay=0.5):
     """
     Sparsing that considers timing between same-domain requests.
@@ -0,0 +1,152 @@
+"""
+Seen index: fingerprints of the fetched requests, persisted next to the
+dumps in path_dumps/.seen_index, so a new run starts with them in its seen
+filter without walking the dump folders.
+
+Each process appends to its own <pid>.idx file. A record is two
+little-endian 64-bit integers: the fingerprint of the request, keyed
+exactly like the seen filter lookups, and the key of its domain. A
+truncated record at the end of a file (crash while writing) is ignored.
+
+Dump folders written before the index existed can be indexed from the
+crawl metadata (unified_conn_meta*.json):
+
+    python -m ispider_core.utils.seen_index ~/.ispider
+"""
+import os
+import sys
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import xxhash
+
+from ispider_core.utils.canonical import UrlCanonicalizer
+
+RECORD = np.dtype([('fp', '<u8'), ('dom', '<u8')])
+
+_lock = threading.Lock()
+_files = {}
+
+
+def fingerprint(url, dom_tld):
+    """
+    64-bit fingerprint of a request, the only hash computed per URL. url
+    is the dedup key (UrlCanonicalizer.key), hashed as it is.
+    """
+    return xxhash.xxh3_64_intdigest(f"{url}|{dom_tld}")
+
+
+def domain_key(dom_tld):
+    return xxhash.xxh3_64_intdigest(dom_tld)
+
+
+def records(reqsA):
+    """Index records of requests, (url, rd, dom_tld, ...) tuples."""
+    out = np.empty(len(reqsA), dtype=RECORD)
+    out['fp'] = [fingerprint(reqA[0], reqA[2]) for reqA in reqsA]
+    out['dom'] = [domain_key(reqA[2]) for reqA in reqsA]
+    return out
+
+
+def index_dir(conf):
+    # Dot folder: never taken for a domain folder
+    return Path(conf['path_dumps']) / '.seen_index'
+
+
+def append(conf, reqsA):
+    """Append requests to the file of this process, one write per call."""
+    if not reqsA:
+        return
+    data = records(reqsA).tobytes()
+    key = (os.getpid(), str(index_dir(conf)))
+    with _lock:
+        fd = _files.get(key)
+        if fd is None:
+            index_dir(conf).mkdir(parents=True, exist_ok=True)
+            fd = os.open(index_dir(conf) / f"{key[0]}.idx", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            # Drop a torn record left by a previous process with this pid
+            size = os.fstat(fd).st_size
+            if size % RECORD.itemsize:
+                os.ftruncate(fd, size - size % RECORD.itemsize)
+            _files[key] = fd
+        os.write(fd, data)
+
+
+# Records filtered at a time by load()
+LOAD_BLOCK = 1 << 20
+
+
+def load(conf):
+    """
+    The index files mapped as RECORD arrays, not read until used. With
+    conf['seen_index_shard'], (mod, shards), only the records of the domains
+    of shard mod (cls_shards.shard_of), read in blocks.
+    """
+    arrays = []
+    base = index_dir(conf)
+    if not base.exists():
+        return arrays
+    shard = conf.get('seen_index_shard')
+    for path in sorted(base.glob('*.idx')):
+        n = path.stat().st_size // RECORD.itemsize
+        if not n:
+            continue
+        index = np.memmap(path, dtype=RECORD, mode='r', shape=(n,))
+        if shard is not None:
+            mod, shards = shard
+            index = np.concatenate([
+                block[block['dom'] % np.uint64(shards) == mod]
+                for block in (index[i:i + LOAD_BLOCK] for i in range(0, n, LOAD_BLOCK))])
+        if len(index):
+            arrays.append(index)
+    return arrays
+
+
+def rebuild(conf):
+    """
+    Rewrite the index from the metadata of the downloaded pages in
+    path_jsons, return the number of requests. The dump file names
+    can't give the URLs back, the metadata is the only source. URLs are
+    keyed by the canonical rules of conf, as the crawl looks them up.
+    """
+    canonicalizer = UrlCanonicalizer(conf)
+    reqsA = set()
+    for path in sorted(Path(conf['path_jsons']).glob('unified_conn_meta*.json')):
+        with open(path) as f:
+            for line in f:
+                try:
+                    resp = json.loads(line)
+                except ValueError:
+                    continue
+                if resp.get('is_downloaded'):
+                    reqsA.update(canonicalizer.key_reqs([(resp['url'], None, resp['dom_tld'])]))
+
+    base = index_dir(conf)
+    base.mkdir(parents=True, exist_ok=True)
+    tmp = base / 'rebuilt.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(records(sorted(reqsA)).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    for path in base.glob('*.idx'):
+        path.unlink()
+    os.replace(tmp, base / 'rebuilt.idx')
+    return len(reqsA)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("Usage: python -m ispider_core.utils.seen_index <USER_FOLDER>")
+        return 1
+    data = Path(os.path.expanduser(argv[0])) / 'data'
+    conf = {'path_dumps': data / 'dumps', 'path_jsons': data / 'jsons'}
+    n = rebuild(conf)
+    print(f"Seen index of {conf['path_dumps']}: {n} fetched requests")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
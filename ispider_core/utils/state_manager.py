@@ -1,9 +1,65 @@
 # utils/state_manager.py
 import os
+import json
 import pickle
+import shutil
 import threading
+from collections import Counter
+from datetime import datetime
 from pathlib import Path
 from ispider_core.utils.logger import LoggerFactory
+from ispider_core.crawlers.cls_queue_transport import read_snapshot
+
+
+# Checkpoints are path_data/checkpoints/ckpt_N directories, complete once
+# renamed from ckpt_N.tmp, manifest.json lists their content.
+def checkpoints_dir(conf):
+    return Path(conf['path_data']) / 'checkpoints'
+
+
+def list_checkpoints(conf):
+    """Complete checkpoints, oldest first."""
+    base = checkpoints_dir(conf)
+    if not base.exists():
+        return []
+    done = [p for p in base.glob('ckpt_*') if p.suffix != '.tmp' and (p / 'manifest.json').exists()]
+    return sorted(done, key=lambda p: int(p.name[len('ckpt_'):]))
+
+
+def latest_checkpoint(conf):
+    """(path, manifest) of the newest complete checkpoint, (None, None) if none."""
+    for path in reversed(list_checkpoints(conf)):
+        try:
+            with open(path / 'manifest.json') as f:
+                return path, json.load(f)
+        except (OSError, ValueError):
+            continue
+    return None, None
+
+
+def oldest_journal_marks(conf):
+    """{queue name: journal segment} of the oldest readable checkpoint."""
+    for path in list_checkpoints(conf):
+        try:
+            with open(path / 'manifest.json') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        return {name: entry['journal'] for name, entry in manifest['queues'].items() if entry.get('journal')}
+    return {}
+
+
+def journal_resume(conf, manifest, name):
+    """
+    How the journal of queue name is resumed: False (not at all), True
+    (replay it all, no checkpoint) or the segment recorded by the checkpoint.
+    """
+    if not conf.get('RESUME'):
+        return False
+    if manifest is None:
+        return True
+    return manifest['queues'].get(name, {}).get('journal') or False
+
 
 class ResumeState:
     def __init__(self, conf, controller):
@@ -35,6 +91,11 @@ class ResumeState:
         return None
 
     def resume_all(self):
+        path, manifest = self.ctrl.resume_checkpoint, self.ctrl.resume_manifest
+        if manifest is not None:
+            return self.resume_checkpoint(path, manifest)
+
+        # No checkpoint: state saved by older versions
         # 1. Resume domain stats internals FIRST (includes redirect mappings)
         ds = self.load_pickle('dom_stats')
         if ds is not None:
@@ -49,7 +110,7 @@ class ResumeState:
         self.ctrl.dom_tld_finished = domains
         self.logger.info(f"Loaded {len(domains)} finished domains")
 
-        # 3. Resume queues
+        # 3. Resume queues (journaled queues already replayed their journal)
         qin_items = self.load_pickle('qin') or []
         for itm in qin_items:
             self.ctrl.shared_qin.put(itm)
@@ -68,6 +129,58 @@ class ResumeState:
 
         return True
 
+    def resume_checkpoint(self, path, manifest):
+        self.logger.info(f"Resuming from checkpoint {path.name} of {manifest['created']} ({manifest['reason']})")
+
+        # 1. Domain stats internals FIRST (includes redirect mappings)
+        with open(path / manifest['dom_stats'], 'rb') as f:
+            self.ctrl.shared_dom_stats.restore(pickle.load(f))
+
+        # 2. Finished domains
+        with open(path / manifest['finished'], 'rb') as f:
+            self.ctrl.dom_tld_finished = pickle.load(f)
+        self.logger.info(f"Loaded {len(self.ctrl.dom_tld_finished)} finished domains")
+
+        # 3. Queues: journaled ones were replayed up to the checkpoint when created,
+        # their leased requests (being fetched or scheduled) are apart
+        for name, q in (('qin', self.ctrl.shared_qin), ('qout', self.ctrl.shared_qout)):
+            entry = manifest['queues'].get(name, {})
+            for key in ('file', 'leased'):
+                if key in entry:
+                    for chunk in read_snapshot(path / entry[key]):
+                        q.put_many(chunk)
+            self.logger.info(f"Resumed {name} with {q.qsize()} items")
+
+        # The domain stats were written after the queues: count as missing
+        # exactly the requests queued now, the leased ones put back above
+        # included, so their domains can finish
+        queued = self.queued_by_domain()
+        ds = self.ctrl.shared_dom_stats
+        with ds.lock:
+            for dom_tld, missing in list(ds.dom_missing.items()):
+                if missing != queued.get(dom_tld, 0):
+                    ds.dom_missing[dom_tld] = queued.get(dom_tld, 0)
+
+        # 4. Seen filter
+        try:
+            self.ctrl.seen_filter.load(path / manifest['seen'])
+            self.logger.info(f"Loaded seen state with {self.ctrl.seen_filter.bloom_len()} items.")
+        except Exception as e:
+            self.logger.warning(f"Seen filter error, skipping for: {e}")
+
+        return True
+
+
+    def queued_by_domain(self):
+        queued = Counter()
+        tmp = Path(self.conf['path_data']) / 'resume_queued.pkl'
+        for q in (self.ctrl.shared_qin, self.ctrl.shared_qout):
+            q.snapshot(tmp)
+            for chunk in read_snapshot(tmp):
+                queued.update(reqA[2] for reqA in chunk)
+        tmp.unlink(missing_ok=True)
+        return queued
+
 
 class SaveState:
     def __init__(self, conf, controller):
@@ -91,43 +204,92 @@ class SaveState:
             self.logger.error(f"Error saving {suffix}: {e}")
 
     def save_all(self):
+        return self.checkpoint('shutdown')
+
+    def checkpoint(self, reason='periodic'):
+        """
+        Write a checkpoint without pausing the workers: queues are
+        journal-synced or snapshotted without draining them, with the
+        requests leased from them, the seen filter is copied under its
+        lock and written after.
+        The directory only counts once renamed, with manifest.json inside.
+        """
         with self.lock:
-            # 1. Domains
-            finished = self.ctrl.shared_dom_stats.get_finished_domains()
-            self.save_pickle(finished, 'dom_stats_finished')
-
-            # 2. Queues
-            qin_items = []
-            while not self.ctrl.shared_qin.empty():
-                qin_items.append(self.ctrl.shared_qin.get())
-            self.save_pickle(qin_items, 'qin')
-            for itm in qin_items:
-                self.ctrl.shared_qin.put(itm)
-
-            qout_items = []
-            while not self.ctrl.shared_qout.empty():
-                qout_items.append(self.ctrl.shared_qout.get())
-            self.save_pickle(qout_items, 'qout')
-            for itm in qout_items:
-                self.ctrl.shared_qout.put(itm)
-
-            # 3. Seen filter: use .save(path) method directly
-            try:
-                path = self.get_path('seen')
-                self.ctrl.seen_filter.save(path)
-                self.logger.debug(f"Saved seen filter to {path}")
-            except Exception as e:
-                self.logger.warning(f"Could not save seen filter: {e}")
+            t0 = datetime.now()
+            base = checkpoints_dir(self.conf)
+            done = list_checkpoints(self.conf)
+            n = int(done[-1].name[len('ckpt_'):]) + 1 if done else 1
+            tmp = base / f"ckpt_{n:06d}.tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+
+            manifest = {'id': n, 'created': t0.isoformat(), 'reason': reason, 'queues': {}}
 
-            # 5. Domain stats internals
+            queues = (('qin', self.ctrl.shared_qin), ('qout', self.ctrl.shared_qout))
+            # 1. From now on, requests acknowledged (handled, or moved to qin)
+            # stay leased: their seen marks may be newer than the seen filter
+            for _, q in queues:
+                q.hold_acks()
+            journaled = []
             try:
-                ds_data = self.ctrl.shared_dom_stats.serialize()  # assumes method returns dict
-                self.save_pickle(ds_data, 'dom_stats')
-                self.logger.debug(f"Saved ds_data Serialized Stats keys: {ds_data.keys()}")
-            except Exception as e:
-                self.logger.warning(f"Could not serialize domain stats: {e}")
+                # 2. Seen filter, before the queues: a request seen there is in
+                # them, leased from them or handled before the checkpoint
+                manifest['seen'] = 'seen.bloom'
+                self.ctrl.seen_filter.save(tmp / manifest['seen'])
 
-        return True
+                # 3. Queues, with their leased requests
+                for name, q in queues:
+                    upto = q.checkpoint(compact=False, leased=tmp / f"{name}_leased.pkl")
+                    if upto is not None:
+                        manifest['queues'][name] = {'journal': upto, 'leased': f"{name}_leased.pkl"}
+                        journaled.append((name, q, upto))
+                    else:
+                        items = q.snapshot(tmp / f"{name}.pkl")
+                        manifest['queues'][name] = {'file': f"{name}.pkl", 'items': items}
+            finally:
+                for _, q in queues:
+                    q.release_acks()
+
+            # 4. Domains, missing counts are set from the queues on resume
+            ds_data = self.ctrl.shared_dom_stats.serialize()
+            manifest['dom_stats'] = 'dom_stats.pkl'
+            with open(tmp / manifest['dom_stats'], 'wb') as f:
+                pickle.dump(ds_data, f)
+
+            finished = self.ctrl.shared_dom_stats.get_finished_domains()
+            manifest['finished'] = 'finished.pkl'
+            with open(tmp / manifest['finished'], 'wb') as f:
+                pickle.dump(finished, f)
+
+            manifest['domains'] = len(ds_data['dom_missing'])
+            manifest['finished_domains'] = len(finished)
+            if hasattr(self.ctrl.shared_dom_stats, 'events_count'):
+                # Completion events up to here are in this checkpoint
+                manifest['completion_events'] = self.ctrl.shared_dom_stats.events_count()
+            with open(tmp / 'manifest.json', 'w') as f:
+                json.dump(manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+
+            path = base / f"ckpt_{n:06d}"
+            os.replace(tmp, path)
+
+            for old in done[:max(0, len(done) + 1 - self.conf.get('CHECKPOINT_KEEP', 2))]:
+                shutil.rmtree(old, ignore_errors=True)
 
+            # The journals can be compacted now that the checkpoint is complete,
+            # up to the oldest one kept: each can still be resumed from
+            oldest = oldest_journal_marks(self.conf)
+            for name, q, upto in journaled:
+                q.compact_journal(min(upto, oldest.get(name, upto)))
 
+            self.logger.info(f"Checkpoint {path.name} ({reason}) written in "
+                             f"{(datetime.now() - t0).total_seconds():.2f}s")
+        return path
 
+    def clear_checkpoints(self):
+        """A new crawl, not resumed: checkpoints of the previous one no longer apply."""
+        base = checkpoints_dir(self.conf)
+        if base.exists():
+            self.logger.info(f"Removing checkpoints of the previous crawl in {base}")
+            shutil.rmtree(base, ignore_errors=True)
@@ -0,0 +1,63 @@
+import threading
+from types import SimpleNamespace
+
+from ispider_core.crawlers.cls_seen_filter import SeenFilter, drop_seen
+from ispider_core.crawlers.stage_unified_helpers import _canonical_unseen_links
+from ispider_core.utils.canonical import UrlCanonicalizer
+
+
+def test_canonical_rules():
+    canonical = UrlCanonicalizer({}).canonical
+    assert canonical('HTTPS://Example.COM:443/Blog/?b=2&utm_source=x&a=1&fbclid=y#top') == \
+        'https://example.com/Blog?a=1&b=2'
+    assert canonical('https://example.com') == 'https://example.com/'
+    assert canonical('https://example.com/a b') == 'https://example.com/a%20b'
+
+    custom = UrlCanonicalizer({'CANONICAL_STRIP_PARAMS': ['ref'], 'CANONICAL_LOWERCASE_PATH': True,
+                               'CANONICAL_STRIP_TRAILING_SLASH': False}).canonical
+    assert custom('https://example.com/Blog/?ref=1&utm_source=x') == 'https://example.com/blog/?utm_source=x'
+
+    # Scheme and www kept apart unless asked
+    assert canonical('http://www.example.com/a') == 'http://www.example.com/a'
+    folded = UrlCanonicalizer({'CANONICAL_IGNORE_SCHEME': True, 'CANONICAL_STRIP_WWW': True}).canonical
+    assert folded('http://www.example.com:80/a') == folded('https://example.com/a') == '//example.com/a'
+
+
+def test_saved_requests(tmp_path):
+    (tmp_path / 'dumps').mkdir()
+    conf = {'USER_FOLDER': tmp_path, 'LOG_LEVEL': 'INFO', 'path_dumps': tmp_path / 'dumps'}
+    seen = SeenFilter(conf, threading.Lock())
+    seen.mark_seen([('https://example.com/done', 'internal_url', 'example.com', 0, 1, 'httpx'),
+                    ('http://www.example.com/b', 'internal_url', 'example.com', 0, 1, 'httpx')])
+
+    links = ['https://example.com/a?x=1&y=2', 'https://example.com/a?y=2&x=1&utm_medium=m',
+             'https://example.com/done/', 'https://example.com/b', 'https://example.com/b']
+    unseen, saved = _canonical_unseen_links(links, 'example.com', 1, seen, UrlCanonicalizer(conf))
+    assert unseen == ['https://example.com/a?x=1&y=2', 'https://example.com/b']
+    # The reordered /a, and /done/ seen once the slash is ignored; http://www.../b is another url
+    assert saved == 2
+
+    disabled = UrlCanonicalizer({'CANONICAL_URLS': False})
+    assert _canonical_unseen_links(links, 'example.com', 1, None, disabled) == (links, 0)
+
+
+def test_key_only_the_original_url_is_fetched(tmp_path):
+    (tmp_path / 'dumps').mkdir()
+    conf = {'USER_FOLDER': tmp_path, 'LOG_LEVEL': 'INFO', 'path_dumps': tmp_path / 'dumps'}
+    seen = SeenFilter(conf, threading.Lock())
+    canonicalizer = UrlCanonicalizer(conf)
+    fetched = [('https://example.com/a', 'internal_url', 'example.com')]
+    seen.mark_seen(canonicalizer.key_reqs(fetched))
+
+    # Only the tracking variant is saved: /a was seen anyway
+    links = ['https://example.com/a?utm_source=x', 'https://example.com/a', 'https://example.com/blog/?b=1&a=2']
+    assert _canonical_unseen_links(links, 'example.com', 1, seen, canonicalizer) == (
+        ['https://example.com/blog/?b=1&a=2'], 1)
+
+    released = []
+    dom_stats = SimpleNamespace(release=lambda dom_tld, n: released.append((dom_tld, n)))
+    reqsA = [(link, 'internal_url', 'example.com', 0, 1, 'httpx')
+             for link in ('https://example.com/blog/?b=1&a=2', 'https://example.com/blog?a=2&b=1')]
+    assert drop_seen(seen, reqsA, dom_stats, mark=True, canonicalizer=canonicalizer) == reqsA[:1]
+    assert released == [('example.com', 1)]
+    assert seen.req_in_seen(('https://example.com/blog?a=2&b=1', 'internal_url', 'example.com', 0, 1, None))
@@ -0,0 +1,257 @@
+import json
+import logging
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ispider_core.crawlers.cls_domain_stats import SharedDomainStats
+from ispider_core.crawlers.cls_frontier import SpillingFrontier
+from ispider_core.crawlers.cls_queue_transport import BatchQueue, QueueManager, ShmRingQueue, read_snapshot
+from ispider_core.crawlers.cls_seen_filter import SeenFilter, drop_seen
+from ispider_core.utils import state_manager
+
+
+def _req(i, dom='example.com'):
+    return (f"https://{dom}/p/{i}", 'internal_url', dom, 0, 1, 'httpx')
+
+
+def _read(path):
+    return [item for chunk in read_snapshot(path) for item in chunk]
+
+
+def _conf(tmp_path, **extra):
+    (tmp_path / 'dumps').mkdir(exist_ok=True)
+    return {
+        'USER_FOLDER': tmp_path,
+        'LOG_LEVEL': 'INFO',
+        'path_data': tmp_path,
+        'path_dumps': tmp_path / 'dumps',
+        **extra,
+    }
+
+
+def _queue(kind, tmp_path):
+    if kind == 'batch':
+        return BatchQueue()
+    if kind == 'shm':
+        return ShmRingQueue(capacity=64 * 1024)
+    return SpillingFrontier({'path_data': tmp_path, 'FRONTIER_MEMORY_ITEMS': 3, 'FRONTIER_SEGMENT_ITEMS': 2})
+
+
+@pytest.mark.parametrize('kind', ['batch', 'shm', 'frontier'])
+def test_snapshot_does_not_drain(kind, tmp_path):
+    q = _queue(kind, tmp_path)
+    try:
+        q.put_many([_req(i) for i in range(12)])
+        q.get_many(2)
+
+        assert q.snapshot(tmp_path / 'q.pkl') == 10
+        assert _read(tmp_path / 'q.pkl') == [_req(i) for i in range(2, 12)]
+        assert q.qsize() == 10
+        assert q.get_many(20) == [_req(i) for i in range(2, 12)]
+    finally:
+        if kind != 'batch':
+            q.close()
+
+
+@pytest.mark.parametrize('kind', ['batch', 'shm', 'frontier'])
+def test_leased_items_stay_in_snapshots_until_acked(kind, tmp_path):
+    manager = QueueManager()
+    manager.start()
+    if kind == 'shm':
+        q = ShmRingQueue(capacity=64 * 1024, leases=manager.LeaseTable())
+    else:
+        q = _queue(kind, tmp_path)
+    snap = tmp_path / 'q.pkl'
+    try:
+        q.put_many([_req(i) for i in range(4)])
+        taken = q.get_many(3, lease=True)
+        assert q.ack(taken[:1]) == []
+        q.snapshot(snap)
+        assert sorted(_read(snap)) == [_req(i) for i in range(1, 4)]
+
+        # Acknowledged while a checkpoint is written: kept till it ends
+        q.hold_acks()
+        q.ack(taken[1:])
+        assert q.snapshot(snap) == 3
+        q.release_acks()
+        assert q.snapshot(snap) == 1 and _read(snap) == [_req(3)]
+        # Never leased here
+        assert q.ack([_req(9)]) == [_req(9)]
+    finally:
+        if kind != 'batch':
+            q.close()
+        manager.shutdown()
+
+
+def _controller(conf):
+    ctrl = SimpleNamespace(
+        shared_qin=BatchQueue(),
+        shared_qout=BatchQueue(),
+        seen_filter=SeenFilter(conf, threading.Lock(), capacity=1000),
+        shared_dom_stats=SharedDomainStats(SimpleNamespace(dict=dict), logging.getLogger('test'), threading.Lock()),
+        dom_tld_finished=set(),
+    )
+    ctrl.resume_checkpoint, ctrl.resume_manifest = state_manager.latest_checkpoint(conf)
+    return ctrl
+
+
+def test_checkpoint_roundtrip_and_prune(tmp_path):
+    conf = _conf(tmp_path, CHECKPOINT_KEEP=2)
+    ctrl = _controller(conf)
+    save = state_manager.SaveState(conf, ctrl)
+
+    # One a.com request is being fetched, in no queue
+    ctrl.shared_dom_stats.dom_missing.update({'a.com': 4, 'b.com': 0})
+    ctrl.shared_qin.put_many([_req(0, 'a.com')])
+    ctrl.shared_qout.put_many([_req(i, 'a.com') for i in range(1, 3)])
+    ctrl.seen_filter.add_to_seen_req(_req(9, 'a.com'))
+
+    for _ in range(3):
+        path = save.checkpoint()
+    # An interrupted checkpoint is ignored
+    (path.parent / 'ckpt_000004.tmp').mkdir()
+
+    assert [p.name for p in state_manager.list_checkpoints(conf)] == ['ckpt_000002', 'ckpt_000003']
+    assert json.loads((path / 'manifest.json').read_text())['queues']['qout'] == {'file': 'qout.pkl', 'items': 2}
+    # Queues are left as they were
+    assert ctrl.shared_qout.qsize() == 2
+
+    ctrl = _controller({**conf, 'RESUME': True})
+    assert ctrl.resume_checkpoint == path
+    state_manager.ResumeState(conf, ctrl).resume_all()
+
+    assert ctrl.shared_qin.get_many(10) == [_req(0, 'a.com')]
+    assert ctrl.shared_qout.get_many(10) == [_req(1, 'a.com'), _req(2, 'a.com')]
+    assert ctrl.seen_filter.req_in_seen(_req(9, 'a.com'))
+    assert ctrl.shared_dom_stats.dom_missing == {'a.com': 3, 'b.com': 0}
+    assert ctrl.dom_tld_finished == ['b.com']
+
+
+def test_journaled_queue_resumes_at_checkpoint(tmp_path):
+    conf = _conf(tmp_path, RESUME=True)
+    q = BatchQueue(journal_dir=tmp_path / 'journal')
+    q.put_many([_req(i) for i in range(5)])
+    upto = q.checkpoint(compact=False)
+    # Changes after the checkpoint are not part of it
+    q.get_many(2)
+    q.checkpoint(compact=False)
+
+    manifest = {'queues': {'qout': {'journal': upto}}}
+    assert state_manager.journal_resume(conf, manifest, 'qout') == upto
+    assert state_manager.journal_resume(conf, None, 'qout') is True
+    assert state_manager.journal_resume({**conf, 'RESUME': False}, manifest, 'qout') is False
+
+    q = BatchQueue(journal_dir=tmp_path / 'journal', resume=upto)
+    assert q.get_many(10) == [_req(i) for i in range(5)]
+
+
+@pytest.mark.parametrize('journal', [False, True])
+def test_resume_requeues_leased_requests(journal, tmp_path):
+    conf = _conf(tmp_path, FRONTIER_JOURNAL=journal)
+
+    def queues(ctrl, manifest=None):
+        if journal:
+            ctrl.shared_qin, ctrl.shared_qout = (
+                BatchQueue(journal_dir=tmp_path / 'journal' / name,
+                           resume=manifest and state_manager.journal_resume(conf, manifest, name))
+                for name in ('qin', 'qout'))
+        return ctrl
+
+    ctrl = queues(_controller(conf))
+    # Domain stats are written after the queues: a.com/1 fetched meanwhile,
+    # b.com counts a request already gone
+    ctrl.shared_dom_stats.dom_missing.update({'a.com': 2, 'b.com': 1})
+    ctrl.shared_qin.put_many([_req(0, 'a.com'), _req(1, 'a.com')])
+    ctrl.shared_qout.put_many([_req(2, 'a.com')])
+    # A worker fetches a.com/0, a.com/2 waits in the domain scheduler
+    ctrl.shared_qin.get_many(1, lease=True)
+    ctrl.shared_qout.get_many(1, lease=True)
+    path = state_manager.SaveState(conf, ctrl).checkpoint()
+    manifest = json.loads((path / 'manifest.json').read_text())
+
+    conf = {**conf, 'RESUME': True}
+    ctrl = queues(_controller(conf), manifest)
+    state_manager.ResumeState(conf, ctrl).resume_all()
+
+    assert sorted(ctrl.shared_qin.get_many(10)) == [_req(0, 'a.com'), _req(1, 'a.com')]
+    assert ctrl.shared_qout.get_many(10) == [_req(2, 'a.com')]
+    assert ctrl.shared_dom_stats.dom_missing == {'a.com': 3, 'b.com': 0}
+
+
+@pytest.mark.parametrize('journal', [False, True])
+def test_resumed_domains_finish(journal, tmp_path):
+    conf = _conf(tmp_path, FRONTIER_JOURNAL=journal)
+
+    def queues(ctrl, manifest=None):
+        if journal:
+            ctrl.shared_qin, ctrl.shared_qout = (
+                BatchQueue(journal_dir=tmp_path / 'journal' / name,
+                           resume=manifest and state_manager.journal_resume(conf, manifest, name))
+                for name in ('qin', 'qout'))
+        return ctrl
+
+    ctrl = queues(_controller(conf))
+    qin, qout, seen, ds = ctrl.shared_qin, ctrl.shared_qout, ctrl.seen_filter, ctrl.shared_dom_stats
+    ds.dom_missing.update({'a.com': 3, 'b.com': 1, 'c.com': 1})
+    ds.dom_total.update(ds.dom_missing)
+    qin.put_many([_req(0, 'a.com'), _req(1, 'a.com'), _req(0, 'c.com')])
+    qout.put_many([_req(0, 'b.com'), _req(2, 'a.com')])
+    # a.com/1 and c.com/0 being fetched, b.com/0 in the domain scheduler
+    qin.get_many(1)
+    qin.get_many(2, lease=True)
+    qout.get_many(1, lease=True)
+
+    def meanwhile():
+        # b.com/0 released to qin and c.com/0 handled, while the checkpoint is written
+        qin.put_many([_req(0, 'b.com')])
+        seen.mark_seen([_req(0, 'b.com'), _req(0, 'c.com')])
+        qout.ack([_req(0, 'b.com')])
+        ds.reduce_missing('c.com')
+        qin.ack([_req(0, 'c.com')])
+    save_seen = seen.save
+    seen.save = lambda path: (meanwhile(), save_seen(path))
+    path = state_manager.SaveState(conf, ctrl).checkpoint()
+    manifest = json.loads((path / 'manifest.json').read_text())
+
+    conf = {**conf, 'RESUME': True}
+    ctrl = queues(_controller(conf), manifest)
+    state_manager.ResumeState(conf, ctrl).resume_all()
+    qin, qout, ds = ctrl.shared_qin, ctrl.shared_qout, ctrl.shared_dom_stats
+
+    # The crawl goes on: qout released through the seen filter, qin fetched
+    qin.put_many(drop_seen(ctrl.seen_filter, qout.get_many(10), ds, mark=True))
+    for reqA in qin.get_many(10):
+        ds.reduce_missing(reqA[2])
+    assert qin.qsize() == qout.qsize() == 0
+    assert ds.dom_missing == {'a.com': 0, 'b.com': 0, 'c.com': 0}
+
+
+def test_compaction_keeps_the_older_checkpoint_resumable(tmp_path):
+    conf = _conf(tmp_path, CHECKPOINT_KEEP=2)
+
+    def journaled(ctrl, manifest=None):
+        ctrl.shared_qin, ctrl.shared_qout = (
+            BatchQueue(journal_dir=tmp_path / 'journal' / name, compact_min=1,
+                       resume=manifest and state_manager.journal_resume(conf, manifest, name))
+            for name in ('qin', 'qout'))
+        return ctrl
+
+    ctrl = journaled(_controller(conf))
+    save = state_manager.SaveState(conf, ctrl)
+    for i in range(3):
+        ctrl.shared_qout.put_many([_req(10 * i + k) for k in range(5)])
+        ctrl.shared_qout.get_many(4)
+        path = save.checkpoint()
+    assert [p.name for p in state_manager.list_checkpoints(conf)] == ['ckpt_000002', 'ckpt_000003']
+    # The newest is damaged: resumed from the one before
+    (path / 'manifest.json').write_text('{')
+
+    conf = {**conf, 'RESUME': True}
+    ctrl = _controller(conf)
+    assert ctrl.resume_checkpoint.name == 'ckpt_000002'
+    journaled(ctrl, ctrl.resume_manifest)
+    state_manager.ResumeState(conf, ctrl).resume_all()
+    assert ctrl.shared_qout.qsize() == 2
+    assert ctrl.shared_qout.get_many(20) == [_req(13), _req(14)]
@@ -0,0 +1,84 @@
+import logging
+import multiprocessing as mp
+import threading
+from queue import Queue
+
+from ispider_core.crawlers.cls_counters import WorkerCounters, apply_counters, count_response
+from ispider_core.crawlers.cls_domain_stats import ShmDomainStats
+
+
+def _crawl(stats, progress, mod):
+    counters = WorkerCounters(mod, progress, stats, flush_sec=0)
+    for i in range(200):
+        assert stats.filter_and_add_links('a.com', ['x'], max_pages=1000) == ['x']
+        stats.reduce_missing('a.com')
+        count_response('internal_url', counters)
+        counters['tot_counter'] += 1
+        counters['bytes'] += 10
+        if i % 50 == 49:
+            counters.maybe_publish()
+
+
+def test_worker_deltas_merged_by_the_controller():
+    with mp.Manager() as manager:
+        stats = ShmDomainStats(manager, logging.getLogger('test'), manager.Lock(), stripes=4)
+        try:
+            stats.add_domain('a.com')
+            progress = mp.Queue()
+            procs = [mp.Process(target=_crawl, args=(stats, progress, mod)) for mod in range(3)]
+            for p in procs:
+                p.start()
+            reports = [progress.get(timeout=10) for _ in range(12)]
+            for p in procs:
+                p.join()
+
+            script_controller = {'tot_counter': 5}
+            for report in reports:
+                apply_counters(report, script_controller, threading.Lock())
+            assert script_controller['tot_counter'] == 605
+            assert script_controller['internal_urls'] == 600
+            assert script_controller['bytes'] == 6000
+            assert sorted(script_controller['lock_wait']) == [0, 1, 2]
+            assert stats.dom_total['a.com'] == 600 and stats.dom_missing['a.com'] == 0
+        finally:
+            stats.close()
+
+
+def test_publish_sends_nothing_when_idle():
+    progress = Queue()
+    stats = ShmDomainStats.__new__(ShmDomainStats)
+    stats.lock_wait = 0.0
+    counters = WorkerCounters(0, progress, stats)
+    counters.publish()
+    assert progress.empty()
+    count_response('landing_page', counters)
+    count_response('unknown', counters)
+    counters.publish()
+    assert progress.get_nowait() == {'mod': 0, 'counters': {'landings': 1}, 'lock_wait': 0.0}
+    assert counters['landings'] == 0
+
+
+def test_domain_stats_merged_in_the_worker():
+    progress = Queue()
+    stats = ShmDomainStats.__new__(ShmDomainStats)
+    stats.lock_wait = 0.0
+    counters = WorkerCounters(0, progress, stats)
+    for code in (200, 404, 200):
+        stats.qstats.put({"dom_tld": "a.com", "key": "bytes", "value": 10, "op": "sum"})
+        stats.qstats.put({"dom_tld": "a.com", "key": "last_status_code", "value": code, "op": "set"})
+    stats.qstats.put({"dom_tld": "b.com", "key": "has_robot", "value": True, "op": "set"})
+    stats.qstats.put({"dom_tld": "b.com", "key": "has_robot", "value": 1})
+    counters.publish()
+
+    report = progress.get_nowait()
+    assert report['stats'] == [
+        {"dom_tld": "a.com", "key": "bytes", "value": 30, "op": "sum"},
+        {"dom_tld": "a.com", "key": "last_status_code", "value": 200, "op": "set"},
+        {"dom_tld": "b.com", "key": "has_robot", "value": 2, "op": "set"},
+    ]
+    script_controller = {}
+    apply_counters(report, script_controller, threading.Lock())
+    assert script_controller['stats_puts'] == 8 and script_controller['stats_items'] == 3
+    assert 0 <= script_controller['stats_lag'] < 5
+    counters.publish()
+    assert progress.empty()
@@ -0,0 +1,110 @@
+import threading
+from types import SimpleNamespace
+
+from ispider_core.crawlers.cls_domain_scheduler import DomainScheduler
+from ispider_core.crawlers.cls_queue_transport import BatchQueue
+from ispider_core.crawlers.cls_seen_filter import SeenFilter
+from ispider_core.crawlers.thread_queue_in import release_unseen
+from ispider_core.utils.priorities import RequestPriority
+
+
+def _req(dom, i):
+    return (f"https://{dom}/{i}", 'internal_url', dom, 0, 1, 'httpx')
+
+
+def test_releases_one_request_per_domain_per_delay():
+    sched = DomainScheduler(min_delay=1.0)
+    for i in range(3):
+        sched.push(_req('a.com', i))
+    sched.push(_req('b.com', 0))
+
+    first = sched.pop_ready(10, now=100.0)
+    assert sorted(r[2] for r in first) == ['a.com', 'b.com']
+    assert sched.pop_ready(10, now=100.5) == []
+    assert sched.next_eligible_in(now=100.5) == 0.5
+
+    assert sched.pop_ready(10, now=101.0) == [_req('a.com', 1)]
+    assert sched.pop_ready(10, now=102.0) == [_req('a.com', 2)]
+    assert len(sched) == 0
+    assert sched.next_eligible_in() is None
+
+
+def test_delay_survives_empty_domain_queue():
+    sched = DomainScheduler(min_delay=1.0)
+    sched.push(_req('a.com', 0))
+    assert len(sched.pop_ready(10, now=10.0)) == 1
+
+    # New request for the same domain must still wait for the delay
+    sched.push(_req('a.com', 1))
+    assert sched.pop_ready(10, now=10.2) == []
+    assert sched.pop_ready(10, now=11.0) == [_req('a.com', 1)]
+
+
+def test_limit_and_drain():
+    sched = DomainScheduler(min_delay=0)
+    for d in range(5):
+        sched.push(_req(f"d{d}.com", 0))
+    assert len(sched.pop_ready(2, now=0)) == 2
+    assert len(sched.drain()) == 3
+    assert len(sched) == 0
+    assert sched.stats()['released'] == 2
+
+
+def test_skipped_requests_do_not_use_the_domain_slot():
+    sched = DomainScheduler(min_delay=1.0)
+    sched.push(_req('a.com', 'dup'))
+    sched.push(_req('a.com', 'dup'))
+    sched.push(_req('a.com', 1))
+
+    out = sched.pop_ready(10, now=0, skip=lambda r: r[0].endswith('dup'))
+    assert out == [_req('a.com', 1)]
+    assert len(sched) == 0
+    assert sched.stats()['skipped'] == 2
+
+
+def test_priority_orders_requests_inside_a_domain():
+    sched = DomainScheduler(min_delay=1.0, priority=RequestPriority(['robots', 'internal_url']))
+    sched.push(_req('a.com', 0))
+    sched.push(('https://a.com/robots.txt', 'robots', 'a.com', 0, 0, 'httpx'))
+    sched.push(_req('a.com', 1))
+
+    assert sched.pop_ready(10, now=100.0)[0][1] == 'robots'
+    assert sched.pop_ready(10, now=101.0) == [_req('a.com', 0)]
+    assert sched.drain() == [_req('a.com', 1)]
+
+
+def test_domain_cap_leaves_room_for_other_domains():
+    sched = DomainScheduler(min_delay=1.0, max_per_domain=2)
+    big = [_req('big.com', i) for i in range(5)]
+    assert sched.push_many(big + [_req('a.com', 0)]) == big[2:]
+    assert sched.stats()['domains'] == 2 and sched.stats()['deferred'] == 3
+
+    assert sorted(r[2] for r in sched.pop_ready(10, now=100.0)) == ['a.com', 'big.com']
+    # One request of big.com left: room for one more
+    assert sched.push_many(big[2:]) == big[3:]
+    assert sched.pop_ready(10, now=101.0) == [big[1]]
+    assert sched.pop_ready(10, now=102.0) == [big[2]]
+
+
+def test_copies_released_in_the_same_batch_reach_qin_once(tmp_path):
+    (tmp_path / 'dumps').mkdir()
+    seen = SeenFilter({'USER_FOLDER': tmp_path, 'LOG_LEVEL': 'INFO', 'path_dumps': tmp_path / 'dumps'},
+                      threading.Lock())
+    released = []
+    dom_stats = SimpleNamespace(release=lambda dom_tld, n: released.append((dom_tld, n)))
+
+    # No delay: both copies are ready at once
+    sched = DomainScheduler(min_delay=0)
+    qin, qout = BatchQueue(), BatchQueue()
+    qout.put_many([_req('a.com', 1), _req('a.com', 1), _req('a.com', 2)])
+    sched.push_many(qout.get_many(10, lease=True))
+    ready, _ = release_unseen(sched, 10, seen, dom_stats, qin, qout)
+    assert ready == [_req('a.com', 1), _req('a.com', 2)]
+    assert qin.get_many(10) == ready
+    assert released == [('a.com', 1)]
+    # In qin: no longer leased from qout
+    assert qout.snapshot(tmp_path / 'qout.pkl') == 0
+
+    # Marked on release: a later copy is dropped too
+    sched.push(_req('a.com', 2))
+    assert release_unseen(sched, 10, seen, dom_stats, qin, qout) == ([], 0)
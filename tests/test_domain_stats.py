@@ -0,0 +1,347 @@
+import logging
+import multiprocessing as mp
+
+import pytest
+
+from ispider_core.crawlers.cls_domain_archive import DomainArchive
+from ispider_core.crawlers.cls_domain_stats import SharedDomainStats, ShmDomainStats
+from ispider_core.utils.interning import RequestCodec
+
+
+class SmallChunks(ShmDomainStats):
+    CHUNK = 4
+    EVENT_CHUNK = 8
+    TOP = 2
+
+
+@pytest.fixture
+def manager():
+    with mp.Manager() as m:
+        yield m
+
+
+@pytest.fixture
+def stats(manager):
+    s = SmallChunks(manager, logging.getLogger('test'), manager.Lock(), stripes=3)
+    yield s
+    s.close()
+
+
+def _fill(stats):
+    for i in range(10):
+        stats.add_domain(f"d{i}.com")
+        stats.filter_and_add_links(f"d{i}.com", ['a', 'b', 'c'], max_pages=2 + i)
+    stats.reduce_missing('d0.com')
+    stats.reduce_missing('d0.com')
+
+
+def test_same_api_as_manager_dicts(manager, stats):
+    plain = SharedDomainStats(manager, logging.getLogger('test'), manager.Lock())
+    for s in (plain, stats):
+        _fill(s)
+        s.register_redirect('d1.com', 'd9.com')
+    for s in (plain, stats):
+        assert 'd1.com' not in s.dom_missing and s.dom_missing['d9.com'] == 3 + 3
+        assert s.get_tot_domains() == 9
+        assert sorted(s.get_finished_domains()) == ['d0.com']
+        assert s.count_by(lambda v: v > 0) == 8
+        assert s.is_domain_finished('d0.com') and not s.is_domain_finished('d2.com')
+    assert stats.get_sorted_missing() == plain.get_sorted_missing()
+    assert dict(stats.dom_total) == dict(plain.dom_total)
+    assert stats.serialize() == plain.serialize()
+
+    # Dict views, as SaveState and the API server use them
+    stats.dom_missing['d2.com'] = 0
+    stats.dom_missing['new.com'] = 7
+    assert stats.dom_total['new.com'] == 0 and stats.dom_last_call['new.com'] is None
+    del stats.dom_missing['new.com']
+    assert 'new.com' not in stats.dom_total
+
+
+def test_restore(manager, stats):
+    _fill(stats)
+    stats.set_last_call('d3.com')
+    state = stats.serialize()
+
+    other = ShmDomainStats(manager, logging.getLogger('test'), manager.Lock())
+    try:
+        other.add_domain('gone.com')
+        other.restore(state)
+        assert other.serialize() == state
+        assert other.dom_last_call['d3.com'] is not None
+    finally:
+        other.close()
+
+
+def _hammer(stats, n):
+    for i in range(n):
+        stats.add_missing_total(f"d{i % 10}.com")
+        stats.reduce_missing(f"d{(i + 3) % 10}.com")
+
+
+def test_updates_from_other_processes(stats):
+    _fill(stats)
+    before = dict(stats.dom_missing)
+    procs = [mp.Process(target=_hammer, args=(stats, 1000)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    # Every domain got as many increments as decrements
+    assert dict(stats.dom_missing) == before
+    assert sum(stats.dom_total.values()) == sum(min(3, 2 + i) for i in range(10)) + 4000
+
+
+def _codec_intern(stats):
+    # A ring put in another process, with a domain no stats call added
+    RequestCodec(stats.domain_ids).dumps(('https://far.com/', 'internal_url', 'far.com', 0, 1, 'httpx'))
+
+
+def test_ids_interned_past_the_chunks(stats):
+    for i in range(4):
+        stats.add_domain(f"d{i}.com")
+    # First id of the next chunk, taken without the stats
+    p = mp.Process(target=_codec_intern, args=(stats,))
+    p.start()
+    p.join()
+    assert stats.domain_ids.get('far.com') == 4 and stats._published_chunks() == 1
+
+    assert 'far.com' not in stats.dom_missing and len(dict(stats.dom_missing)) == 4
+    assert stats.get_tot_domains() == 4 and stats.count_by(lambda v: v == 0) == 4
+    stats.add_domain('d4.com')
+    stats.reserve('d4.com', 3)
+    assert stats.dom_missing['d4.com'] == 3 and stats._published_chunks() == 2
+
+
+def _scan_finished(stats):
+    return sorted(k for k, v in stats.dom_missing.items() if v == 0 and stats.dom_total[k] > 0)
+
+
+def test_finished_tracked_from_completion_events(manager, stats):
+    _fill(stats)
+    stats.add_domain('idle.com')
+    procs = [mp.Process(target=_hammer, args=(stats, 500)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    # Read while the other processes write
+    stats.get_finished_domains()
+    for p in procs:
+        p.join()
+    for dom in ('d4.com', 'd5.com'):
+        while stats.dom_missing[dom]:
+            stats.reduce_missing(dom)
+    stats.register_redirect('d4.com', 'd5.com')
+
+    assert sorted(stats.get_finished_domains()) == sorted(_scan_finished(stats) + ['d4.com'])
+    assert sorted(stats.get_unfinished_domains()) == sorted(k for k, v in stats.dom_missing.items() if v > 0)
+    assert stats.count_finished() == len(_scan_finished(stats))
+
+    events, pos = stats.events()
+    assert pos == stats.events_count() == len(events)
+    assert [e[1:] for e in events if e[1] == 'd4.com'][-2:] == [('d4.com', 'redirected', 'd5.com'), ('d4.com', 'idle', None)]
+    assert stats.events(pos - 2, limit=1)[1] == pos - 1
+
+    # Another process reading the stream from the start
+    state = stats.serialize()
+    other = SmallChunks(manager, logging.getLogger('test'), manager.Lock())
+    try:
+        other.add_domain('gone.com')
+        other.add_missing_total('gone.com')
+        other.restore(state)
+        assert 'gone.com' not in other.get_unfinished_domains()
+        assert sorted(other.get_finished_domains()) == sorted(stats.get_finished_domains())
+    finally:
+        other.close()
+
+
+def test_backlog_summary(manager, stats):
+    _fill(stats)
+    procs = [mp.Process(target=_hammer, args=(stats, 300)) for _ in range(2)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    stats.filter_and_add_links('d3.com', [str(i) for i in range(40)], max_pages=100)
+    stats.filter_and_add_links('d6.com', [str(i) for i in range(20)], max_pages=100)
+
+    summary = stats.backlog_summary(k=2)
+    assert summary['top'] == [('d3.com', stats.dom_missing['d3.com']), ('d6.com', stats.dom_missing['d6.com'])]
+    assert summary == SharedDomainStats.backlog_summary(stats, k=2)
+
+    # Finished and redirected domains leave the table, values stay live
+    while stats.dom_missing['d6.com']:
+        stats.reduce_missing('d6.com')
+    stats.register_redirect('d3.com', 'd6.com')
+    stats.reduce_missing('d5.com')
+    top = stats.backlog_summary()['top']
+    assert top and all(v == stats.dom_missing[dom] > 0 for dom, v in top)
+    assert 'd3.com' not in dict(top)
+    assert stats.backlog_summary()['histogram'] == SharedDomainStats.backlog_summary(stats)['histogram']
+
+
+def test_backlog_summary_brings_back_domains_left_out(manager):
+    stats = SmallChunks(manager, logging.getLogger('test'), manager.Lock(), stripes=1)
+    try:
+        for dom, n in (('d2.com', 8), ('d0.com', 10), ('d1.com', 9), ('d3.com', 1)):
+            stats.reserve(dom, n)
+        # d2.com evicted from the table of 2, then both of its domains fall below it
+        for _ in range(6):
+            stats.reduce_missing('d0.com')
+            stats.reduce_missing('d1.com')
+        assert stats.backlog_summary()['top'] == [('d2.com', 8), ('d0.com', 4)]
+
+        stats.release('d2.com', 8)
+        assert stats.backlog_summary()['top'] == [('d0.com', 4), ('d1.com', 3)]
+        # The rebuilt table goes on streaming
+        stats.reserve('d3.com', 9)
+        assert stats.backlog_summary()['top'] == [('d3.com', 10), ('d0.com', 4)]
+        assert stats.backlog_summary() == SharedDomainStats.backlog_summary(stats, k=2)
+    finally:
+        stats.close()
+
+
+def _reserve_release(stats, seed, out, max_pages):
+    import random
+    rnd = random.Random(seed)
+    net, over = {}, 0
+    for _ in range(400):
+        dom = f"d{rnd.randrange(3)}.com"
+        links = stats.filter_and_add_links(dom, ['x'] * rnd.randint(1, 6), max_pages)
+        over += stats.dom_total[dom] > max_pages
+        net[dom] = net.get(dom, 0) + len(links)
+        if links and rnd.random() < 0.5:
+            n = rnd.randint(1, len(links))
+            stats.release(dom, n)
+            net[dom] -= n
+    out.put((net, over))
+
+
+@pytest.mark.parametrize('cls', [SharedDomainStats, SmallChunks])
+def test_page_budget_never_overshoots(manager, cls):
+    stats = cls(manager, logging.getLogger('test'), manager.Lock())
+    try:
+        # The domains are added by the first reserve, from any process
+        out = mp.Queue()
+        procs = [mp.Process(target=_reserve_release, args=(stats, seed, out, 25)) for seed in range(6)]
+        for p in procs:
+            p.start()
+        results = [out.get(timeout=60) for _ in procs]
+        for p in procs:
+            p.join()
+
+        assert sum(over for _, over in results) == 0
+        for i in range(3):
+            dom = f"d{i}.com"
+            # Every reserved page is accounted for
+            assert stats.dom_total[dom] == stats.dom_missing[dom] == sum(net.get(dom, 0) for net, _ in results)
+            assert 0 < stats.dom_total[dom] <= 25
+        left = 25 - stats.dom_total['d0.com']
+        assert stats.reserve('d0.com', 100, 25) == left and stats.reserve('d0.com', 1, 25) == 0
+        assert stats.reserve('d0.com', 2) == 2 and stats.dom_total['d0.com'] == 27
+    finally:
+        if cls is SmallChunks:
+            stats.close()
+
+
+def _revive(stats):
+    # Another process taking a domain back from the archive
+    stats.reserve('d1.com', 5, 6)
+
+
+def _reserve_new(stats, out):
+    for i in range(100):
+        stats.reserve(f"w{i}.com", 1)
+    stats.add_domain('w100.com')
+    out.put(len(stats.local_stats))
+
+
+def test_workers_keep_no_local_stats(manager, stats):
+    _fill(stats)
+    out = mp.Queue()
+    p = mp.Process(target=_reserve_new, args=(stats, out))
+    p.start()
+    assert out.get(timeout=30) == 10
+    p.join()
+    # Counted in the shm record, local_stats left to the controller
+    assert stats.dom_total['w99.com'] == 1 and 'w100.com' in stats.dom_missing
+    assert 'w99.com' not in stats.local_stats
+
+
+@pytest.mark.parametrize('cls', [SharedDomainStats, SmallChunks])
+def test_finished_domains_archived(manager, cls, tmp_path):
+    stats = cls(manager, logging.getLogger('test'), manager.Lock(), manager.Queue())
+    stats.archive = DomainArchive(tmp_path / 'archive.sqlite')
+    try:
+        _fill(stats)
+        for dom in ('d1.com', 'd2.com'):
+            while stats.dom_missing[dom]:
+                stats.reduce_missing(dom)
+        stats.register_redirect('old.com', 'd2.com')
+        stats.apply_stats([{"dom_tld": f"d{i}.com", "key": "bytes", "value": 10 * i} for i in range(10)])
+        stats.dom_engine['d1.com'] = 'httpx'
+        before = stats.serialize()
+        finished = sorted(stats.get_finished_domains())
+
+        # Moved when found finished by two passes in a row
+        assert stats.archive_finished() == 0
+        assert stats.archive_finished() == 3 and len(stats.archive) == 3
+        assert 'd1.com' not in stats.local_stats and 'd1.com' not in stats.dom_engine
+        if cls is SharedDomainStats:
+            assert 'd1.com' not in stats.dom_missing
+        assert stats.serialize() == before
+        assert sorted(stats.get_finished_domains()) == finished == ['d0.com', 'd1.com', 'd2.com', 'old.com']
+        assert stats.count_finished() == 3 and stats.get_tot_domains() == 10
+        assert stats.is_domain_finished('old.com')
+        rows = dict(stats.domain_rows())
+        assert len(rows) == 10 and rows['d1.com']['local_stats'] == {'bytes': 10}
+        assert rows['d1.com']['engine'] == 'httpx' and rows['d1.com']['total'] == 3
+
+        # Taken back when counted again
+        p = mp.Process(target=_revive, args=(stats,))
+        p.start()
+        p.join()
+        stats.flush_qstats()
+        stats.apply_stats([{"dom_tld": dom, "key": "bytes", "value": 1} for dom in ('d1.com', 'd2.com')])
+        assert stats.dom_total['d1.com'] == 6 and stats.dom_missing['d1.com'] == 3
+        assert stats.local_stats['d1.com'] == {'bytes': 11} and stats.local_stats['d2.com'] == {'bytes': 21}
+        assert stats.dom_engine['d1.com'] == 'httpx' and len(stats.archive) == 1
+    finally:
+        stats.archive.close()
+        if cls is SmallChunks:
+            stats.close()
+
+
+@pytest.mark.parametrize('cls', [SharedDomainStats, SmallChunks])
+def test_archived_domain_live_again_on_reserve(manager, cls, tmp_path):
+    stats = cls(manager, logging.getLogger('test'), manager.Lock())
+    stats.archive = DomainArchive(tmp_path / 'archive.sqlite')
+    try:
+        _fill(stats)
+        for dom in ('d1.com', 'd2.com'):
+            while stats.dom_missing[dom]:
+                stats.reduce_missing(dom)
+        stats.apply_stats([{"dom_tld": "d1.com", "key": "bytes", "value": 10}])
+        stats.dom_engine['d1.com'] = 'httpx'
+        assert stats.archive_finished() == 0
+
+        # Redirected away between the two passes: left out, no error
+        stats.register_redirect('d2.com', 'd9.com')
+        if cls is SmallChunks:
+            # Also when redirected after being listed
+            assert stats._archive(['d2.com']) == 0
+        assert stats.archive_finished() == 2
+        assert 'd1.com' in stats.archive
+
+        # The first reserve takes it back, without a stats pass
+        assert stats.reserve('d1.com', 2) == 2
+        assert 'd1.com' not in stats.archive
+        assert stats.dom_engine['d1.com'] == 'httpx'
+        assert stats.local_stats['d1.com'] == {'bytes': 10}
+        row = dict(stats.domain_rows())['d1.com']
+        assert row['missing'] == 2 and row['total'] == 5 and row['engine'] == 'httpx'
+        stats.dom_engine['d1.com'] = 'curl'
+        assert dict(stats.domain_rows())['d1.com']['engine'] == 'curl'
+    finally:
+        stats.archive.close()
+        if cls is SmallChunks:
+            stats.close()
@@ -0,0 +1,85 @@
+from queue import Empty
+
+import pytest
+
+from ispider_core.crawlers.cls_frontier import SpillingFrontier
+
+
+def _req(i):
+    return (f"https://example.com/p/{i}", 'internal_url', 'example.com', 0, 1, 'httpx')
+
+
+def _frontier(tmp_path, memory_items=10, segment_items=4):
+    return SpillingFrontier({
+        'path_data': tmp_path,
+        'FRONTIER_MEMORY_ITEMS': memory_items,
+        'FRONTIER_SEGMENT_ITEMS': segment_items,
+    })
+
+
+def test_spills_past_threshold_and_keeps_fifo(tmp_path):
+    q = _frontier(tmp_path)
+    for i in range(55):
+        q.put(_req(i))
+
+    st = q.stats()
+    assert st['memory'] == 10
+    assert st['disk'] == 45
+    assert q.qsize() == 55
+
+    got = [q.get_nowait() for _ in range(55)]
+    assert got == [_req(i) for i in range(55)]
+    assert q.empty()
+    assert list((tmp_path / 'frontier').rglob('*.pkl')) == []
+    with pytest.raises(Empty):
+        q.get_nowait()
+
+
+def test_interleaved_put_get_while_spilled(tmp_path):
+    q = _frontier(tmp_path, memory_items=3, segment_items=2)
+    expected = []
+    got = []
+    n = 0
+    for _ in range(20):
+        for _ in range(3):
+            q.put(_req(n))
+            expected.append(_req(n))
+            n += 1
+        got.append(q.get(timeout=1))
+    while not q.empty():
+        got.append(q.get_nowait())
+    assert got == expected
+    q.close()
+
+
+def test_priority_lanes_serve_discovery_first(tmp_path):
+    q = SpillingFrontier({
+        'path_data': tmp_path,
+        'FRONTIER_MEMORY_ITEMS': 2,
+        'FRONTIER_SEGMENT_ITEMS': 2,
+        'QUEUE_PRIORITIES': ['robots', 'sitemap', 'internal_url'],
+    })
+    deep = [(f"https://example.com/d/{i}", 'internal_url', 'example.com', 0, 3, 'httpx') for i in range(3)]
+    shallow = [_req(i) for i in range(3)]
+    robots = ('https://example.com/robots.txt', 'robots', 'example.com', 0, 0, 'httpx')
+    q.put_many(deep + shallow + [robots])
+
+    assert q.backlog() == {'robots:d0': 1, 'internal_url:d1': 3, 'internal_url:d3': 3}
+    assert q.get_many(10) == [robots] + shallow + deep
+    q.close()
+
+
+def test_spill_directory_per_frontier(tmp_path):
+    a, b = _frontier(tmp_path, memory_items=1), _frontier(tmp_path, memory_items=1)
+    a.put_many([_req(i) for i in range(5)])
+    b.put_many([_req(i) for i in range(5)])
+    assert a.spill_dir != b.spill_dir and a.spill_dir.parent == tmp_path / 'frontier'
+
+    # A new frontier, e.g. a resumed crawl, leaves the others' segments alone
+    c = _frontier(tmp_path, memory_items=1)
+    a.close()
+    assert not a.spill_dir.exists()
+    assert b.get_many(10) == [_req(i) for i in range(5)]
+    b.close()
+    c.close()
+    assert list((tmp_path / 'frontier').iterdir()) == []
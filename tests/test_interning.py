@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing as mp
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+from ispider_core.crawlers.cls_queue_transport import ShmRingQueue
+from ispider_core.utils.interning import InternTable, RequestCodec, intern_request
+
+
+@pytest.fixture
+def manager():
+    with mp.Manager() as m:
+        yield m
+
+
+def _req(i, dom='example.com'):
+    return (f"https://{dom}/p/{i}", 'internal_url', dom, 0, 1, 'httpx')
+
+
+def _intern(table, names, out):
+    out.put(table.intern_many(names))
+
+
+def test_codec_round_trip_and_fallback(manager):
+    codec = RequestCodec(InternTable(manager))
+    items = [
+        _req(1), ('https://b.org', 'landing_page', 'b.org', 2, 0, None),
+        ('https://ü.de/é', 'sitemap', 'ü.de', 0, 3, 'seleniumbase'),
+        ('https://c.com', 'other', 'c.com', 0, 0, None),  # unknown discriminator
+        ('https://c.com', 'internal_url', 'c.com', 0, -1, None),
+        {'dom_tld': 'c.com'},
+    ]
+    assert [codec.loads(codec.dumps(item)) for item in items] == items
+    assert len(codec.dumps(_req(1))) < len(pickle.dumps(_req(1), protocol=pickle.HIGHEST_PROTOCOL)) * 0.6
+
+
+def test_table_shared_across_processes(manager):
+    table = InternTable(manager)
+    assert table.intern('a.com') == 0
+    out = mp.Queue()
+    procs = [mp.Process(target=_intern, args=(table, [f"d{i}.com" for i in range(k, k + 30)], out))
+             for k in (0, 10)]
+    for p in procs:
+        p.start()
+    got = [out.get(timeout=10) for _ in procs]
+    for p in procs:
+        p.join()
+
+    assert len(table) == 41
+    ids = dict(zip([f"d{i}.com" for i in range(40)], got[0] + got[1][20:]))
+    assert sorted(ids.values()) == list(range(1, 41))
+    assert all(table.get(name) == i and table.name(i) == name for name, i in ids.items())
+    assert table.names() == ['a.com'] + sorted(ids, key=ids.get)
+
+
+def test_shm_ring_with_codec(manager):
+    codec = RequestCodec(InternTable(manager))
+    q = ShmRingQueue(capacity=1024, codec=codec)
+    try:
+        for rnd in range(10):
+            q.put_many([_req(i, f"d{i % 3}.com") for i in range(rnd, rnd + 5)])
+            assert q.get_many(5) == [_req(i, f"d{i % 3}.com") for i in range(rnd, rnd + 5)]
+        assert len(codec.domains) == 3
+    finally:
+        q.close()
+
+
+def test_intern_request_shares_strings():
+    a = intern_request(_req(1, ''.join(['exa', 'mple.com'])))
+    b = intern_request(_req(2, ''.join(['examp', 'le.com'])))
+    assert a[2] is b[2] and a[1] is b[1]
+    assert intern_request({'x': 1}) == {'x': 1}
+
+
+def test_ids_api_pages_the_domain_table(manager, monkeypatch):
+    from ispider_core import api_server
+
+    table = InternTable(manager)
+    table.intern_many(['a.com', 'b.com', 'c.com'])
+    monkeypatch.setattr(api_server, 'spider_instance', SimpleNamespace(shared_dom_stats=SimpleNamespace(domain_ids=table)))
+
+    out = asyncio.run(api_server.get_ids(start=1, limit=10))
+    assert out['domains'] == [{'id': 1, 'domain': 'b.com'}, {'id': 2, 'domain': 'c.com'}]
+    assert out['next'] == 3 and out['discriminators'][0] == 'landing_page'
+    assert asyncio.run(api_server.get_ids(start=3))['domains'] == []
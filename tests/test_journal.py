@@ -0,0 +1,114 @@
+import random
+from collections import deque
+
+import pytest
+
+from ispider_core.crawlers.cls_frontier import SpillingFrontier
+from ispider_core.crawlers.cls_journal import FrontierJournal
+from ispider_core.crawlers.cls_queue_transport import BatchQueue
+
+
+def _req(i, rd='internal_url', depth=1):
+    return (f"https://example.com/p/{i}", rd, 'example.com', 0, depth, 'httpx')
+
+
+def _content(lanes):
+    return {level: list(lane) for level, lane in lanes.items() if lane}
+
+
+def test_replay_matches_queue_across_checkpoints_and_compaction(tmp_path):
+    random.seed(7)
+    journal = FrontierJournal(tmp_path, compact_min=50)
+    journal.reset()
+    model = {}
+    n = 0
+    for step in range(3000):
+        level = random.choice([0, 1, 5])
+        if random.random() < 0.6 or not model.get(level):
+            journal.put(level, _req(n))
+            model.setdefault(level, deque()).append(_req(n))
+            n += 1
+        else:
+            journal.got(level)
+            model[level].popleft()
+
+        if step % 400 == 399:
+            upto = journal.checkpoint()
+            if journal.needs_compaction(sum(len(l) for l in model.values())):
+                closed = journal.closed_entries
+                journal.compact(upto)
+                journal.compacted(closed)
+
+    journal.checkpoint()
+    assert _content(journal.replay()) == _content(model)
+    # Compacted at least once, older snapshots removed
+    assert [p.name for p in tmp_path.glob('snap_*.log')] != ['snap_00000001.log']
+    assert len(list(tmp_path.glob('snap_*.log'))) == 1
+
+
+def test_truncated_tail_is_ignored(tmp_path):
+    journal = FrontierJournal(tmp_path)
+    journal.reset()
+    journal.put(0, _req(1))
+    journal.checkpoint()
+    journal.put(0, _req(2))
+    journal.checkpoint()
+
+    last = sorted(tmp_path.glob('seg_*.log'))[-1]
+    last.write_bytes(last.read_bytes()[:-3])
+    assert _content(journal.replay()) == {0: [_req(1)]}
+
+
+def test_crash_while_restarting_keeps_the_journal(tmp_path, monkeypatch):
+    journal = FrontierJournal(tmp_path)
+    journal.reset()
+    journal.put(0, _req(1))
+    journal.put(0, _req(2))
+    journal.got(0)
+    upto = journal.checkpoint()
+    journal.put(0, _req(3))
+    journal.checkpoint()
+
+    # Resumed up to the checkpoint, crash before the new snapshot is in place
+    def crash(src, dst):
+        raise OSError('crash')
+    monkeypatch.setattr('ispider_core.crawlers.cls_journal.os.replace', crash)
+    with pytest.raises(OSError):
+        FrontierJournal(tmp_path).reset({0: [_req(2)]}, upto)
+    monkeypatch.undo()
+
+    assert _content(FrontierJournal(tmp_path).replay(upto)) == {0: [_req(2)]}
+    journal = FrontierJournal(tmp_path)
+    journal.reset({0: [_req(2)]}, upto)
+    assert _content(journal.replay()) == {0: [_req(2)]}
+    assert [p.name for p in tmp_path.iterdir()] == [f"snap_{upto:08d}.log"]
+
+
+def test_batch_queue_resumes_from_journal(tmp_path):
+    q = BatchQueue(priorities=['robots', 'internal_url'], journal_dir=tmp_path)
+    robots = _req(0, rd='robots', depth=0)
+    q.put_many([_req(i) for i in range(1, 6)] + [robots])
+    assert q.get_many(3) == [robots, _req(1), _req(2)]
+    assert q.checkpoint()
+
+    q = BatchQueue(priorities=['robots', 'internal_url'], journal_dir=tmp_path, resume=True)
+    assert q.get_many(10) == [_req(3), _req(4), _req(5)]
+    assert not BatchQueue().checkpoint()
+
+
+def test_frontier_resumes_from_journal(tmp_path):
+    conf = {
+        'path_data': tmp_path,
+        'FRONTIER_MEMORY_ITEMS': 3,
+        'FRONTIER_SEGMENT_ITEMS': 2,
+        'FRONTIER_JOURNAL': True,
+    }
+    q = SpillingFrontier(conf)
+    q.put_many([_req(i) for i in range(10)])
+    q.get_many(4)
+    q.checkpoint()
+    q.close()
+
+    q = SpillingFrontier({**conf, 'RESUME': True})
+    assert q.get_many(20) == [_req(i) for i in range(4, 10)]
+    q.close()
@@ -0,0 +1,195 @@
+import multiprocessing as mp
+import threading
+import time
+from queue import Empty, Full
+
+import pytest
+
+from ispider_core.crawlers.cls_queue_transport import BatchQueue, QueueManager, ShmRingQueue, build_queue
+
+
+def _req(i):
+    return (f"https://example.com/p/{i}", 'internal_url', 'example.com', 0, 1, 'httpx')
+
+
+def _produce(q, n):
+    for i in range(n):
+        q.put(_req(i))
+
+
+def test_shm_ring_fifo_and_wraparound():
+    q = ShmRingQueue(capacity=512)
+    try:
+        for rnd in range(20):
+            for i in range(3):
+                q.put(_req(rnd * 3 + i))
+            assert q.qsize() == 3
+            for i in range(3):
+                assert q.get(timeout=1) == _req(rnd * 3 + i)
+        assert q.empty()
+    finally:
+        q.close()
+
+
+def test_shm_ring_maxsize_and_nowait():
+    q = ShmRingQueue(maxsize=2, capacity=4096)
+    try:
+        q.put_nowait(_req(1))
+        q.put_nowait(_req(2))
+        assert q.full()
+        with pytest.raises(Full):
+            q.put_nowait(_req(3))
+        with pytest.raises(Full):
+            q.put(_req(3), timeout=0.05)
+        q.get_nowait()
+        q.get_nowait()
+        with pytest.raises(Empty):
+            q.get(timeout=0.05)
+    finally:
+        q.close()
+
+
+def test_shm_ring_across_processes():
+    q = ShmRingQueue(capacity=64 * 1024)
+    try:
+        procs = [mp.Process(target=_produce, args=(q, 500)) for _ in range(3)]
+        for p in procs:
+            p.start()
+        got = [q.get(timeout=5) for _ in range(1500)]
+        for p in procs:
+            p.join()
+        assert len(got) == 1500
+        assert q.empty()
+    finally:
+        q.close()
+
+
+def test_build_queue_rejects_unknown_transport():
+    with pytest.raises(ValueError):
+        build_queue({'QUEUE_TRANSPORT': 'zmq'}, None)
+
+
+def test_shm_ring_put_many_get_many():
+    q = ShmRingQueue(capacity=2048)
+    try:
+        q.put_many([_req(i) for i in range(5)])
+        assert q.get_many(3) == [_req(i) for i in range(3)]
+        assert q.get_many(10) == [_req(3), _req(4)]
+        with pytest.raises(Empty):
+            q.get_many(10, block=False)
+    finally:
+        q.close()
+
+
+def test_batch_queue_get_many_returns_what_is_ready():
+    q = BatchQueue()
+    q.put_many([_req(i) for i in range(4)])
+    assert q.get_many(10, timeout=1) == [_req(i) for i in range(4)]
+    with pytest.raises(Empty):
+        q.get_many(10, timeout=0.01)
+
+
+def test_manager_served_batch_queue():
+    manager = QueueManager()
+    manager.start()
+    try:
+        q = build_queue({'QUEUE_TRANSPORT': 'manager'}, manager, maxsize=100)
+        q.put_many([_req(i) for i in range(10)])
+        assert q.qsize() == 10
+        assert q.get_many(6) == [_req(i) for i in range(6)]
+    finally:
+        manager.shutdown()
+
+
+def test_batch_queue_priorities():
+    q = BatchQueue(priorities=['landing_page', 'internal_url'])
+    landing = ('https://example.com', 'landing_page', 'example.com', 0, 0, 'httpx')
+    q.put_many([_req(0), _req(1), landing])
+    assert q.backlog() == {'landing_page:d0': 1, 'internal_url:d1': 2}
+    assert q.get_many(10) == [landing, _req(0), _req(1)]
+
+
+def _drain_later(q, n, delay):
+    time.sleep(delay)
+    q.get_many(n)
+
+
+@pytest.mark.parametrize('make', [BatchQueue, lambda: ShmRingQueue(capacity=4096)])
+def test_wait_below_wakes_when_drained(make):
+    q = make()
+    try:
+        assert q.put_many([_req(i) for i in range(4)]) >= 0
+        assert q.wait_below(2, timeout=0.05) == 4
+
+        t = threading.Thread(target=_drain_later, args=(q, 3, 0.1))
+        t.start()
+        t0 = time.monotonic()
+        assert q.wait_below(2, timeout=5) == 1
+        assert time.monotonic() - t0 < 2
+        t.join()
+
+        q.get()
+        time.sleep(0.05)
+        assert q.put_many([_req(9)]) >= 0.05
+        assert q.put_many([_req(10)]) == 0
+    finally:
+        if isinstance(q, ShmRingQueue):
+            q.close()
+
+
+def test_shm_ring_put_many_is_all_or_nothing():
+    q = ShmRingQueue(maxsize=4, capacity=4096)
+    try:
+        q.put_many([_req(i) for i in range(3)])
+        with pytest.raises(Full):
+            q.put_many([_req(3), _req(4)], block=False)
+        assert q.qsize() == 3
+        with pytest.raises(ValueError):
+            q.put_many([_req(i) for i in range(5)])
+        assert q.get_many(10) == [_req(i) for i in range(3)]
+    finally:
+        q.close()
+
+
+def test_shm_ring_with_overflow_keeps_fifo_order():
+    manager = QueueManager()
+    manager.start()
+    q = ShmRingQueue(maxsize=2, capacity=4096, overflow=manager.BatchQueue())
+    try:
+        for i in range(4):
+            q.put(_req(i))
+        assert q.get_many(1) == [_req(0)]
+        # Room in the ring again, but 2 and 3 are still spilled: 4 goes after them
+        q.put(_req(4))
+        got = []
+        while len(got) < 4:
+            got += q.get_many(1)
+        assert got == [_req(i) for i in range(1, 5)]
+        # Overflow drained: back to the ring
+        q.put_many([_req(5), _req(6)])
+        assert q.overflow.qsize() == 0 and q.get_many(10) == [_req(5), _req(6)]
+    finally:
+        q.close()
+        manager.shutdown()
+
+
+def test_shm_ring_spills_to_overflow_when_full(tmp_path):
+    manager = QueueManager()
+    manager.start()
+    q = ShmRingQueue(maxsize=2, capacity=4096, overflow=manager.BatchQueue())
+    try:
+        q.put_many([_req(0), _req(1)])
+        # Full ring: neither blocks nor raises
+        q.put_many([_req(2), _req(3)])
+        q.put(_req(4), timeout=0.01)
+        assert q.qsize() == 5
+        assert q.snapshot(tmp_path / 'q.pkl') == 5
+
+        got = q.get_many(10) + q.get_many(10)
+        assert got == [_req(i) for i in range(5)]
+        assert q.empty()
+        with pytest.raises(Empty):
+            q.get_many(10, timeout=0.01)
+    finally:
+        q.close()
+        manager.shutdown()
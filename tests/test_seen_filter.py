@@ -0,0 +1,242 @@
+import multiprocessing as mp
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ispider_core.crawlers.cls_seen_filter import (
+    ExactSeenFilter, PartitionedSeenFilter, SeenFilter, SharedExactSeenFilter,
+    SharedPartitionedSeenFilter, SharedSeenFilter, drop_seen)
+
+
+def _req(i):
+    return (f"https://example.com/p/{i}", 'internal_url', 'example.com', 0, 1, 'httpx')
+
+
+@pytest.fixture
+def conf(tmp_path):
+    (tmp_path / 'dumps').mkdir()
+    return {'USER_FOLDER': tmp_path, 'LOG_LEVEL': 'INFO', 'path_dumps': tmp_path / 'dumps'}
+
+
+def _add(seen_filter, start, n):
+    for i in range(start, start + n):
+        seen_filter.add_to_seen_req(_req(i))
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_bits_set_by_other_processes_are_seen(conf, method):
+    ctx = mp.get_context(method)
+    seen = SharedSeenFilter(conf, ctx.Lock(), capacity=10_000)
+    try:
+        procs = [ctx.Process(target=_add, args=(seen, k * 100, 150)) for k in range(3)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+        assert all(seen.req_in_seen(_req(i)) for i in range(350))
+        assert not seen.req_in_seen(_req(1000))
+        # Overlapping adds are counted once
+        assert seen.bloom_len() == 350
+    finally:
+        seen.close()
+
+
+def test_files_interchangeable_with_seen_filter(conf, tmp_path):
+    seen = SharedSeenFilter(conf, capacity=1000)
+    _add(seen, 0, 10)
+    seen.save(tmp_path / 'shared.bloom')
+
+    plain = SeenFilter(conf, threading.Lock(), capacity=1000)
+    plain.load(tmp_path / 'shared.bloom')
+    assert plain.req_in_seen(_req(9)) and plain.bloom_len() == 10
+    _add(plain, 10, 5)
+    plain.save(tmp_path / 'plain.bloom')
+
+    seen.load(tmp_path / 'plain.bloom')
+    assert seen.req_in_seen(_req(14)) and seen.bloom_len() == 15
+
+    # Another geometry replaces the segment
+    big = SeenFilter(conf, threading.Lock(), capacity=5000)
+    _add(big, 100, 3)
+    big.save(tmp_path / 'big.bloom')
+    seen.load(tmp_path / 'big.bloom')
+    assert seen.req_in_seen(_req(102)) and not seen.req_in_seen(_req(14))
+    assert seen.capacity == 5000
+    seen.close()
+
+    # pybloom files of older versions are refused, not misread
+    (tmp_path / 'old.bloom').write_bytes(b'\x00' * 64)
+    with pytest.raises(ValueError):
+        plain.load(tmp_path / 'old.bloom')
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_batch_api(conf, shared):
+    seen = SharedSeenFilter(conf, capacity=1000) if shared else SeenFilter(conf, threading.Lock(), capacity=1000)
+    seen.mark_seen([_req(i) for i in range(0, 10, 2)])
+
+    retry = _req(2)[:3] + (1,) + _req(2)[4:]
+    robots = ('https://example.com/robots.txt', 'robots', 'example.com', 0, 1, 'httpx')
+    reqs = [_req(i) for i in range(10)] + [retry, robots]
+    # Retries and other discriminators are never filtered
+    assert seen.filter_unseen(reqs) == [_req(i) for i in range(1, 10, 2)] + [retry, robots]
+    assert seen.bloom_len() == 5
+
+    released = []
+    dom_stats = SimpleNamespace(release=lambda dom_tld, n: released.append((dom_tld, n)))
+    kept = drop_seen(seen, [_req(1), _req(2), _req(1), _req(3)], dom_stats, mark=True)
+    assert kept == [_req(1), _req(3)]
+    # The seen one and the duplicate
+    assert released == [('example.com', 2)]
+    assert seen.req_in_seen(_req(3)) and seen.bloom_len() == 7
+    if shared:
+        seen.close()
+
+
+def test_grows_beyond_capacity(conf, tmp_path):
+    seen = SeenFilter(conf, threading.Lock(), capacity=100, error_rate=0.01)
+    seen.mark_seen([_req(i) for i in range(1000)])
+
+    stats = seen.stats()
+    # 100 + 200 + 400 + 800
+    assert stats['stages'] == 4 and stats['capacity'] == 1500
+    assert stats['items'] == seen.bloom_len() == 1000
+    assert stats['fill_ratio'] == pytest.approx(1000 / 1500, abs=1e-3)
+    assert stats['fp_rate'] < 0.01
+    assert all(seen.req_in_seen(_req(i)) for i in range(1000))
+    false_positives = sum(seen.req_in_seen(_req(i)) for i in range(10_000, 20_000))
+    assert false_positives < 2 * 0.01 * 10_000
+
+    seen.save(tmp_path / 'grown.bloom')
+    shared = SharedSeenFilter(conf, capacity=100, error_rate=0.01)
+    try:
+        shared.load(tmp_path / 'grown.bloom')
+        assert shared.stats() == stats
+        assert all(shared.req_in_seen(_req(i)) for i in range(1000))
+    finally:
+        shared.close()
+
+
+def test_stages_added_by_other_processes_are_seen(conf):
+    ctx = mp.get_context('spawn')
+    # Low error rate: no false positive to miscount the adds
+    seen = SharedSeenFilter(conf, ctx.Lock(), capacity=50, error_rate=1e-6)
+    try:
+        p = ctx.Process(target=_add, args=(seen, 0, 400))
+        p.start()
+        p.join()
+
+        assert seen.stats()['stages'] == 4
+        assert all(seen.req_in_seen(_req(i)) for i in range(400))
+        _add(seen, 400, 400)
+        assert seen.bloom_len() == 800 and seen.stats()['stages'] == 5
+    finally:
+        seen.close()
+
+
+def _exact(conf, tmp_path, shared, memory_items=100):
+    conf = {**conf, 'path_data': tmp_path}
+    if shared:
+        return SharedExactSeenFilter(conf, memory_items=memory_items)
+    return ExactSeenFilter(conf, threading.Lock(), memory_items=memory_items)
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_exact_backend_spills_to_sorted_runs(conf, tmp_path, shared):
+    seen = _exact(conf, tmp_path, shared)
+    try:
+        for start in range(0, 1000, 37):
+            seen.mark_seen([_req(i) for i in range(start, min(1000, start + 37))])
+        seen.mark_seen([_req(i) for i in range(500)])
+
+        # 9 table flushes merged down to runs of 800 and 100, the last 100 in the table
+        assert [len(run) for run in seen.runs] == [800, 100]
+        stats = seen.stats()
+        assert stats['items'] == seen.bloom_len() == 1000 and stats['fp_rate'] == 0
+        assert all(seen.req_in_seen(_req(i)) for i in range(1000))
+        assert not any(seen.req_in_seen(_req(i)) for i in range(1000, 5000))
+        assert seen.filter_unseen([_req(i) for i in range(995, 1005)]) == [_req(i) for i in range(1000, 1005)]
+
+        seen.save(tmp_path / 'exact.seen')
+        other = _exact(conf, tmp_path, False)
+        other.load(tmp_path / 'exact.seen')
+        assert other.bloom_len() == 1000 and all(other.req_in_seen(_req(i)) for i in range(1000))
+        # Not interchangeable with Bloom filter files
+        with pytest.raises(ValueError):
+            SeenFilter(conf, threading.Lock()).load(tmp_path / 'exact.seen')
+    finally:
+        if shared:
+            seen.close()
+
+
+def test_exact_runs_written_by_other_processes_are_seen(conf, tmp_path):
+    ctx = mp.get_context('spawn')
+    seen = SharedExactSeenFilter({**conf, 'path_data': tmp_path}, ctx.Lock(), memory_items=50)
+    try:
+        p = ctx.Process(target=_add, args=(seen, 0, 400))
+        p.start()
+        p.join()
+
+        assert seen.bloom_len() == 400 and len(seen.runs) >= 1
+        _add(seen, 300, 200)
+        assert seen.bloom_len() == 500
+        assert all(seen.req_in_seen(_req(i)) for i in range(500))
+    finally:
+        seen.close()
+    assert not any((tmp_path / 'seen_exact').iterdir())
+
+
+def _dom_req(d, i):
+    return (f"https://d{d}.com/p/{i}", 'internal_url', f"d{d}.com", 0, 1, 'httpx')
+
+
+def _add_domains(seen_filter, doms, n):
+    seen_filter.mark_seen([_dom_req(d, i) for d in doms for i in range(n)])
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_partitions_released_and_reused(conf, tmp_path, shared):
+    conf = {**conf, 'SEEN_PARTITION_CAPACITY': 100}
+    seen = SharedPartitionedSeenFilter(conf) if shared else PartitionedSeenFilter(conf, threading.Lock())
+    try:
+        rows = PartitionedSeenFilter.ARENA_ROWS
+        _add_domains(seen, range(rows), 20)
+        assert seen.bloom_len() == rows * 20 and len(seen.arenas) == 1
+        assert seen.filter_unseen([_dom_req(0, i) for i in range(25)]) == [_dom_req(0, i) for i in range(20, 25)]
+
+        assert seen.release([f"d{d}.com" for d in range(rows // 2)] + ['unknown.com']) == rows // 2
+        assert seen.bloom_len() == rows // 2 * 20
+        assert not seen.req_in_seen(_dom_req(0, 1)) and seen.req_in_seen(_dom_req(rows - 1, 1))
+
+        # New domains take the released rows
+        _add_domains(seen, range(1000, 1000 + rows // 2), 20)
+        assert len(seen.arenas) == 1 and seen.stats()['partitions'] == rows
+
+        seen.save(tmp_path / 'seen.bin')
+        other = PartitionedSeenFilter(conf, threading.Lock())
+        other.load(tmp_path / 'seen.bin')
+        assert other.bloom_len() == rows * 20
+        assert other.req_in_seen(_dom_req(1000, 3)) and not other.req_in_seen(_dom_req(0, 3))
+    finally:
+        if shared:
+            seen.close()
+
+
+def test_partitions_added_by_other_processes_are_seen(conf):
+    ctx = mp.get_context('spawn')
+    conf = {**conf, 'SEEN_PARTITION_CAPACITY': 100}
+    seen = SharedPartitionedSeenFilter(conf, ctx.Lock())
+    try:
+        # More domains than an arena: the directory is rebuilt in the child
+        p = ctx.Process(target=_add_domains, args=(seen, range(300), 10))
+        p.start()
+        p.join()
+
+        assert seen.bloom_len() == 3000 and len(seen.arenas) == 2
+        assert all(seen.req_in_seen(_dom_req(d, 9)) for d in range(300))
+        assert seen.release(['d7.com']) == 1
+        assert not seen.req_in_seen(_dom_req(7, 9))
+    finally:
+        seen.close()
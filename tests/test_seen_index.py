@@ -0,0 +1,84 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ispider_core.crawlers.cls_seen_filter import PartitionedSeenFilter, SeenFilter, SharedSeenFilter, drop_seen
+from ispider_core.utils import seen_index
+from ispider_core.utils.canonical import UrlCanonicalizer
+
+
+def _req(i):
+    return (f"https://example.com/p/{i}", 'internal_url', 'example.com', 0, 1, 'httpx')
+
+
+@pytest.fixture
+def conf(tmp_path):
+    (tmp_path / 'dumps').mkdir()
+    (tmp_path / 'jsons').mkdir()
+    return {'USER_FOLDER': tmp_path, 'LOG_LEVEL': 'INFO',
+            'path_dumps': tmp_path / 'dumps', 'path_jsons': tmp_path / 'jsons'}
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_next_run_starts_with_the_index(conf, shared):
+    seen_index.append(conf, [_req(i) for i in range(5)])
+    seen_index.append(conf, [_req(i) for i in range(5, 8)])
+    # Crash in the middle of a record
+    path, = seen_index.index_dir(conf).glob('*.idx')
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+
+    assert sum(len(fps) for fps in seen_index.load(conf)) == 8
+    seen = SharedSeenFilter(conf) if shared else SeenFilter(conf, threading.Lock())
+    try:
+        assert seen.bloom_len() == 8
+        assert all(seen.req_in_seen(_req(i)) for i in range(8))
+        assert not seen.req_in_seen(_req(8))
+    finally:
+        if shared:
+            seen.close()
+
+
+def test_partitions_load_the_crawled_domains_only(conf):
+    other = ('https://other.com/p/1', 'internal_url', 'other.com', 0, 1, 'httpx')
+    seen_index.append(conf, [_req(1), _req(2), other])
+
+    seen = PartitionedSeenFilter({**conf, 'domains': ['https://example.com']}, threading.Lock())
+    assert seen.bloom_len() == 2
+    assert seen.req_in_seen(_req(2)) and not seen.req_in_seen(other)
+
+
+def test_rebuild_from_metadata(conf):
+    seen_index.append(conf, [('https://example.com/gone', 'internal_url', 'example.com')])
+    lines = [
+        {'url': _req(1)[0], 'dom_tld': 'example.com', 'is_downloaded': True},
+        {'url': _req(2)[0], 'dom_tld': 'example.com', 'is_downloaded': False},
+        {'url': _req(1)[0], 'dom_tld': 'example.com', 'is_downloaded': True},
+    ]
+    with open(conf['path_jsons'] / 'unified_conn_meta.0.json', 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line) + '\n')
+        f.write('{"truncated')
+
+    assert seen_index.rebuild(conf) == 1
+    seen = SeenFilter(conf, threading.Lock())
+    assert seen.req_in_seen(_req(1)) and not seen.req_in_seen(_req(2))
+    assert seen.bloom_len() == 1
+
+
+def test_rebuilt_index_keyed_like_the_crawl(conf):
+    with open(conf['path_jsons'] / 'unified_conn_meta.0.json', 'w') as f:
+        f.write(json.dumps({'url': 'https://Example.com/blog/?b=2&utm_source=x&a=1',
+                            'dom_tld': 'example.com', 'is_downloaded': True}) + '\n')
+    assert seen_index.rebuild(conf) == 1
+
+    seen = SeenFilter(conf, threading.Lock())
+    reqsA = [(url, 'internal_url', 'example.com', 0, 1, 'httpx')
+             for url in ('https://example.com/blog?a=1&b=2', 'http://example.com/blog?a=1&b=2')]
+    released = []
+    dom_stats = SimpleNamespace(release=lambda dom_tld, n: released.append((dom_tld, n)))
+    # Seen under its canonical form; another scheme is another url
+    assert drop_seen(seen, reqsA, dom_stats, canonicalizer=UrlCanonicalizer(conf)) == reqsA[1:]
+    assert released == [('example.com', 1)]
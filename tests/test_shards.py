@@ -0,0 +1,147 @@
+import logging
+import threading
+from queue import Queue
+
+from ispider_core.crawlers.cls_domain_stats import SharedDomainStats
+from ispider_core.crawlers.cls_shards import (
+    Shard, ShardRouter, _LocalManager, apply_report, inbox_requests, shard_of)
+from ispider_core.utils import queues, seen_index
+
+
+def _req(dom, i, rd='internal_url'):
+    return (f"https://{dom}/{i}", rd, dom, 0, 1, 'httpx')
+
+
+def _shard(tmp_path, seed=None, mod=0, router=None):
+    conf = {
+        'USER_FOLDER': tmp_path,
+        'LOG_LEVEL': 'INFO',
+        'path_data': tmp_path,
+        'path_dumps': tmp_path / 'dumps',
+        'QUEUE_MAX_SIZE': 1000,
+        'DELAY_DOMAIN_SEC': 0,
+    }
+    return Shard(mod, conf, logging.getLogger('test'), seed, router=router)
+
+
+def _owned_by(mod, shards, n=1):
+    doms = (f"dom{i}.com" for i in range(1000))
+    return [d for d in doms if shard_of(d, shards) == mod][:n]
+
+
+def test_router_sends_each_domain_to_one_shard():
+    inboxes = [Queue() for _ in range(3)]
+    router = ShardRouter(inboxes)
+    doms = [f"dom{i}.com" for i in range(30)]
+    router.put_many([_req(d, i) for d in doms for i in range(2)])
+    router.put(_req('dom0.com', 9))
+
+    for i, inbox in enumerate(inboxes):
+        while not inbox.empty():
+            assert all(shard_of(reqA[2], 3) == i for reqA in inbox.get())
+    assert len({shard_of(d, 3) for d in doms}) == 3
+
+
+def test_shard_local_crawl_state_and_report(tmp_path):
+    shard = _shard(tmp_path, seed={'a.com': (1, 1)})
+    shard.receive([_req('a.com', 0, rd='landing_page'), _req('b.com', 0)])
+
+    assert len(shard.next_requests(10, exclusion_list=set())) == 2
+    shard.dom_stats.reduce_missing('a.com')
+    shard.dom_stats.reduce_missing('b.com')
+
+    # A link to an url already fetched is dropped by the shard seen filter
+    shard.dom_stats.add_missing_total('b.com')
+    shard.frontier.put(_req('b.com', 0))
+    assert shard.next_requests(10, exclusion_list=set()) == []
+    shard.add_counters({'tot_counter': 1, 'landings': 1})
+    report = shard.report()
+    assert report['dom_missing'][0] == {'a.com': 0, 'b.com': 0}
+    assert report['counters']['tot_counter'] == 1
+    assert shard.report()['dom_missing'] == ({}, [])
+    shard.close()
+
+
+def test_apply_report_merges_into_controller_state(tmp_path):
+    shard = _shard(tmp_path)
+    shard.receive([_req('a.com', 0)])
+    shard.dom_stats.qstats.put({'dom_tld': 'a.com', 'key': 'bytes', 'value': 10, 'op': 'sum'})
+    shard.add_counters({'tot_counter': 3, 'bytes': 10})
+
+    dom_stats = SharedDomainStats(_LocalManager(), logging.getLogger('test'), threading.Lock())
+    script_controller = {'tot_counter': 2}
+    apply_report(shard.report(), dom_stats, script_controller, threading.Lock())
+
+    assert dom_stats.dom_missing == {'a.com': 1}
+    assert dom_stats.local_stats['a.com'] == {'bytes': 10}
+    assert script_controller['tot_counter'] == 5
+    assert script_controller['bytes'] == 10
+    shard.close()
+
+
+def test_duplicates_released_together_are_fetched_once(tmp_path):
+    shard = _shard(tmp_path, seed={'a.com': (2, 2)})
+    shard.frontier.put_many([_req('a.com', 0), _req('a.com', 0)])
+    assert shard.next_requests(10, exclusion_list=set()) == [_req('a.com', 0)]
+    assert shard.dom_stats.dom_missing['a.com'] == 1
+    shard.close()
+
+
+def test_seen_requests_do_not_use_the_release_limit(tmp_path):
+    shard = _shard(tmp_path, seed={'a.com': (8, 8)})
+    shard.seen_filter.mark_seen([_req('a.com', i) for i in range(6)])
+    # Seen after being queued: only dropped when released
+    for i in range(8):
+        shard.scheduler.push(_req('a.com', i))
+    assert shard.next_requests(2, exclusion_list=set()) == [_req('a.com', 6), _req('a.com', 7)]
+    assert shard.dom_stats.dom_missing['a.com'] == 2
+    shard.close()
+
+
+def test_redirect_to_another_shard_handed_to_its_owner(tmp_path):
+    inboxes = [Queue(), Queue()]
+    router = ShardRouter(inboxes)
+    (orig,), (final,) = _owned_by(0, 2), _owned_by(1, 2)
+    shards = [_shard(tmp_path / str(mod), seed, mod, router)
+              for mod, seed in ((0, {orig: (1, 1)}), (1, {final: (1, 1)}))]
+
+    # Landing of orig redirected to final, as manage_resps handles it
+    stats = shards[0].dom_stats
+    stats.register_redirect(orig, final)
+    links = stats.filter_and_add_links(final, [f"https://{final}/a", f"https://{final}/b"], 10)
+    qbuf = queues.PutBuffer(shards[0])
+    qbuf.put_many([(link, 'internal_url', final, 0, 1, 'httpx') for link in links])
+    stats.reduce_missing(final)
+    qbuf.flush()
+    shards[0].hand_off()
+
+    report = shards[0].report()
+    assert report['dom_missing'] == ({}, [orig]) and report['dom_total'] == ({}, [orig])
+    assert report['dom_redirects'][0] == {orig: final}
+    assert len(shards[0]) == 0 and inboxes[0].empty()
+
+    # The owner adds them to the crawl of its own final
+    shards[1].pull_inbox(inboxes[1])
+    assert shards[1].report()['dom_missing'][0] == {final: 1 + 2}
+    assert shards[1].dom_stats.dom_total[final] == 1 + 3
+    assert sorted(reqA[0] for reqA in shards[1].next_requests(10, exclusion_list=set())) == sorted(links)
+
+    # Left in an inbox when the shards are gone: counters go to the controller
+    router.hand_off('late.com', 1, 2, [_req('late.com', 0)])
+    dom_stats = SharedDomainStats(_LocalManager(), logging.getLogger('test'), threading.Lock())
+    assert inbox_requests(inboxes[shard_of('late.com', 2)].get(), dom_stats, threading.Lock()) == [_req('late.com', 0)]
+    assert dom_stats.dom_missing == {'late.com': 1} and dom_stats.dom_total == {'late.com': 2}
+    for shard in shards:
+        shard.close()
+
+
+def test_shard_loads_its_part_of_the_seen_index(tmp_path):
+    doms = _owned_by(0, 2, 3) + _owned_by(1, 2, 2)
+    seen_index.append({'path_dumps': tmp_path / 'dumps'}, [_req(d, i) for d in doms for i in range(2)])
+
+    shards = [_shard(tmp_path, mod=mod, router=ShardRouter([Queue(), Queue()])) for mod in range(2)]
+    assert [shard.seen_filter.bloom_len() for shard in shards] == [3 * 2, 2 * 2]
+    assert shards[0].seen_filter.req_in_seen(_req(doms[0], 1))
+    assert not shards[1].seen_filter.req_in_seen(_req(doms[0], 1))
+    for shard in shards:
+        shard.close()